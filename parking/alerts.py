@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from parking.models import ParkingAlert, ParkingArchive, ParkingModels, ParkingScanState
+
+ALERT_FIELDS = ("id", "kind", "session_id", "plate", "detected_at",
+                "lot_id", "arrival_time", "paid")
+INSERT_BATCH_SIZE = 1000
+
+
+def thresholds():
+    return {
+        ParkingAlert.OVERSTAY: timedelta(
+            hours=getattr(settings, "PARKING_OVERSTAY_HOURS", 24)),
+        ParkingAlert.PAID_NOT_LEFT: timedelta(
+            minutes=getattr(settings, "PARKING_PAID_EXIT_MINUTES", 30)),
+    }
+
+
+def crossed(kind, db):
+    # Open sessions by the time their clock for the alert started, read
+    # through the partial indexes parking_open_arrival_idx and
+    # parking_paid_open_idx.
+    sessions = ParkingModels.objects.using(db).filter(departure_time=None)
+    if kind == ParkingAlert.OVERSTAY:
+        return sessions, "arrival_time"
+    return sessions.filter(paid=True), "updated_at"
+
+
+def scan(kind, threshold, db="default", rescan=False):
+    """
+    Flags the open sessions that crossed the threshold since the previous
+    scan, whose cutoff is kept as the watermark of the kind, and returns the
+    number of sessions flagged. A scan only reads the sessions between the two
+    cutoffs, rescan=True reads all of them (e.g. for the sessions synced late
+    by the edge nodes).
+    """
+    cutoff = datetime.now() - threshold
+    with transaction.atomic(using=db):
+        state, _ = ParkingScanState.objects.using(db).select_for_update() \
+            .get_or_create(name=kind)
+        sessions, field = crossed(kind, db)
+        sessions = sessions.filter(**{field + "__lte": cutoff})
+        if state.watermark is not None and not rescan:
+            sessions = sessions.filter(**{field + "__gt": state.watermark})
+        alerts = [ParkingAlert(session_id=id, kind=kind, plate=plate, lot_id=lot_id,
+                               arrival_time=arrival_time)
+                  for id, plate, lot_id, arrival_time in sessions.order_by(field)
+                  .values_list("id", "plate", "lot_id", "arrival_time")]
+        ParkingAlert.objects.using(db).bulk_create(
+            alerts, batch_size=INSERT_BATCH_SIZE, ignore_conflicts=True)
+        if state.watermark is None or cutoff > state.watermark:
+            state.watermark = cutoff
+            state.save(using=db, update_fields=["watermark"])
+    return len(alerts)
+
+
+def alert_rows(alerts):
+    # ALERT_FIELDS tuples. "paid" is the session's current one, read from
+    # the archive once the session is archived: a session__ lookup would
+    # INNER JOIN the sessions and drop these alerts.
+    def paid(model):
+        return Subquery(model.objects.filter(id=OuterRef("session_id")).values("paid")[:1])
+    return alerts.annotate(paid=Coalesce(paid(ParkingModels), paid(ParkingArchive))) \
+        .values_list(*ALERT_FIELDS)
+
+
+def represent_alerts(rows):
+    return [{
+        "id": id,
+        "kind": kind,
+        "session": session,
+        "plate": plate,
+        "detected_at": detected_at,
+        "lot": lot,
+        "arrival_time": arrival_time,
+        "paid": paid,
+    } for id, kind, session, plate, detected_at, lot, arrival_time, paid in rows]
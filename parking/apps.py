@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ParkingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parking'
+
+    def ready(self):
+        from parking import cache, events, fuzzy, lots, occupancy, outbox, rollups, \
+            signals  # noqa: F401
@@ -0,0 +1,90 @@
+import queue
+import threading
+
+
+def get_redis(url):
+    # redis is an optional dependency, only needed when a shared backend is
+    # configured.
+    import redis
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the subset of the Redis API used by the parking
+    app, for tests and single-process deployments.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def hget(self, name, key):
+        with self._lock:
+            return self._data.get(name, {}).get(key)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            h = self._data.setdefault(name, {})
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = len(set(items) - set(h))
+            h.update((k, str(v)) for k, v in items.items())
+            return added
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            h = self._data.get(name, {})
+            return sum(h.pop(k, None) is not None for k in keys)
+
+    def hlen(self, name):
+        with self._lock:
+            return len(self._data.get(name, {}))
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(n, None) is not None for n in names)
+
+    def rename(self, src, dst):
+        with self._lock:
+            if src not in self._data:
+                raise KeyError(src)
+            self._data[dst] = self._data.pop(src)
+            return True
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.messages.put({"type": "message", "channel": channel, "data": message})
+        return len(subscribers)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.messages = queue.Queue()
+
+    def subscribe(self, *channels):
+        with self.redis._lock:
+            for channel in channels:
+                self.redis._channels.setdefault(channel, set()).add(self)
+
+    def unsubscribe(self, *channels):
+        with self.redis._lock:
+            for channel in channels:
+                self.redis._channels.get(channel, set()).discard(self)
+
+    def listen(self):
+        while True:
+            yield self.messages.get()
+
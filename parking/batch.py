@@ -0,0 +1,260 @@
+from datetime import datetime
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Q, Value, When
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from parking.models import ParkingModels, ERR_ALREADY_LEFT, \
+    ERR_DEPARTURE_NOT_PAID, ERR_DUPLICATED_NO_FINISHED, ERR_NO_OPEN_SESSION
+from parking.serializer import ParkingEdgeEventSerializer, ParkingEventSerializer, \
+    ParkingSerializer
+from parking.signals import sessions_changed
+
+MAX_BATCH_SIZE = 1000
+ERR_NOT_FOUND = "Not found."
+
+
+class ConcurrentWrite(APIException):
+    # Not a 4xx: idempotent retries of the batch must run again.
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "A session of this batch was written concurrently, retry."
+
+
+def error(code, field, message):
+    return {"status": code, "errors": {field: [message]}}
+
+
+def apply_events(queryset, items):
+    """
+    Applies a batch of arrival/payment/departure events in order and returns
+    one result per item. The number of queries doesn't depend on the size of
+    the batch: one SELECT loads every session the batch refers to, then there
+    is one UPDATE for the payments, one for the departures and one INSERT.
+    """
+    results = [None] * len(items)
+    events = []
+    for index, item in enumerate(items):
+        serializer = ParkingEventSerializer(data=item)
+        if serializer.is_valid():
+            events.append((index, serializer.validated_data))
+        else:
+            results[index] = {"status": status.HTTP_400_BAD_REQUEST,
+                              "errors": serializer.errors}
+
+    plates = {e["plate"] for _, e in events if e["event"] == "arrival"}
+    ids = {e["id"] for _, e in events if e["event"] != "arrival"}
+    sessions = {}
+    open_plates = set()
+    if events:
+        for obj in queryset.filter(Q(plate__in=plates, departure_time=None) |
+                                   Q(pk__in=ids)):
+            sessions[obj.id] = obj
+            if obj.departure_time is None:
+                open_plates.add(obj.plate)
+
+    # The events are applied in memory first, so a payment followed by the
+    # departure of the same session in one batch behaves as two requests.
+    now = datetime.now()
+    arrivals, paid, closed = {}, {}, {}
+    for index, event in events:
+        if event["event"] == "arrival":
+            if event["plate"] in open_plates:
+                results[index] = error(status.HTTP_400_BAD_REQUEST, "plate",
+                                       ERR_DUPLICATED_NO_FINISHED)
+                continue
+            open_plates.add(event["plate"])
+            arrivals[index] = ParkingModels(plate=event["plate"])
+            continue
+        obj = sessions.get(event["id"])
+        if obj is None:
+            results[index] = error(status.HTTP_404_NOT_FOUND, "id", ERR_NOT_FOUND)
+        elif obj.departure_time is not None:
+            results[index] = error(status.HTTP_400_BAD_REQUEST, "departure_time",
+                                   ERR_ALREADY_LEFT)
+        elif event["event"] == "payment":
+            obj.paid = True
+            paid[index] = obj
+        elif not obj.paid:
+            results[index] = error(status.HTTP_400_BAD_REQUEST, "paid",
+                                   ERR_DEPARTURE_NOT_PAID)
+        else:
+            obj.departure_time = now
+            open_plates.discard(obj.plate)
+            closed[index] = obj
+
+    with transaction.atomic():
+        # Guarded updates: a session closed by a concurrent request since it
+        # was read is reported as already left instead of being overwritten.
+        for changes, event, guard, values in (
+                (paid, "payment", Q(departure_time=None),
+                 dict(paid=True, updated_at=now)),
+                (closed, "departure", Q(paid=True, departure_time=None),
+                 dict(departure_time=now, updated_at=now))):
+            if not changes:
+                continue
+            updated = {obj.id: obj for obj in queryset
+                       .filter(guard, pk__in={o.id for o in changes.values()})
+                       .update_returning(**values)}
+            if updated:
+                sessions_changed.send(sender=queryset.model,
+                                      sessions=list(updated.values()), event=event)
+            for index, obj in changes.items():
+                if obj.id in updated:
+                    results[index] = {"status": status.HTTP_202_ACCEPTED,
+                                      "obj": updated[obj.id]}
+                else:
+                    results[index] = error(status.HTTP_400_BAD_REQUEST,
+                                           "departure_time", ERR_ALREADY_LEFT)
+        create_arrivals(queryset, arrivals, results)
+
+    return represent_results(results)
+
+
+def represent_results(results):
+    serializer = ParkingSerializer()
+    for result in results:
+        obj = result.pop("obj", None)
+        if obj is not None:
+            result["data"] = serializer.to_representation(obj)
+    return results
+
+
+def create_arrivals(queryset, arrivals, results):
+    if not arrivals:
+        return
+    try:
+        with transaction.atomic():
+            created = queryset.bulk_create(arrivals.values())
+    except IntegrityError:
+        # A concurrent request opened a session for one of the plates: insert
+        # one by one so only the conflicting arrivals fail.
+        for index, obj in arrivals.items():
+            obj.pk = None
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+            except IntegrityError:
+                results[index] = error(status.HTTP_400_BAD_REQUEST, "plate",
+                                       ERR_DUPLICATED_NO_FINISHED)
+                continue
+            results[index] = {"status": status.HTTP_201_CREATED, "obj": obj}
+        return
+    sessions_changed.send(sender=queryset.model, sessions=created, event="arrival")
+    for index, obj in arrivals.items():
+        results[index] = {"status": status.HTTP_201_CREATED, "obj": obj}
+
+
+def apply_edge_events(queryset, items):
+    """
+    Applies, in order, the events an edge node recorded while offline. They
+    refer to sessions by plate and carry the time they happened at the gate.
+    Conflicts with the central data follow the rules of ParkingModels.clean():
+    an arrival of a plate already inside is rejected (the older session is
+    kept and the later payment/departure apply to it), a payment or departure
+    needs an open session and a departure needs the payment.
+    """
+    results = [None] * len(items)
+    events = []
+    for index, item in enumerate(items):
+        serializer = ParkingEdgeEventSerializer(data=item)
+        if serializer.is_valid():
+            events.append((index, serializer.validated_data))
+        else:
+            results[index] = {"status": status.HTTP_400_BAD_REQUEST,
+                              "errors": serializer.errors}
+
+    plates = {e["plate"] for _, e in events}
+    open_sessions = {}
+    if plates:
+        open_sessions = {obj.plate: obj for obj in
+                         queryset.filter(plate__in=plates, departure_time=None)}
+
+    # Final state of every session the batch touches, and the events that led
+    # to it, so each session is written once.
+    arrivals, changed = {}, {}
+    for index, event in events:
+        plate, at = event["plate"], event["at"]
+        obj = open_sessions.get(plate)
+        if event["event"] == "arrival":
+            if obj is not None:
+                results[index] = error(status.HTTP_400_BAD_REQUEST, "plate",
+                                       ERR_DUPLICATED_NO_FINISHED)
+                continue
+            obj = open_sessions[plate] = ParkingModels(plate=plate, arrival_time=at)
+            arrivals[id(obj)] = obj
+        elif obj is None:
+            results[index] = error(status.HTTP_404_NOT_FOUND, "plate",
+                                   ERR_NO_OPEN_SESSION)
+            continue
+        elif event["event"] == "payment":
+            obj.paid = True
+        elif not obj.paid:
+            results[index] = error(status.HTTP_400_BAD_REQUEST, "paid",
+                                   ERR_DEPARTURE_NOT_PAID)
+            continue
+        else:
+            obj.departure_time = at
+            del open_sessions[plate]
+        changed.setdefault(id(obj), (obj, []))[1].append(index)
+
+    now = datetime.now()
+    with transaction.atomic():
+        updates = [obj for obj, _ in changed.values() if obj.pk is not None]
+        paid = [obj for obj in updates if obj.departure_time is None]
+        closed = [obj for obj in updates if obj.departure_time is not None]
+        updated = {}
+        if paid:
+            rows = queryset.filter(pk__in=[o.pk for o in paid], departure_time=None) \
+                .update_returning(paid=True, updated_at=now)
+            updated.update((obj.pk, obj) for obj in rows)
+            if rows:
+                sessions_changed.send(sender=queryset.model, sessions=rows,
+                                      event="payment")
+        if closed:
+            departures = Case(*[When(pk=o.pk, then=Value(o.departure_time))
+                                for o in closed])
+            rows = queryset.filter(pk__in=[o.pk for o in closed], departure_time=None) \
+                .update_returning(paid=True, departure_time=departures, updated_at=now)
+            updated.update((obj.pk, obj) for obj in rows)
+            if rows:
+                sessions_changed.send(sender=queryset.model, sessions=rows,
+                                      event="departure")
+        insert_recorded(queryset, list(arrivals.values()))
+
+    kinds = {index: event["event"] for index, event in events}
+    for key, (obj, indexes) in changed.items():
+        if key in arrivals or obj.pk in updated:
+            obj = updated.get(obj.pk, obj)
+            for index in indexes:
+                results[index] = {"status": status.HTTP_201_CREATED
+                                  if kinds[index] == "arrival"
+                                  else status.HTTP_202_ACCEPTED, "obj": obj}
+        else:
+            # Closed by a concurrent request since it was read.
+            for index in indexes:
+                results[index] = error(status.HTTP_400_BAD_REQUEST,
+                                       "departure_time", ERR_ALREADY_LEFT)
+    return represent_results(results)
+
+
+def insert_recorded(queryset, sessions):
+    # bulk_create() stamps arrival_time (auto_now_add), the recorded times are
+    # written back in the same transaction before the sessions are announced.
+    if not sessions:
+        return []
+    arrival_times = [obj.arrival_time for obj in sessions]
+    try:
+        with transaction.atomic():
+            created = queryset.bulk_create(sessions)
+    except IntegrityError:
+        # A plate was opened concurrently, the next sync sees it.
+        raise ConcurrentWrite()
+    queryset.filter(pk__in=[o.pk for o in created]).update(arrival_time=Case(
+        *[When(pk=o.pk, then=Value(at)) for o, at in zip(created, arrival_times)]))
+    for obj, at in zip(created, arrival_times):
+        obj.arrival_time = at
+    sessions_changed.send(sender=queryset.model, sessions=created, event="arrival")
+    closed = [obj for obj in created if obj.departure_time is not None]
+    if closed:
+        sessions_changed.send(sender=queryset.model, sessions=closed,
+                              event="departure")
+    return created
@@ -0,0 +1,27 @@
+import random
+import string
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list.
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def summarize(latencies, elapsed):
+    """Latencies in seconds -> JSON-friendly summary in milliseconds."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+def random_plate(rnd=random):
+    return "{}-{:04d}".format("".join(rnd.choices(string.ascii_uppercase, k=3)),
+                              rnd.randrange(10000))
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import math
+import uuid
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+from parking.routers import sticky_seconds
+from parking.signals import by_database, sessions_changed
+
+# Responses without open sessions never change until the plate is written to.
+HISTORY_TIMEOUT = 300
+
+
+def version_key(plate):
+    return "parking:plate:{}:version".format(plate)
+
+
+def history_key(plate, limit, offset):
+    # Every write to a plate gives it a new version, which orphans all its
+    # cached pages at once (they expire on their own).
+    version = cache.get(version_key(plate))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(version_key(plate), version, None):
+            version = cache.get(version_key(plate))
+    return "parking:plate:{}:{}:{}:{}".format(plate, version, limit, offset)
+
+
+def written_key(plate):
+    return "parking:plate:{}:written".format(plate)
+
+
+def invalidate_plates(plates):
+    cache.set_many({version_key(plate): uuid.uuid4().hex for plate in plates},
+                   None)
+    # A replica may not have the write yet: reading it there would cache the
+    # old history under the new version.
+    cache.set_many({written_key(plate): 1 for plate in plates}, sticky_seconds())
+
+
+def recently_written(plate):
+    return cache.get(written_key(plate)) is not None
+
+
+def make_etag(data):
+    content = json.dumps(data, separators=(",", ":")).encode()
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+def history_timeout(rows, now):
+    # The "time" of an open session is a rounded number of minutes, so the
+    # page stays valid until the earliest of them rounds to the next minute.
+    timeout = HISTORY_TIMEOUT
+    for id, plate, paid, arrival, departure in rows:
+        if departure is None:
+            seconds = (now - arrival).total_seconds()
+            remaining = (round(seconds / 60) + 0.5) * 60 - seconds
+            timeout = min(timeout, max(1, math.ceil(remaining)))
+    return timeout
+
+
+@receiver(sessions_changed)
+def invalidate_history(sender, sessions, event, **kwargs):
+    # Invalidated right away for readers of this transaction, and again on
+    # commit so a page cached by a concurrent reader meanwhile is dropped.
+    invalidate_plates({s.plate for s in sessions})
+    for db, group in by_database(sessions).items():
+        plates = {s.plate for s in group}
+        transaction.on_commit(lambda plates=plates: invalidate_plates(plates), using=db)
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from django.conf import settings
+from rest_framework.exceptions import NotFound, ValidationError
+from parking.models import ERR_DEPARTURE_NOT_PAID, ERR_DUPLICATED_NO_FINISHED, \
+    ERR_NO_OPEN_SESSION
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL,
+    plate TEXT NOT NULL,
+    at TEXT NOT NULL,
+    status INTEGER,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS events_pending ON events (seq) WHERE status IS NULL;
+CREATE TABLE IF NOT EXISTS sessions (
+    plate TEXT PRIMARY KEY,
+    arrival TEXT NOT NULL,
+    paid INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class EdgeLog:
+    """
+    Write-ahead log of an edge node: the gate events are appended to a local
+    SQLite file (fsync'ed on every commit) and replayed to the central
+    database by edge_sync. The vehicles currently inside, as seen by this
+    node, are kept next to it so the gate rules are checked locally.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.executescript(SCHEMA)
+
+    def append(self, event, plate, at=None):
+        at = at or datetime.now()
+        with self.lock:
+            db = self.connection
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                session = db.execute("SELECT paid FROM sessions WHERE plate = ?",
+                                     (plate,)).fetchone()
+                if event == "arrival":
+                    if session is not None:
+                        raise ValidationError({"plate": [ERR_DUPLICATED_NO_FINISHED]})
+                    db.execute("INSERT INTO sessions (plate, arrival) VALUES (?, ?)",
+                               (plate, at.isoformat()))
+                    paid = False
+                elif session is None:
+                    raise NotFound(ERR_NO_OPEN_SESSION)
+                elif event == "payment":
+                    db.execute("UPDATE sessions SET paid = 1 WHERE plate = ?", (plate,))
+                    paid = True
+                elif not session[0]:
+                    raise ValidationError({"paid": [ERR_DEPARTURE_NOT_PAID]})
+                else:
+                    db.execute("DELETE FROM sessions WHERE plate = ?", (plate,))
+                    paid = True
+                seq = db.execute("INSERT INTO events (event, plate, at) VALUES (?, ?, ?)",
+                                 (event, plate, at.isoformat())).lastrowid
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        return {"seq": seq, "event": event, "plate": plate, "paid": paid,
+                "left": event == "departure", "at": at}
+
+    def pending(self, limit):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT seq, event, plate, at FROM events WHERE status IS NULL "
+                "ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        return [{"seq": seq, "event": event, "plate": plate, "at": at}
+                for seq, event, plate, at in rows]
+
+    def backlog(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM events WHERE status IS NULL").fetchone()[0]
+
+    def acknowledge(self, events, results):
+        # The central outcome of each event is kept, conflicts included.
+        with self.lock:
+            db = self.connection
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("UPDATE events SET status = ?, result = ? WHERE seq = ?", [
+                (result["status"], json.dumps(result), event["seq"])
+                for event, result in zip(events, results)])
+            db.execute("COMMIT")
+
+    def prune(self):
+        with self.lock:
+            return self.connection.execute(
+                "DELETE FROM events WHERE status IS NOT NULL").rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+_log = None
+
+
+def edge_enabled():
+    return bool(getattr(settings, "PARKING_EDGE_LOG", None))
+
+
+def get_log():
+    global _log
+    path = settings.PARKING_EDGE_LOG
+    if _log is None or _log.path != path:
+        _log = EdgeLog(path)
+    return _log
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+from parking.backends import get_redis
+from parking.occupancy import get_index, index_enabled
+from parking.signals import by_database, sessions_changed
+
+EVENTS_CHANNEL = "parking:events"
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class Subscription:
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, event):
+        # A subscriber that can't keep up loses events instead of slowing the
+        # publishers down.
+        if not self.queue.full():
+            self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    Delivers the gate events to the subscribers of this process. Publishing is
+    thread-safe, subscribers are asyncio queues of the event loop serving them.
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def deliver(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # Its event loop is closed.
+                self.unsubscribe(subscription)
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Relays the events through a Redis channel, so the subscribers of every
+    process receive the events published by any of them.
+    """
+
+    def __init__(self, client, channel=EVENTS_CHANNEL):
+        super().__init__()
+        self.client = client
+        self.channel = channel
+        self.listener = None
+
+    def subscribe(self):
+        with self.lock:
+            if self.listener is None:
+                pubsub = self.client.pubsub()
+                pubsub.subscribe(self.channel)
+                self.listener = threading.Thread(target=self.listen, args=(pubsub,),
+                                                 daemon=True)
+                self.listener.start()
+        return super().subscribe()
+
+    def listen(self, pubsub):
+        for message in pubsub.listen():
+            if message["type"] == "message":
+                self.deliver(json.loads(message["data"]))
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        url = getattr(settings, "PARKING_EVENTS_REDIS_URL", None)
+        _broker = RedisBroker(get_redis(url)) if url else LocalBroker()
+    return _broker
+
+
+def set_broker(broker):
+    global _broker
+    _broker = broker
+
+
+@receiver(sessions_changed)
+def publish_sessions(sender, sessions, event, **kwargs):
+    for db, group in by_database(sessions).items():
+        transaction.on_commit(publisher(group, event), using=db)
+
+
+def publisher(sessions, event):
+    events = [{
+        "event": event,
+        "id": s.id,
+        "plate": s.plate,
+        "paid": s.paid,
+        "left": s.departure_time is not None,
+    } for s in sessions]
+
+    def publish():
+        broker = get_broker()
+        at = datetime.now().isoformat()
+        occupied = get_index().count() if index_enabled() else None
+        for data in events:
+            data.update(at=at, occupied=occupied)
+            broker.publish(data)
+    return publish
@@ -0,0 +1,85 @@
+import csv
+import heapq
+import io
+import zlib
+from django.db.models import Q
+from parking.lots import lot_databases
+from parking.models import ParkingArchive, ParkingModels
+
+EXPORT_FIELDS = ("id", "plate", "paid", "arrival_time", "departure_time",
+                 "created_at", "updated_at", "lot_id", "database")
+EXPORT_CHUNK_SIZE = 5000
+
+
+def iter_sessions(start=None, end=None, after=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Sessions (recent and archived, of every database) as EXPORT_FIELDS tuples
+    ordered by (updated_at, database, id), read through server-side cursors.
+    The ids are per database, hence the database in the order and in "after",
+    the (updated_at, database, id) high-water mark of a previous export.
+    """
+    def rows(model, db):
+        # The default database through the router (replicas).
+        queryset = model.objects.all() if db == "default" else model.objects.using(db)
+        if start is not None:
+            queryset = queryset.filter(arrival_time__gte=start)
+        if end is not None:
+            queryset = queryset.filter(arrival_time__lt=end)
+        if after is not None:
+            updated_at, after_db, id = after
+            if db == after_db:
+                queryset = queryset.filter(Q(updated_at__gt=updated_at) |
+                                           Q(updated_at=updated_at, id__gt=id))
+            elif db > after_db:
+                queryset = queryset.filter(updated_at__gte=updated_at)
+            else:
+                queryset = queryset.filter(updated_at__gt=updated_at)
+        return (row + (db,) for row in queryset.order_by("updated_at", "id")
+                .values_list(*EXPORT_FIELDS[:-1]).iterator(chunk_size=chunk_size))
+
+    return heapq.merge(*(rows(model, db) for db in lot_databases()
+                         for model in (ParkingModels, ParkingArchive)),
+                       key=cursor)
+
+
+def cursor(row):
+    # (updated_at, database, id), the order of the export.
+    return row[6], row[8], row[0]
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def gzip_csv(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields a gzip compressed CSV of the rows, chunk by chunk."""
+    compressor = zlib.compressobj(wbits=31)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow([csv_value(value) for value in row])
+        count += 1
+        if count % chunk_size == 0:
+            data = compressor.compress(buffer.getvalue().encode())
+            buffer.seek(0)
+            buffer.truncate()
+            if data:
+                yield data
+    yield compressor.compress(buffer.getvalue().encode()) + compressor.flush()
+
+
+def write_parquet(path, rows):
+    # pyarrow is optional, only needed for --format parquet.
+    import pyarrow
+    import pyarrow.parquet
+    columns = list(zip(*rows))
+    table = pyarrow.table({name: list(values) for name, values in zip(EXPORT_FIELDS, columns)})
+    pyarrow.parquet.write_table(table, path, compression="zstd")
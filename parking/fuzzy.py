@@ -0,0 +1,169 @@
+import threading
+import time
+from django.conf import settings
+from django.db import connection, transaction
+from django.dispatch import receiver
+from parking.models import ParkingModels
+from parking.signals import by_database, sessions_changed
+
+# Characters the plate cameras mistake for one another. Each group is folded
+# to its first character before indexing, so these misreads cost nothing to
+# find and half an edit when ranking.
+CONFUSIONS = ("0ODQ", "8B", "1IL", "5S", "2Z", "6G", "7T", "4A")
+FOLD = str.maketrans({c: group[0] for group in CONFUSIONS for c in group[1:]})
+MAX_DISTANCE = 2.0
+
+
+def normalize(plate):
+    return "".join(c for c in plate.upper() if c.isalnum())
+
+
+def fold(plate):
+    return normalize(plate).translate(FOLD)
+
+
+def distance(a, b):
+    # Levenshtein distance between normalized plates, where substituting two
+    # confusable characters costs 0.5.
+    previous = [float(j) for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        current = [float(i)]
+        for j, cb in enumerate(b, 1):
+            if ca == cb:
+                cost = 0.0
+            elif ca.translate(FOLD) == cb.translate(FOLD):
+                cost = 0.5
+            else:
+                cost = 1.0
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + cost))
+        previous = current
+    return previous[-1]
+
+
+def variants(key):
+    # The folded plate and every way to delete one character from it: two
+    # plates one edit apart (after folding) share at least one variant.
+    yield key
+    for i in range(len(key)):
+        yield key[:i] + key[i + 1:]
+
+
+class FuzzyPlateIndex:
+    """
+    Deletion-neighbourhood index of the plates currently inside, over their
+    folded form (see CONFUSIONS). A lookup is a handful of dict accesses, so
+    it finds the plates within one misread character of any number of
+    confusions in well under a millisecond regardless of the occupancy.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.plates = set()
+        self.built_at = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def add(self, plate):
+        with self.lock:
+            if plate in self.plates:
+                return
+            self.plates.add(plate)
+            for key in variants(fold(plate)):
+                self.keys.setdefault(key, set()).add(plate)
+
+    def discard(self, plate):
+        with self.lock:
+            if plate not in self.plates:
+                return
+            self.plates.discard(plate)
+            for key in variants(fold(plate)):
+                plates = self.keys.get(key)
+                if plates is not None:
+                    plates.discard(plate)
+                    if not plates:
+                        del self.keys[key]
+
+    def rebuild(self, plates):
+        keys = {}
+        plates = set(plates)
+        for plate in plates:
+            for key in variants(fold(plate)):
+                keys.setdefault(key, set()).add(plate)
+        with self.lock:
+            self.keys, self.plates = keys, plates
+            self.built_at = time.monotonic()
+
+    def search(self, query, max_distance=1.0, limit=10):
+        query = normalize(query)
+        candidates = set()
+        with self.lock:
+            for key in variants(query.translate(FOLD)):
+                candidates.update(self.keys.get(key, ()))
+        ranked = []
+        for plate in candidates:
+            d = distance(query, normalize(plate))
+            if d <= max_distance:
+                ranked.append((d, plate))
+        ranked.sort()
+        return ranked[:limit]
+
+
+_index = FuzzyPlateIndex()
+
+
+def refresh_seconds():
+    return getattr(settings, "PARKING_FUZZY_REFRESH_SECONDS", 60)
+
+
+def open_plates():
+    return ParkingModels.objects.filter(departure_time=None) \
+        .values_list("plate", flat=True).iterator(chunk_size=5000)
+
+
+def refresh(index):
+    try:
+        index.rebuild(open_plates())
+    finally:
+        index.refreshing = False
+        connection.close()
+
+
+def get_fuzzy_index():
+    # Built from the database on first use, then rebuilt in the background
+    # every refresh_seconds(), which bounds how long the arrivals handled by
+    # other workers are missed. The writes of this process are applied as
+    # they commit.
+    index = _index
+    if index.built_at is None:
+        index.rebuild(open_plates())
+    elif time.monotonic() - index.built_at > refresh_seconds() and not index.refreshing:
+        index.refreshing = True
+        threading.Thread(target=refresh, args=(index,), daemon=True).start()
+    return index
+
+
+def reset_fuzzy_index():
+    global _index
+    _index = FuzzyPlateIndex()
+
+
+@receiver(sessions_changed)
+def update_fuzzy_index(sender, sessions, event, **kwargs):
+    if _index.built_at is None:
+        return
+    index = _index
+
+    def applier(changes):
+        def apply():
+            for plate, inside in changes:
+                if inside:
+                    index.add(plate)
+                else:
+                    index.discard(plate)
+        return apply
+
+    for db, group in by_database(sessions).items():
+        transaction.on_commit(applier([(s.plate, event != "delete" and
+                                        s.departure_time is None) for s in group]),
+                              using=db)
@@ -0,0 +1,73 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+
+IDEMPOTENCY_CACHE = "idempotency"
+MAX_KEY_LENGTH = 255
+# How long a key stays claimed by a request that never finished (a worker
+# killed mid-request), after which it can be retried.
+CLAIM_TIMEOUT = 30
+PENDING = "pending"
+
+
+def fingerprint(request):
+    # A key reused for a different request is an error, not a replay.
+    content = b"%s %s\n%s" % (request.method.encode(),
+                              request.get_full_path().encode(), request.body)
+    return hashlib.sha1(content).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Responses of the writes sent with an Idempotency-Key header, replayed
+    when the same key is sent again. Entries are compact tuples in a cache:
+    (fingerprint, PENDING) while the first request runs, then
+    (fingerprint, status, content type, body) until they expire.
+    """
+
+    def __init__(self, cache, ttl):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def key(idempotency_key):
+        return "parking:idempotency:{}".format(
+            hashlib.sha256(idempotency_key.encode()).hexdigest())
+
+    def claim(self, key, fingerprint):
+        # Returns None when the caller owns the key, else the stored entry.
+        # add() is atomic, so only one of concurrent requests gets the key.
+        if self.cache.add(key, (fingerprint, PENDING), CLAIM_TIMEOUT):
+            return None
+        return self.cache.get(key) or (fingerprint, PENDING)
+
+    async def aclaim(self, key, fingerprint):
+        if await self.cache.aadd(key, (fingerprint, PENDING), CLAIM_TIMEOUT):
+            return None
+        return await self.cache.aget(key) or (fingerprint, PENDING)
+
+    def entry(self, fingerprint, response):
+        return (fingerprint, response.status_code, response.get("Content-Type"),
+                response.content)
+
+    def save(self, key, fingerprint, response):
+        self.cache.set(key, self.entry(fingerprint, response), self.ttl)
+
+    async def asave(self, key, fingerprint, response):
+        await self.cache.aset(key, self.entry(fingerprint, response), self.ttl)
+
+    def release(self, key):
+        self.cache.delete(key)
+
+    async def arelease(self, key):
+        await self.cache.adelete(key)
+
+
+def get_store():
+    return IdempotencyStore(caches[IDEMPOTENCY_CACHE],
+                            getattr(settings, "PARKING_IDEMPOTENCY_TTL", 24 * 3600))
+
+
+def should_store(response):
+    # Server errors and streams are not stored, the client may retry them.
+    return not response.streaming and response.status_code < 500
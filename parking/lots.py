@@ -0,0 +1,68 @@
+from collections import Counter
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from parking.models import ParkingLot, ParkingModels, ERR_DUPLICATED_NO_FINISHED
+from parking.signals import sessions_changed
+
+
+class LotFull(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The parking lot is full."
+    default_code = "lot_full"
+
+
+def lot_database(slug):
+    # Lots can be spread over databases (shards) with the
+    # PARKING_LOT_DATABASES setting, {"slug": "alias"}. A lot's row and its
+    # sessions are in the same database, so an arrival or a departure and
+    # the lot's counter are written in one local transaction.
+    return getattr(settings, "PARKING_LOT_DATABASES", {}).get(slug, "default")
+
+
+def lot_databases():
+    # Every database holding sessions, "default" first.
+    shards = set(getattr(settings, "PARKING_LOT_DATABASES", {}).values())
+    return ["default"] + sorted(shards - {"default"})
+
+
+def get_lot(slug):
+    try:
+        return ParkingLot.objects.using(lot_database(slug)).get(slug=slug)
+    except ParkingLot.DoesNotExist:
+        raise NotFound()
+
+
+def arrive(lot, plate):
+    # One conditional UPDATE takes a space (nothing is counted) and the
+    # session is inserted in the same transaction, so a rejected arrival
+    # gives the space back.
+    db = lot._state.db
+    with transaction.atomic(using=db):
+        taken = ParkingLot.objects.using(db) \
+            .filter(pk=lot.pk, occupied__lt=F("capacity")) \
+            .update(occupied=F("occupied") + 1)
+        if not taken:
+            raise LotFull()
+        try:
+            with transaction.atomic(using=db):
+                return ParkingModels.objects.using(db).create(lot=lot, plate=plate)
+        except IntegrityError:
+            raise ValidationError({"plate": [ERR_DUPLICATED_NO_FINISHED]})
+
+
+@receiver(sessions_changed)
+def release_spaces(sender, sessions, event, **kwargs):
+    # Runs in the transaction of the departure, on the lot's database.
+    if event not in ("departure", "delete"):
+        return
+    released = Counter((s._state.db or "default", s.lot_id) for s in sessions
+                       if s.lot_id is not None and
+                       (event == "departure" or s.departure_time is None))
+    for (db, lot_id), count in released.items():
+        ParkingLot.objects.using(db).filter(pk=lot_id) \
+            .update(occupied=Greatest(F("occupied") - count, 0))
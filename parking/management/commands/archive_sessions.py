@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from parking.lots import lot_databases
+from parking.models import ParkingArchive, ParkingModels
+
+ARCHIVED_FIELDS = ("id", "lot_id", "plate", "paid", "arrival_time", "departure_time",
+                   "created_at", "updated_at")
+
+
+class Command(BaseCommand):
+    help = "Moves the sessions closed for more than --days days to the archive " \
+           "table of their database (default and the lots' shards), in batches of " \
+           "--batch-size, one transaction per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--max-batches", type=int,
+                            help="Stop after this many batches (default: until done).")
+
+    def handle(self, *args, **options):
+        cutoff = datetime.now() - timedelta(days=options["days"])
+        moved = batches = 0
+        for db in lot_databases():
+            closed = ParkingModels.objects.using(db).filter(departure_time__lt=cutoff)
+            while options["max_batches"] is None or batches < options["max_batches"]:
+                with transaction.atomic(using=db):
+                    rows = list(closed.order_by("id").select_for_update(skip_locked=True)
+                                .values_list(*ARCHIVED_FIELDS)[:options["batch_size"]])
+                    if not rows:
+                        break
+                    ParkingArchive.objects.using(db).bulk_create(
+                        [ParkingArchive(**dict(zip(ARCHIVED_FIELDS, row))) for row in rows],
+                        ignore_conflicts=True)
+                    # A plain DELETE: the sessions are closed, so there is nothing
+                    # for the post_delete / sessions_changed receivers (occupancy,
+                    # fuzzy search, lots, outbox) to update, and no per-row
+                    # signals to send. The alerts point to them without a
+                    # constraint and are kept.
+                    ParkingModels.objects.filter(id__in=[row[0] for row in rows]) \
+                        ._raw_delete(using=db)
+                moved += len(rows)
+                batches += 1
+                self.stdout.write("Archived {} sessions.".format(moved))
+        self.stdout.write(self.style.SUCCESS(
+            "Done: {} sessions archived in {} batches.".format(moved, batches)))
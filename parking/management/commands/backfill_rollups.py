@@ -0,0 +1,51 @@
+from itertools import chain
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from parking.models import ParkingArchive, ParkingHourlyRollup, ParkingModels
+from parking.rollups import ROLLUP_FIELDS, add_session, hour_of
+
+CHUNK_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the hourly rollups from the closed sessions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Only rebuild the hours from this date/time "
+                                            "on (default: everything).")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("--since must be a date/time, e.g. 2022-07-01T00:00")
+            since = hour_of(since)
+
+        sources = [ParkingModels.objects.exclude(departure_time=None),
+                   ParkingArchive.objects.all()]
+        rollups = ParkingHourlyRollup.objects.all()
+        if since is not None:
+            # Sessions that left before "since" don't touch the rebuilt hours.
+            sources = [sessions.filter(departure_time__gte=since) for sessions in sources]
+            rollups = rollups.filter(bucket__gte=since)
+
+        deltas = {}
+        rows = chain.from_iterable(
+            sessions.values_list("arrival_time", "departure_time")
+                    .iterator(chunk_size=CHUNK_SIZE)
+            for sessions in sources)
+        for arrival, departure in rows:
+            add_session(deltas, arrival, departure, since)
+
+        # Run it while the gates are quiet and the outbox is drained: the
+        # departures delivered during the rebuild would be counted twice.
+        with transaction.atomic():
+            rollups.delete()
+            ParkingHourlyRollup.objects.bulk_create(
+                (ParkingHourlyRollup(bucket=bucket, **dict(zip(ROLLUP_FIELDS, values)))
+                 for bucket, values in sorted(deltas.items())),
+                batch_size=CHUNK_SIZE)
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt {} hourly rollups.".format(len(deltas))))
@@ -0,0 +1,55 @@
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from parking.benchmarks import random_plate, summarize
+from parking.models import ParkingModels
+
+
+class Command(BaseCommand):
+    help = "Times the same read done the way a request does it (connections " \
+           "checked before and after), with a new connection per request " \
+           "(CONN_MAX_AGE=0) and with a persistent one, and reports the " \
+           "connection setup cost saved per request as JSON. Read only."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--database", default="default")
+
+    def run(self, alias, max_age, requests):
+        connection = connections[alias]
+        saved = connection.settings_dict["CONN_MAX_AGE"]
+        connection.close()
+        connection.settings_dict["CONN_MAX_AGE"] = max_age
+        latencies = []
+        try:
+            began = time.perf_counter()
+            for _ in range(requests):
+                start = time.perf_counter()
+                close_old_connections()
+                ParkingModels.objects.using(alias).filter(plate=random_plate()).exists()
+                close_old_connections()
+                latencies.append(time.perf_counter() - start)
+            elapsed = time.perf_counter() - began
+        finally:
+            connection.close()
+            connection.settings_dict["CONN_MAX_AGE"] = saved
+        report = summarize(latencies, elapsed)
+        report["mean_ms"] = round(statistics.mean(latencies) * 1000, 3)
+        return report
+
+    def handle(self, *args, **options):
+        alias, requests = options["database"], options["requests"]
+        if alias not in connections:
+            raise CommandError("Unknown database {!r}.".format(alias))
+        if requests < 1:
+            raise CommandError("--requests must be positive.")
+        report = {
+            "database": alias,
+            "new_connection": self.run(alias, 0, requests),
+            "persistent": self.run(alias, None, requests),
+        }
+        report["setup_saved_ms"] = round(report["new_connection"]["mean_ms"] -
+                                         report["persistent"]["mean_ms"], 3)
+        self.stdout.write(json.dumps(report, indent=2))
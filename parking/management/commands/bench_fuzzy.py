@@ -0,0 +1,48 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from parking.benchmarks import random_plate, summarize
+from parking.fuzzy import CONFUSIONS, FuzzyPlateIndex
+
+
+def misread(plate, rnd):
+    # One confusable character swapped, as the cameras do.
+    positions = [i for i, c in enumerate(plate)
+                 if any(c in group for group in CONFUSIONS)]
+    if not positions:
+        return plate
+    i = rnd.choice(positions)
+    group = next(group for group in CONFUSIONS if plate[i] in group)
+    return plate[:i] + rnd.choice(group.replace(plate[i], "")) + plate[i + 1:]
+
+
+class Command(BaseCommand):
+    help = "Builds the fuzzy plate index over random plates and times lookups " \
+           "of misread plates."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plates", type=int, default=50000)
+        parser.add_argument("--queries", type=int, default=10000)
+        parser.add_argument("--max-distance", type=float, default=1.5)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(0)
+        plates = list({random_plate(rnd) for _ in range(options["plates"])})
+        index = FuzzyPlateIndex()
+        began = time.perf_counter()
+        index.rebuild(plates)
+        self.stdout.write("build        {:>9.1f} ms for {} plates".format(
+            (time.perf_counter() - began) * 1000, len(plates)))
+
+        queries = [(plate, misread(plate, rnd))
+                   for plate in rnd.choices(plates, k=options["queries"])]
+        latencies, found = [], 0
+        began = time.perf_counter()
+        for plate, query in queries:
+            start = time.perf_counter()
+            ranked = index.search(query, options["max_distance"])
+            latencies.append(time.perf_counter() - start)
+            found += any(p == plate for _, p in ranked)
+        report = summarize(latencies, time.perf_counter() - began)
+        self.stdout.write("lookup       p50 {p50_ms} ms  p99 {p99_ms} ms".format(**report))
+        self.stdout.write("recall       {:>9.1f} %".format(100 * found / len(queries)))
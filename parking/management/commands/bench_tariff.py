@@ -0,0 +1,40 @@
+import datetime
+import random
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from parking.tariff import Tariff
+
+
+class Command(BaseCommand):
+    help = "Compares the batched tariff evaluation with one evaluation per session."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=200000)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(0)
+        start = datetime.datetime(2022, 1, 1)
+        arrivals, departures = [], []
+        for _ in range(options["sessions"]):
+            arrival = start + datetime.timedelta(seconds=rnd.randrange(180 * 86400))
+            arrivals.append(arrival)
+            departures.append(arrival + datetime.timedelta(
+                seconds=int(rnd.lognormvariate(8.5, 1.2))))
+        tariff = Tariff.from_settings()
+
+        began = time.perf_counter()
+        batched = tariff.fees(arrivals, departures)
+        batched_time = time.perf_counter() - began
+
+        began = time.perf_counter()
+        looped = [int(tariff.fees([a], [d])[0]) for a, d in zip(arrivals, departures)]
+        looped_time = time.perf_counter() - began
+
+        if not np.array_equal(batched, np.asarray(looped)):
+            raise CommandError("Batched and per-session fees differ.")
+        count = len(arrivals)
+        for name, elapsed in (("batched", batched_time), ("per session", looped_time)):
+            self.stdout.write("{:<12} {:>9.1f} ms  {:>8.3f} us/session".format(
+                name, elapsed * 1000, elapsed * 1e6 / count))
+        self.stdout.write("speedup      {:>9.1f}x".format(looped_time / batched_time))
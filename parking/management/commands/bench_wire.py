@@ -0,0 +1,76 @@
+import gzip
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from parking.management.commands.bench_serializer import sample_sessions
+from parking.renderers import FastJSONRenderer, MessagePackParser, MessagePackRenderer
+from parking.serializer import FAST_FIELDS, represent_rows
+
+
+class BytesStream:
+    def __init__(self, content):
+        self.content = content
+
+    def read(self):
+        return self.content
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - began
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Command(BaseCommand):
+    help = "Compares the size and the encode/decode time of the API's wire formats " \
+           "(JSON, orjson, MessagePack, gzip/brotli) for one session and for a list."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def formats(self):
+        msgpack_parser = MessagePackParser()
+        yield "json", JSONRenderer(), json.loads
+        yield "orjson", FastJSONRenderer(), json.loads
+        yield "msgpack", MessagePackRenderer(), \
+            lambda content: msgpack_parser.parse(BytesStream(content))
+
+    def bench(self, label, data, repeat):
+        self.stdout.write("{}\n{:<16} {:>10} {:>11} {:>11}".format(
+            label, "format", "bytes", "encode ms", "decode ms"))
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        for name, renderer, decode in self.formats():
+            encode_time, content = best_of(repeat, renderer.render, data)
+            decode_time, decoded = best_of(repeat, decode, content)
+            if decoded != json.loads(JSONRenderer().render(data)):
+                raise CommandError("{} doesn't round-trip the data.".format(name))
+            self.stdout.write("{:<16} {:>10} {:>11.3f} {:>11.3f}".format(
+                name, len(content), encode_time * 1000, decode_time * 1000))
+            compressors = [("gzip", lambda c: gzip.compress(c, 6), gzip.decompress)]
+            if brotli is not None:
+                compressors.append(("br", lambda c: brotli.compress(c, quality=4),
+                                    brotli.decompress))
+            for suffix, compress, decompress in compressors:
+                compress_time, compressed = best_of(repeat, compress, content)
+                decompress_time, _ = best_of(repeat, decompress, compressed)
+                self.stdout.write("{:<16} {:>10} {:>11.3f} {:>11.3f}".format(
+                    name + "+" + suffix, len(compressed),
+                    (encode_time + compress_time) * 1000,
+                    (decode_time + decompress_time) * 1000))
+        self.stdout.write("")
+
+    def handle(self, *args, **options):
+        rows = [tuple(getattr(obj, f) for f in FAST_FIELDS)
+                for obj in sample_sessions(options["rows"])]
+        data = represent_rows(rows)
+        self.bench("single session", data[0], options["repeat"] * 100)
+        self.bench("{} sessions".format(len(data)), data, options["repeat"])
@@ -0,0 +1,200 @@
+import contextlib
+import datetime
+import json
+import platform
+import random
+import subprocess
+import time
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_databases, \
+    setup_test_environment, teardown_databases, teardown_test_environment
+from parking.benchmarks import random_plate, summarize
+from parking.models import ParkingModels
+
+OPERATIONS = ("arrival", "payment", "departure", "search")
+SEED_BATCH_SIZE = 10000
+
+
+@contextlib.contextmanager
+def explicit_timestamps():
+    # Lets bulk_create keep the historical arrival/update times instead of
+    # auto_now/auto_now_add overwriting them with the current time.
+    fields = [ParkingModels._meta.get_field(name)
+              for name in ("arrival_time", "created_at", "updated_at")]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, (auto_now, auto_now_add) in zip(fields, saved):
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, cwd=settings.BASE_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway database with parking history, replays a mixed gate " \
+           "workload against the API views and reports latency, throughput and " \
+           "queries per request as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=100000,
+                            help="Closed sessions in the seeded history.")
+        parser.add_argument("--plates", type=int, default=20000,
+                            help="Distinct plates; a few frequent visitors make up "
+                                 "most of the history.")
+        parser.add_argument("--open-percent", type=float, default=5.0,
+                            help="Percentage of the plates currently parked.")
+        parser.add_argument("--days", type=int, default=180,
+                            help="Period covered by the history.")
+        parser.add_argument("--operations", type=int, default=2000)
+        parser.add_argument("--mix", default="arrival=30,payment=25,departure=25,search=20",
+                            help="Relative weight of each operation.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--keepdb", action="store_true",
+                            help="Keep the benchmark database between runs (the "
+                                 "history is only seeded when it is empty).")
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        mix = dict(item.split("=") for item in options["mix"].split(","))
+        if set(mix) - set(OPERATIONS):
+            raise CommandError("Unknown operations in --mix: {}".format(
+                ", ".join(sorted(set(mix) - set(OPERATIONS)))))
+        rnd = random.Random(options["seed"])
+        plates = list({random_plate(rnd) for _ in range(options["plates"])})
+
+        # Same throwaway database the test runner uses (test_<NAME>), so the
+        # benchmark never touches real data and runs offline.
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False,
+                                     keepdb=options["keepdb"])
+        try:
+            began = time.perf_counter()
+            if not ParkingModels.objects.exists():
+                self.seed(rnd, plates, options)
+            seed_time = time.perf_counter() - began
+            report = self.replay(rnd, plates, mix, options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        report["config"] = {k: options[k] for k in (
+            "sessions", "plates", "open_percent", "days", "operations", "mix", "seed")}
+        report["environment"] = {
+            "vendor": connection.vendor, "django": django.get_version(),
+            "python": platform.python_version(), "revision": git_revision(),
+            "seed_seconds": round(seed_time, 3),
+        }
+        content = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(content + "\n")
+        else:
+            self.stdout.write(content)
+
+    def seed(self, rnd, plates, options):
+        now = datetime.datetime.now()
+        period = options["days"] * 24 * 60
+
+        def closed_sessions():
+            for _ in range(options["sessions"]):
+                # Power law: low indexes (frequent visitors) come up most.
+                plate = plates[int(len(plates) * rnd.random() ** 3)]
+                arrival = now - datetime.timedelta(minutes=rnd.randrange(60, period))
+                stay = datetime.timedelta(minutes=min(rnd.lognormvariate(4, 1), 3000))
+                departure = min(arrival + stay, now)
+                yield ParkingModels(plate=plate, paid=True, arrival_time=arrival,
+                                    departure_time=departure, created_at=arrival,
+                                    updated_at=departure)
+
+        def open_sessions():
+            count = int(len(plates) * options["open_percent"] / 100)
+            for plate in rnd.sample(plates, count):
+                arrival = now - datetime.timedelta(minutes=rnd.randrange(1, 600))
+                yield ParkingModels(plate=plate, paid=rnd.random() < 0.2,
+                                    arrival_time=arrival, created_at=arrival,
+                                    updated_at=arrival)
+
+        with explicit_timestamps():
+            for sessions in (closed_sessions(), open_sessions()):
+                batch = []
+                for obj in sessions:
+                    batch.append(obj)
+                    if len(batch) >= SEED_BATCH_SIZE:
+                        ParkingModels.objects.bulk_create(batch)
+                        batch = []
+                ParkingModels.objects.bulk_create(batch)
+
+    def replay(self, rnd, plates, mix, options):
+        cache.clear()
+        client = Client()
+        url = "/api/v1/parking/"
+        unpaid, paid = [], []
+        for id, is_paid in ParkingModels.objects.filter(departure_time=None) \
+                                                .values_list("id", "paid"):
+            (paid if is_paid else unpaid).append(id)
+        inside = set(ParkingModels.objects.filter(departure_time=None)
+                     .values_list("plate", flat=True))
+        outside = [plate for plate in plates if plate not in inside]
+
+        latencies = {op: [] for op in OPERATIONS}
+        queries = {op: 0 for op in OPERATIONS}
+        statuses = {op: {} for op in OPERATIONS}
+        names, weights = zip(*((op, float(w)) for op, w in mix.items()))
+        total_began = time.perf_counter()
+        for _ in range(options["operations"]):
+            op = rnd.choices(names, weights)[0]
+            if op == "payment" and not unpaid or op == "departure" and not paid:
+                op = "arrival"
+            if op == "arrival":
+                plate = outside.pop(rnd.randrange(len(outside))) if outside \
+                    else random_plate(rnd)
+                call = lambda: client.post(url, {"plate": plate},
+                                           content_type="application/json")
+            elif op == "payment":
+                id = unpaid.pop(rnd.randrange(len(unpaid)))
+                call = lambda: client.put("{}{}/pay/".format(url, id))
+            elif op == "departure":
+                id = paid.pop(rnd.randrange(len(paid)))
+                call = lambda: client.put("{}{}/out/".format(url, id))
+            else:
+                plate = plates[int(len(plates) * rnd.random() ** 3)]
+                call = lambda: client.get("{}{}/".format(url, plate))
+
+            with CaptureQueriesContext(connection) as ctx:
+                began = time.perf_counter()
+                response = call()
+                latencies[op].append(time.perf_counter() - began)
+            queries[op] += len(ctx.captured_queries)
+            code = str(response.status_code)
+            statuses[op][code] = statuses[op].get(code, 0) + 1
+            if op == "arrival" and response.status_code == 201:
+                unpaid.append(response.json()["id"])
+            elif op == "payment" and response.status_code == 202:
+                paid.append(id)
+        elapsed = time.perf_counter() - total_began
+
+        report = {"operations": {}}
+        for op in OPERATIONS:
+            if not latencies[op]:
+                continue
+            summary = summarize(latencies[op], elapsed)
+            summary["queries_per_request"] = round(queries[op] / len(latencies[op]), 2)
+            summary["status"] = statuses[op]
+            report["operations"][op] = summary
+        report["total"] = summarize([t for op in OPERATIONS for t in latencies[op]],
+                                    elapsed)
+        return report
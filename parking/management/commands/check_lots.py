@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from parking.models import ParkingLot, ParkingModels
+
+
+class Command(BaseCommand):
+    help = "Compares the occupancy counter of every lot with its open sessions. " \
+           "Sessions opened or closed outside the API (admin, scripts) make " \
+           "them drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true",
+                            help="Set the counters to the number of open sessions.")
+
+    def handle(self, *args, **options):
+        databases = {"default"} | set(getattr(settings, "PARKING_LOT_DATABASES",
+                                              {}).values())
+        drift = []
+        for db in sorted(databases):
+            lots = ParkingLot.objects.using(db).annotate(
+                open=Count("sessions", filter=Q(sessions__departure_time=None)))
+            for lot in lots:
+                if lot.open != lot.occupied:
+                    drift.append(lot)
+                    self.stdout.write("{} ({}): counter {}, open sessions {}".format(
+                        lot.slug, db, lot.occupied, lot.open))
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Lot counters are consistent."))
+            return
+        if options["repair"]:
+            # Counted again in the UPDATE, the lots keep working meanwhile.
+            open_sessions = ParkingModels.objects \
+                .filter(lot=OuterRef("pk"), departure_time=None) \
+                .values("lot").annotate(n=Count("id")).values("n")
+            for lot in drift:
+                ParkingLot.objects.using(lot._state.db).filter(pk=lot.pk).update(
+                    occupied=Coalesce(Subquery(open_sessions), 0))
+            self.stdout.write(self.style.SUCCESS(
+                "{} lot counters repaired.".format(len(drift))))
+            return
+        raise CommandError("{} lot counters differ from the open sessions.".format(
+            len(drift)))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from parking.occupancy import get_index, open_sessions
+
+
+class Command(BaseCommand):
+    help = "Compares the occupancy index with the open sessions in the database. " \
+           "The process-local index belongs to each worker, so this is meant for " \
+           "the shared (Redis) index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true",
+                            help="Rebuild the index from the database when it differs.")
+
+    def handle(self, *args, **options):
+        index = get_index(warm=False)
+        indexed = index.items()
+        expected = {plate: (id, arrival_time)
+                    for plate, id, arrival_time in open_sessions()}
+
+        missing = sorted(set(expected) - set(indexed))
+        stale = sorted(set(indexed) - set(expected))
+        wrong = sorted(plate for plate in set(expected) & set(indexed)
+                       if expected[plate] != indexed[plate])
+        for label, plates in (("missing", missing), ("stale", stale),
+                              ("mismatched", wrong)):
+            for plate in plates:
+                self.stdout.write("{}: {}".format(label, plate))
+
+        if not (missing or stale or wrong):
+            self.stdout.write(self.style.SUCCESS(
+                "Occupancy index is consistent ({} vehicles).".format(len(expected))))
+            return
+        if options["repair"]:
+            index.rebuild(open_sessions())
+            self.stdout.write(self.style.SUCCESS(
+                "Occupancy index rebuilt ({} vehicles).".format(index.count())))
+            return
+        raise CommandError("Occupancy index differs from the database: "
+                           "{} missing, {} stale, {} mismatched.".format(
+                               len(missing), len(stale), len(wrong)))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from parking.lots import lot_database
+from parking.models import ParkingLot
+
+
+class Command(BaseCommand):
+    help = "Creates a parking lot in its database (see PARKING_LOT_DATABASES), or " \
+           "changes the capacity of an existing one."
+
+    def add_arguments(self, parser):
+        parser.add_argument("slug")
+        parser.add_argument("capacity", type=int)
+        parser.add_argument("--name")
+
+    def handle(self, *args, **options):
+        slug, capacity = options["slug"], options["capacity"]
+        if capacity < 0:
+            raise CommandError("The capacity can't be negative.")
+        db = lot_database(slug)
+        try:
+            lot, created = ParkingLot.objects.using(db).update_or_create(
+                slug=slug, defaults={"capacity": capacity,
+                                     "name": options["name"] or slug})
+        except IntegrityError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS("{} lot {} ({} spaces) in {!r}.".format(
+            "Created" if created else "Updated", lot.slug, lot.capacity, db)))
@@ -0,0 +1,88 @@
+import http.client
+import json
+import socket
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from parking.batch import MAX_BATCH_SIZE
+from parking.edge import edge_enabled, get_log
+
+
+class Command(BaseCommand):
+    help = "Replays the events of the edge log (EDGE_LOG) to the central API in " \
+           "ordered batches, until the log is drained or the uplink fails."
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="Central API prefix, e.g. "
+                            "https://central.example.com/api/v1/parking/")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--node", default=socket.gethostname(),
+                            help="Name of this node, part of the idempotency keys.")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running, syncing every INTERVAL seconds.")
+        parser.add_argument("--prune", action="store_true",
+                            help="Delete the synced events from the log.")
+        parser.add_argument("--timeout", type=float, default=30)
+
+    def post(self, url, body, headers, timeout):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" \
+            else http.client.HTTPConnection
+        connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        try:
+            connection.request("POST", parts.path.rstrip("/") + "/sync/", body, headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def sync(self, log, options):
+        # Returns the number of events synced. A batch is retried with the same
+        # Idempotency-Key, so a response lost on the way back doesn't apply it
+        # twice.
+        synced = 0
+        while True:
+            events = log.pending(options["batch_size"])
+            if not events:
+                return synced
+            key = "edge:{}:{}-{}".format(options["node"], events[0]["seq"],
+                                         events[-1]["seq"])
+            body = json.dumps([{k: e[k] for k in ("event", "plate", "at")}
+                               for e in events])
+            try:
+                code, content = self.post(options["url"], body, {
+                    "Content-Type": "application/json", "Idempotency-Key": key,
+                }, options["timeout"])
+            except OSError as e:
+                self.stderr.write("Uplink unavailable: {}".format(e))
+                return synced
+            if code >= 500 or code in (409, 429):
+                self.stderr.write("Central API answered {}, retrying later.".format(code))
+                return synced
+            if code != 207:
+                raise CommandError("Central API answered {}: {}".format(
+                    code, content[:200].decode(errors="replace")))
+            results = json.loads(content)
+            log.acknowledge(events, results)
+            synced += len(events)
+            for event, result in zip(events, results):
+                if result["status"] >= 400:
+                    self.stderr.write("Event {seq} ({event} {plate}) rejected: {}".format(
+                        json.dumps(result.get("errors")), **event))
+
+    def handle(self, *args, **options):
+        if not edge_enabled():
+            raise CommandError("EDGE_LOG is not set, this is not an edge node.")
+        if not 1 <= options["batch_size"] <= MAX_BATCH_SIZE:
+            raise CommandError("--batch-size must be between 1 and {}.".format(
+                MAX_BATCH_SIZE))
+        log = get_log()
+        while True:
+            synced = self.sync(log, options)
+            if options["prune"]:
+                log.prune()
+            self.stdout.write("{} events synced, {} pending.".format(
+                synced, log.backlog()))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
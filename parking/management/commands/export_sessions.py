@@ -0,0 +1,91 @@
+import json
+import os
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from parking.export import cursor, gzip_csv, iter_sessions, write_parquet
+
+
+class Command(BaseCommand):
+    help = "Exports the sessions (recent and archived) changed since the last " \
+           "export into compressed files of --rows-per-file rows. The high-water " \
+           "mark is saved after every file, so an interrupted export resumes " \
+           "where it stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir")
+        parser.add_argument("--start", help="Only sessions that arrived from this date/time.")
+        parser.add_argument("--end", help="Only sessions that arrived before this date/time.")
+        parser.add_argument("--format", choices=("csv", "parquet"), default="csv",
+                            help="csv is gzip compressed; parquet needs pyarrow.")
+        parser.add_argument("--rows-per-file", type=int, default=100000)
+        parser.add_argument("--full", action="store_true",
+                            help="Ignore the saved high-water mark.")
+
+    def load_state(self, path, options):
+        if options["full"] or not os.path.exists(path):
+            return {"start": options["start"], "end": options["end"],
+                    "after": None, "files": 0}
+        with open(path) as state_file:
+            state = json.load(state_file)
+        if (state["start"], state["end"]) != (options["start"], options["end"]):
+            raise CommandError("The saved export has another date range, use --full "
+                               "or another output directory.")
+        return state
+
+    def save(self, path, write):
+        # Written aside and renamed, so a crash never leaves half a file.
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as output:
+            write(output)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(tmp, path)
+
+    def handle(self, *args, **options):
+        start = end = None
+        for name in ("start", "end"):
+            if options[name] and parse_datetime(options[name]) is None:
+                raise CommandError("--{} must be a date/time, e.g. 2022-07-01T00:00".format(name))
+        if options["start"]:
+            start = parse_datetime(options["start"])
+        if options["end"]:
+            end = parse_datetime(options["end"])
+        if options["format"] == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise CommandError("--format parquet requires pyarrow, use --format csv.")
+
+        os.makedirs(options["output_dir"], exist_ok=True)
+        state_path = os.path.join(options["output_dir"], "export-state.json")
+        state = self.load_state(state_path, options)
+        after = None
+        if state["after"]:
+            updated_at, *rest = state["after"]
+            # Saved as (updated_at, id) before the lots' databases were exported.
+            db, id = rest if len(rest) == 2 else ("default", rest[0])
+            after = (parse_datetime(updated_at), db, id)
+
+        rows = iter_sessions(start, end, after)
+        exported = 0
+        while True:
+            chunk = list(islice(rows, options["rows_per_file"]))
+            if not chunk:
+                break
+            state["files"] += 1
+            name = "sessions-{:06d}.{}".format(
+                state["files"], "parquet" if options["format"] == "parquet" else "csv.gz")
+            path = os.path.join(options["output_dir"], name)
+            if options["format"] == "parquet":
+                write_parquet(path + ".tmp", chunk)
+                os.replace(path + ".tmp", path)
+            else:
+                self.save(path, lambda output: output.writelines(gzip_csv(chunk)))
+
+            updated_at, db, id = cursor(chunk[-1])
+            state["after"] = (updated_at.isoformat(), db, id)
+            self.save(state_path, lambda output: output.write(json.dumps(state).encode()))
+            exported += len(chunk)
+            self.stdout.write("{}: {} sessions".format(name, len(chunk)))
+        self.stdout.write(self.style.SUCCESS("Exported {} sessions.".format(exported)))
@@ -0,0 +1,90 @@
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand
+from parking.benchmarks import random_plate, summarize
+
+
+class GateClient:
+    # One keep-alive connection, like one gate controller.
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.prefix = parts.path.rstrip("/") + "/"
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80,
+                                                     timeout=30)
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        self.connection.request(method, self.prefix + path,
+                                json.dumps(body) if body is not None else None,
+                                headers)
+        response = self.connection.getresponse()
+        content = response.read()
+        return response.status, content
+
+    def visit(self, record):
+        # arrival, plate search, payment and departure of one car.
+        plate = random_plate()
+        began = time.perf_counter()
+        code, content = self.request("POST", "", {"plate": plate})
+        record(began, code)
+        if code != 201:
+            return
+        id = json.loads(content)["id"]
+        for method, path in (("GET", "{}/".format(plate)), ("PUT", "{}/pay/".format(id)),
+                             ("PUT", "{}/out/".format(id))):
+            began = time.perf_counter()
+            code, content = self.request(method, path)
+            record(began, code)
+
+
+class Command(BaseCommand):
+    help = "Drives gate traffic against a running server (for example the WSGI " \
+           "and the ASGI profiles of docker-compose) at increasing concurrency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="API prefix, e.g. "
+                            "http://localhost:8001/api/v1/async/parking/")
+        parser.add_argument("--concurrency", default="10,50,100",
+                            help="Comma separated numbers of simultaneous clients.")
+        parser.add_argument("--duration", type=float, default=10.0,
+                            help="Seconds per concurrency level.")
+
+    def run_level(self, url, clients, duration):
+        latencies, errors = [], []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def record(began, code):
+            elapsed = time.perf_counter() - began
+            with lock:
+                latencies.append(elapsed)
+                if code >= 500:
+                    errors.append(code)
+
+        def worker():
+            client = GateClient(url)
+            while time.perf_counter() < deadline:
+                try:
+                    client.visit(record)
+                except (OSError, http.client.HTTPException):
+                    with lock:
+                        errors.append(None)
+                    client = GateClient(url)
+
+        began = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result = summarize(latencies, time.perf_counter() - began)
+        result.update(concurrency=clients, errors=len(errors))
+        return result
+
+    def handle(self, *args, **options):
+        results = [self.run_level(options["url"], int(level), options["duration"])
+                   for level in options["concurrency"].split(",")]
+        self.stdout.write(json.dumps(results, indent=2))
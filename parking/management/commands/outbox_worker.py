@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from parking.outbox import claim, deliver, lag
+
+
+class Command(BaseCommand):
+    help = "Delivers the outbox events (parking/outbox.py) to their receivers in " \
+           "batches, with a pool of threads. Events of the same plate are " \
+           "delivered in order, failed ones are retried with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--lease", type=float, default=60,
+                            help="Seconds a batch is reserved to this worker.")
+        parser.add_argument("--idle", type=float, default=0.5,
+                            help="Seconds to wait when the outbox is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Deliver what is deliverable now, then exit.")
+
+    def drain(self, db, pool, options):
+        # Returns the number of events delivered and failed.
+        delivered = failed = 0
+        lease = timedelta(seconds=options["lease"])
+        while True:
+            token, entries = claim(db, options["batch_size"], lease)
+            if not entries:
+                return delivered, failed
+            if pool is None:
+                errors = [deliver(db, token, entry) for entry in entries]
+            else:
+                errors = list(pool.map(lambda entry: self.deliver(db, token, entry),
+                                       entries))
+            for entry, error in zip(entries, errors):
+                if error is not None:
+                    failed += 1
+                    self.stderr.write("Event {} ({} {}) failed: {!r}".format(
+                        entry.id, entry.event, entry.plate, error))
+            delivered += len(entries) - sum(error is not None for error in errors)
+
+    def deliver(self, db, token, entry):
+        # The pool's threads keep their connections between batches.
+        close_old_connections()
+        return deliver(db, token, entry)
+
+    def handle(self, *args, **options):
+        if options["threads"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--threads and --batch-size must be at least 1.")
+        databases = {"default"} | set(getattr(settings, "PARKING_LOT_DATABASES",
+                                              {}).values())
+        # With --threads 1 the events are delivered in the command's thread.
+        pool = ThreadPoolExecutor(options["threads"]) if options["threads"] > 1 else None
+        try:
+            while True:
+                total = 0
+                for db in sorted(databases):
+                    delivered, failed = self.drain(db, pool, options)
+                    total += delivered + failed
+                    if delivered or failed:
+                        self.stdout.write("{}: {} delivered, {} failed, lag {:.1f}s.".format(
+                            db, delivered, failed, lag(db)))
+                if options["once"]:
+                    return
+                if not total:
+                    time.sleep(options["idle"])
+        finally:
+            if pool is not None:
+                pool.shutdown()
@@ -0,0 +1,55 @@
+import json
+from itertools import chain
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from parking.models import ParkingArchive, ParkingModels
+from parking.tariff import Tariff
+
+CHUNK_SIZE = 100000
+
+
+class Command(BaseCommand):
+    help = "Computes the fees of the sessions that left between two dates, " \
+           "per day of departure, in chunks evaluated by the tariff engine."
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", help="e.g. 2022-07-15T00:00")
+        parser.add_argument("end", help="e.g. 2022-07-16T00:00")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        start, end = parse_datetime(options["start"]), parse_datetime(options["end"])
+        if start is None or end is None or start >= end:
+            raise CommandError("start and end must be date/times, start before end.")
+
+        tariff = Tariff.from_settings()
+        rows = chain.from_iterable(
+            model.objects.filter(departure_time__gte=start, departure_time__lt=end)
+                         .values_list("arrival_time", "departure_time")
+                         .iterator(chunk_size=options["chunk_size"])
+            for model in (ParkingModels, ParkingArchive))
+        days = {}
+
+        def reconcile(chunk):
+            arrivals, departures = zip(*chunk)
+            fees = tariff.fees(arrivals, departures)
+            day = np.asarray(departures, dtype="datetime64[D]")
+            for value in np.unique(day):
+                mask = day == value
+                sessions, cents = days.get(str(value), (0, 0))
+                days[str(value)] = (sessions + int(mask.sum()),
+                                    cents + int(fees[mask].sum()))
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= options["chunk_size"]:
+                reconcile(chunk)
+                chunk = []
+        if chunk:
+            reconcile(chunk)
+
+        report = [{"day": day, "sessions": sessions, "revenue": "{:.2f}".format(cents / 100)}
+                  for day, (sessions, cents) in sorted(days.items())]
+        self.stdout.write(json.dumps(report, indent=2))
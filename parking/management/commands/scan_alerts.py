@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from parking.alerts import scan, thresholds
+from parking.models import ParkingAlert
+
+
+class Command(BaseCommand):
+    help = "Flags the sessions parked for too long and the paid sessions that " \
+           "didn't leave, incrementally from the previous run. Run it every minute " \
+           "(or with --interval 60)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--overstay-hours", type=float,
+                            help="Default: PARKING_OVERSTAY_HOURS.")
+        parser.add_argument("--paid-exit-minutes", type=float,
+                            help="Default: PARKING_PAID_EXIT_MINUTES.")
+        parser.add_argument("--rescan", action="store_true",
+                            help="Check every open session, not only the new ones.")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running, scanning every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        limits = thresholds()
+        if options["overstay_hours"] is not None:
+            limits[ParkingAlert.OVERSTAY] = timedelta(hours=options["overstay_hours"])
+        if options["paid_exit_minutes"] is not None:
+            limits[ParkingAlert.PAID_NOT_LEFT] = timedelta(
+                minutes=options["paid_exit_minutes"])
+        databases = {"default"} | set(getattr(settings, "PARKING_LOT_DATABASES",
+                                              {}).values())
+        rescan = options["rescan"]
+        while True:
+            for db in sorted(databases):
+                for kind, threshold in limits.items():
+                    flagged = scan(kind, threshold, db, rescan)
+                    if flagged:
+                        self.stdout.write("{} ({}): {} sessions flagged.".format(
+                            kind, db, flagged))
+            if not options["interval"]:
+                return
+            rescan = False
+            time.sleep(options["interval"])
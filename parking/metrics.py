@@ -0,0 +1,164 @@
+import bisect
+import contextlib
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+from django.db import connections
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+class Histogram:
+    """Prometheus histogram, one series per route."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.series.get(label, (None, 0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self.series[label] = (counts, total + value)
+
+    def render(self, lines):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} histogram".format(self.name))
+        with self.lock:
+            series = {label: (list(counts), total)
+                      for label, (counts, total) in self.series.items()}
+        for label, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append('{}_bucket{{route="{}",le="{}"}} {}'.format(
+                    self.name, label, bound, cumulative))
+            lines.append('{}_sum{{route="{}"}} {}'.format(self.name, label, total))
+            lines.append('{}_count{{route="{}"}} {}'.format(self.name, label, cumulative))
+
+
+class Counter:
+    """
+    Prometheus counter, one series per label value. Past max_series values
+    the new ones are counted as "other", so a client making up labels can't
+    grow it without bound.
+    """
+
+    def __init__(self, name, help, label, max_series=1000):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.max_series = max_series
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value, outcome):
+        with self.lock:
+            if (value, outcome) not in self.series and len(self.series) >= self.max_series:
+                value = "other"
+            self.series[value, outcome] = self.series.get((value, outcome), 0) + 1
+
+    def get(self, value, outcome):
+        with self.lock:
+            return self.series.get((value, outcome), 0)
+
+    def render(self, lines):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} counter".format(self.name))
+        with self.lock:
+            series = dict(self.series)
+        for (value, outcome), count in sorted(series.items()):
+            lines.append('{}{{{}="{}",outcome="{}"}} {}'.format(
+                self.name, self.label, value.replace("\\", "\\\\").replace('"', '\\"'),
+                outcome, count))
+
+
+class Gauge:
+    """Prometheus gauge read when scraped."""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self, lines):
+        lines.append("# HELP {} {}".format(self.name, self.help))
+        lines.append("# TYPE {} gauge".format(self.name))
+        lines.append("{} {}".format(self.name, self.read()))
+
+
+REQUEST_SECONDS = Histogram("parking_request_seconds",
+                            "Time spent handling the request.", LATENCY_BUCKETS)
+DB_SECONDS = Histogram("parking_db_seconds",
+                       "Time spent in database queries per request.", LATENCY_BUCKETS)
+SERIALIZER_SECONDS = Histogram("parking_serializer_seconds",
+                               "Time spent serializing sessions per request.",
+                               LATENCY_BUCKETS)
+QUERIES = Histogram("parking_db_queries", "Database queries per request.",
+                    QUERY_BUCKETS)
+GATE_REQUESTS = Counter("parking_gate_requests_total",
+                        "Writes per gate, by outcome (accepted, throttled, shed).",
+                        "gate")
+REGISTRY = [REQUEST_SECONDS, DB_SECONDS, SERIALIZER_SECONDS, QUERIES, GATE_REQUESTS]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        metric.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "serializer_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute_wrapper.
+        began = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - began
+
+
+request_stats = ContextVar("parking_request_stats", default=None)
+
+
+@contextlib.contextmanager
+def instrument_queries():
+    # Connections are per thread, so this runs again in every thread that
+    # queries on behalf of the request (see views.db_sync_to_async).
+    stats = request_stats.get()
+    if stats is None:
+        yield
+        return
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        yield
+
+
+@contextlib.contextmanager
+def serializer_timer():
+    stats = request_stats.get()
+    if stats is None:
+        yield
+        return
+    began = perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += perf_counter() - began
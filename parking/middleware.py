@@ -0,0 +1,279 @@
+import asyncio
+from time import perf_counter
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.text import compress_sequence, compress_string
+from parking.idempotency import MAX_KEY_LENGTH, PENDING, fingerprint, get_store, \
+    should_store
+from parking.metrics import DB_SECONDS, GATE_REQUESTS, QUERIES, REQUEST_SECONDS, \
+    SERIALIZER_SECONDS, RequestStats, instrument_queries, request_stats
+from parking.throttling import gate_of, get_buckets, pending_writes
+
+
+def route_name(request):
+    # Label the parking API views, everything else shares one series so the
+    # number of series stays bounded.
+    match = getattr(request, "resolver_match", None)
+    if match is None or not match.func.__module__.startswith("parking."):
+        return "other"
+    actions = getattr(match.func, "actions", None)
+    if actions is not None:
+        return actions.get(request.method.lower(), "other")
+    return match.func.__name__.replace("_async", "")
+
+
+def record(request, response, stats, began):
+    elapsed = perf_counter() - began
+    route = route_name(request)
+    REQUEST_SECONDS.observe(route, elapsed)
+    DB_SECONDS.observe(route, stats.db_time)
+    SERIALIZER_SECONDS.observe(route, stats.serializer_time)
+    QUERIES.observe(route, stats.queries)
+    response["Server-Timing"] = 'db;desc="{} queries";dur={:.2f}, ' \
+        'ser;dur={:.2f}, app;dur={:.2f}'.format(
+            stats.queries, stats.db_time * 1000, stats.serializer_time * 1000,
+            elapsed * 1000)
+    return response
+
+
+@sync_and_async_middleware
+def instrumentation_middleware(get_response):
+    """
+    Counts the queries, database time and serializer time of each request,
+    adds them to the response as a Server-Timing header and to the /metrics
+    histograms.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = RequestStats()
+            token = request_stats.set(stats)
+            began = perf_counter()
+            try:
+                with instrument_queries():
+                    response = await get_response(request)
+            finally:
+                request_stats.reset(token)
+            return record(request, response, stats, began)
+    else:
+        def middleware(request):
+            stats = RequestStats()
+            token = request_stats.set(stats)
+            began = perf_counter()
+            try:
+                with instrument_queries():
+                    response = get_response(request)
+            finally:
+                request_stats.reset(token)
+            return record(request, response, stats, began)
+    return middleware
+
+
+# Responses of the API worth compressing, the CSV export is gzipped already.
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "application/x-ndjson")
+BROTLI_QUALITY = 4
+
+
+def accepted_encoding(request):
+    accepted = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        try:
+            weight = float(params[2:]) if params.startswith("q=") else 1
+        except ValueError:
+            weight = 1
+        if weight > 0:
+            accepted.add(name.strip().lower())
+    if "br" in accepted:
+        try:
+            import brotli  # noqa: F401
+            return "br"
+        except ImportError:
+            pass
+    return "gzip" if "gzip" in accepted else None
+
+
+def brotli_sequence(sequence):
+    import brotli
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress(request, response):
+    content_type = response.get("Content-Type", "").split(";")[0]
+    if content_type not in COMPRESSIBLE_TYPES or response.has_header("Content-Encoding"):
+        return response
+    if not response.streaming and \
+            len(response.content) < getattr(settings, "PARKING_COMPRESS_MIN_SIZE", 1024):
+        return response
+    patch_vary_headers(response, ("Accept-Encoding",))
+    encoding = accepted_encoding(request)
+    if encoding is None:
+        return response
+    if response.streaming:
+        sequence = compress_sequence if encoding == "gzip" else brotli_sequence
+        response.streaming_content = sequence(response.streaming_content)
+        del response["Content-Length"]
+    else:
+        if encoding == "gzip":
+            content = compress_string(response.content)
+        else:
+            import brotli
+            content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response["Content-Length"] = str(len(content))
+    # The representation changed, a strong validator doesn't apply anymore.
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response["ETag"] = "W/" + etag
+    response["Content-Encoding"] = encoding
+    return response
+
+
+@sync_and_async_middleware
+def compression_middleware(get_response):
+    """
+    Compresses the large API responses (PARKING_COMPRESS_MIN_SIZE bytes and
+    more) with brotli when the client and the server support it, else gzip.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            return compress(request, await get_response(request))
+    else:
+        def middleware(request):
+            return compress(request, get_response(request))
+    return middleware
+
+
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def throttled(request):
+    return request.method in WRITE_METHODS and request.path.startswith("/api/")
+
+
+def admit(gate, wait):
+    # Returns the response turning the write away, or None once it counts as
+    # pending.
+    if wait is not None:
+        GATE_REQUESTS.inc(gate, "throttled")
+        return JsonResponse({"detail": "Too many requests from this gate."},
+                            status=429, headers={"Retry-After": str(wait)})
+    if not pending_writes.enter(getattr(settings, "PARKING_MAX_PENDING_WRITES", 0)):
+        GATE_REQUESTS.inc(gate, "shed")
+        return JsonResponse({"detail": "The server is busy, retry shortly."},
+                            status=503, headers={"Retry-After": "1"})
+    GATE_REQUESTS.inc(gate, "accepted")
+    return None
+
+
+@sync_and_async_middleware
+def rate_limit_middleware(get_response):
+    """
+    Turns away the API writes of a gate over its rate (token bucket, 429) and
+    the writes arriving while PARKING_MAX_PENDING_WRITES are in progress in
+    the process (503), before they reach the database.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not throttled(request):
+                return await get_response(request)
+            gate, buckets = gate_of(request), get_buckets()
+            rejected = admit(gate, await buckets.atake(gate) if buckets else None)
+            if rejected is not None:
+                return rejected
+            try:
+                return await get_response(request)
+            finally:
+                pending_writes.exit()
+    else:
+        def middleware(request):
+            if not throttled(request):
+                return get_response(request)
+            gate, buckets = gate_of(request), get_buckets()
+            rejected = admit(gate, buckets.take(gate) if buckets else None)
+            if rejected is not None:
+                return rejected
+            try:
+                return get_response(request)
+            finally:
+                pending_writes.exit()
+    return middleware
+
+
+def idempotency_key(request):
+    if request.method not in WRITE_METHODS:
+        return None
+    return request.headers.get("Idempotency-Key")
+
+
+def replay(entry, request_fingerprint):
+    if entry[0] != request_fingerprint:
+        return JsonResponse({"detail": "This Idempotency-Key was used for a "
+                                       "different request."}, status=422)
+    if entry[1] == PENDING:
+        return JsonResponse({"detail": "A request with this Idempotency-Key is "
+                                       "in progress."}, status=409,
+                            headers={"Retry-After": "1"})
+    status, content_type, content = entry[1:]
+    response = HttpResponse(content, status=status, content_type=content_type)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def invalid_key():
+    return JsonResponse({"detail": "The Idempotency-Key header must have at most "
+                                   "{} characters.".format(MAX_KEY_LENGTH)}, status=400)
+
+
+@sync_and_async_middleware
+def idempotency_middleware(get_response):
+    """
+    Writes sent with an Idempotency-Key header run once: the same key sent
+    again gets the stored response back without reaching the view.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            key = idempotency_key(request)
+            if key is None:
+                return await get_response(request)
+            if len(key) > MAX_KEY_LENGTH:
+                return invalid_key()
+            store = get_store()
+            key, request_fingerprint = store.key(key), fingerprint(request)
+            entry = await store.aclaim(key, request_fingerprint)
+            if entry is not None:
+                return replay(entry, request_fingerprint)
+            response = await get_response(request)
+            if should_store(response):
+                await store.asave(key, request_fingerprint, response)
+            else:
+                await store.arelease(key)
+            return response
+    else:
+        def middleware(request):
+            key = idempotency_key(request)
+            if key is None:
+                return get_response(request)
+            if len(key) > MAX_KEY_LENGTH:
+                return invalid_key()
+            store = get_store()
+            key, request_fingerprint = store.key(key), fingerprint(request)
+            entry = store.claim(key, request_fingerprint)
+            if entry is not None:
+                return replay(entry, request_fingerprint)
+            response = get_response(request)
+            if should_store(response):
+                store.save(key, request_fingerprint, response)
+            else:
+                store.release(key)
+            return response
+    return middleware
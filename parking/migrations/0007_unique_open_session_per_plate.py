@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0006_alter_parkingmodels_arrival_time_and_more'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='parkingmodels',
+            constraint=models.UniqueConstraint(condition=models.Q(('departure_time', None)), fields=('plate',), name='unique_open_session_per_plate'),
+        ),
+    ]
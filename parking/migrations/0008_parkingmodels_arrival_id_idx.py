@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0007_unique_open_session_per_plate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(fields=['arrival_time', 'id'], name='parking_arrival_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:35
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0008_parkingmodels_arrival_id_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parkingmodels',
+            name='plate',
+            field=models.CharField(max_length=8, validators=[django.core.validators.RegexValidator(message='Invalid plate, please use the format AAA-9999', regex='^[A-Z]{3}-[0-9]{4}$')]),
+        ),
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(fields=['plate', '-arrival_time'], name='parking_plate_arrival_idx'),
+        ),
+    ]
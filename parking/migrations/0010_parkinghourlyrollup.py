@@ -0,0 +1,24 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0009_parkingmodels_plate_arrival_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingHourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(unique=True)),
+                ('arrivals', models.PositiveIntegerField(default=0)),
+                ('departures', models.PositiveIntegerField(default=0)),
+                ('occupied_seconds', models.BigIntegerField(default=0)),
+                ('stay_seconds', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
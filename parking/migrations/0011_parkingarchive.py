@@ -0,0 +1,30 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0010_parkinghourlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('plate', models.CharField(max_length=8)),
+                ('paid', models.BooleanField(default=True)),
+                ('arrival_time', models.DateTimeField()),
+                ('departure_time', models.DateTimeField()),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='parkingarchive',
+            index=models.Index(fields=['plate', '-arrival_time'], name='parking_archive_plate_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0011_parkingarchive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='parkingarchive',
+            index=models.Index(fields=['updated_at', 'id'], name='parking_archive_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(fields=['updated_at', 'id'], name='parking_updated_id_idx'),
+        ),
+    ]
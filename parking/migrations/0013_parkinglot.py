@@ -0,0 +1,45 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0012_export_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=32, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('capacity', models.PositiveIntegerField()),
+                ('occupied', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='parkingmodels',
+            name='lot',
+            field=models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='parking.parkinglot'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='parkingmodels',
+            name='unique_open_session_per_plate',
+        ),
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(fields=['lot', 'arrival_time', 'id'], name='parking_lot_arrival_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='parkingmodels',
+            constraint=models.UniqueConstraint(condition=models.Q(('departure_time', None), ('lot', None)), fields=('plate',), name='unique_open_session_per_plate'),
+        ),
+        migrations.AddConstraint(
+            model_name='parkingmodels',
+            constraint=models.UniqueConstraint(condition=models.Q(('departure_time', None)), fields=('lot', 'plate'), name='unique_open_session_per_lot_plate'),
+        ),
+    ]
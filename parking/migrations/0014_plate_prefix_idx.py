@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0013_parkinglot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(fields=['plate'], name='parking_plate_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0014_plate_prefix_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('overstay', 'Parked for too long'), ('paid_not_left', 'Paid but not left')], max_length=16)),
+                ('plate', models.CharField(max_length=8)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParkingScanState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('watermark', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(condition=models.Q(('departure_time', None)), fields=['arrival_time'], name='parking_open_arrival_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parkingmodels',
+            index=models.Index(condition=models.Q(('departure_time', None), ('paid', True)), fields=['updated_at'], name='parking_paid_open_idx'),
+        ),
+        migrations.AddField(
+            model_name='parkingalert',
+            name='session',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='alerts', to='parking.parkingmodels'),
+        ),
+        migrations.AddConstraint(
+            model_name='parkingalert',
+            constraint=models.UniqueConstraint(fields=('session', 'kind'), name='unique_alert_per_session_kind'),
+        ),
+    ]
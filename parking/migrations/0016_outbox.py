@@ -0,0 +1,35 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:07
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0015_alerts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParkingOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=16)),
+                ('plate', models.CharField(max_length=8)),
+                ('session_id', models.BigIntegerField()),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=datetime.datetime.now)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=32)),
+                ('last_error', models.TextField(blank=True)),
+                ('failed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='parkingoutbox',
+            index=models.Index(fields=['plate', 'id'], name='parking_outbox_plate_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0016_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingarchive',
+            name='lot',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_sessions', to='parking.parkinglot'),
+        ),
+    ]
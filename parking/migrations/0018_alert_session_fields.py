@@ -0,0 +1,39 @@
+# Generated by Django 4.0.6 on 2026-10-18 07:25
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def copy_session_fields(apps, schema_editor):
+    # The existing alerts take the lot and arrival time of their session,
+    # live or already archived.
+    db = schema_editor.connection.alias
+    ParkingAlert = apps.get_model('parking', 'ParkingAlert')
+    for name in ('ParkingModels', 'ParkingArchive'):
+        sessions = apps.get_model('parking', name).objects.using(db) \
+            .filter(id=OuterRef('session_id'))
+        ParkingAlert.objects.using(db).filter(arrival_time=None).update(
+            lot_id=Subquery(sessions.values('lot_id')[:1]),
+            arrival_time=Subquery(sessions.values('arrival_time')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parking', '0017_archive_lot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parkingalert',
+            name='arrival_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='parkingalert',
+            name='lot',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='alerts', to='parking.parkinglot'),
+        ),
+        migrations.RunPython(copy_session_fields, migrations.RunPython.noop),
+    ]
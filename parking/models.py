@@ -1,27 +1,128 @@
 from queue import Empty
-from django.db import models
+from datetime import datetime
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.sql import UpdateQuery
 from  django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from parking.signals import sessions_changed
 
 ERR_PLATE_MSG = 'Invalid plate, please use the format AAA-9999'
 ERR_DEPARTURE_NOT_PAID = "You cannot register the departure without confirming the payment"
 ERR_DUPLICATED_NO_FINISHED = "It is not possible to enter this data because " \
                     "the same plate is in a record without having been finalized."
+ERR_ALREADY_LEFT = "This vehicle has already left the parking."
+ERR_NO_OPEN_SESSION = "There is no session without departure for this plate."
+
+PLATE_VALIDATOR = RegexValidator(
+    regex='^[A-Z]{3}-[0-9]{4}$',
+    message=ERR_PLATE_MSG,
+)
+
+
+class ParkingQuerySet(models.QuerySet):
+    def update_returning(self, **kwargs):
+        # Same as update(), but the changed rows come back from the UPDATE
+        # itself (UPDATE ... RETURNING), so no separate re-read is needed.
+        self._for_write = True
+        query = self.query.chain(UpdateQuery)
+        query.add_update_values(kwargs)
+        query.annotations = {}
+        compiler = query.get_compiler(self.db)
+        sql, params = compiler.as_sql()
+        columns = ", ".join(compiler.quote_name_unless_alias(f.column)
+                            for f in self.model._meta.concrete_fields)
+        return list(self.model.objects.raw(
+            "{} RETURNING {}".format(sql, columns), params, using=self.db))
+
+    def pay(self):
+        # Paying is only possible while the vehicle is still inside. The
+        # change and its outbox entry (parking/outbox.py) are written in one
+        # transaction.
+        with transaction.atomic(using=self.db):
+            rows = self.filter(departure_time=None).update_returning(
+                paid=True, updated_at=datetime.now())
+            return self._changed(rows, "payment")
+
+    def check_out(self):
+        # The departure is only registered for paid sessions that are still
+        # open, so a concurrent double-tap is resolved by the database.
+        now = datetime.now()
+        with transaction.atomic(using=self.db):
+            rows = self.filter(paid=True, departure_time=None).update_returning(
+                departure_time=now, updated_at=now)
+            return self._changed(rows, "departure")
+
+    def _changed(self, rows, event):
+        if not rows:
+            return None
+        sessions_changed.send(sender=self.model, sessions=rows, event=event)
+        return rows[0]
+
+
+class ParkingLot(models.Model):
+    # A facility. Its row and its sessions live in the database of the lot,
+    # see parking/lots.py. "occupied" is a counter kept by the arrivals and
+    # departures, so the capacity is enforced without counting the sessions.
+    slug = models.SlugField(max_length=32, unique=True)
+    name = models.CharField(max_length=100)
+    capacity = models.PositiveIntegerField()
+    occupied = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return self.slug
+
 
 class ParkingModels(models.Model):
-    plate = models.CharField(max_length=8, null=False, blank=False, validators=[
-            RegexValidator(
-                regex='^[A-Z]{3}-[0-9]{4}$',
-                message=ERR_PLATE_MSG,
-            ),
-        ], db_index=True)
+    # Indexed by parking_lot_arrival_id_idx.
+    lot = models.ForeignKey(ParkingLot, null=True, blank=True, default=None,
+                            on_delete=models.PROTECT, related_name="sessions",
+                            db_index=False)
+    plate = models.CharField(max_length=8, null=False, blank=False,
+                             validators=[PLATE_VALIDATOR])
     paid = models.BooleanField(default=False)
     arrival_time = models.DateTimeField(auto_now_add=True)
     departure_time = models.DateTimeField(null=True, blank=True, default=None)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ParkingQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Only one session without departure per plate (per lot, for the
+            # sessions of a lot). The database enforces it, so the create path
+            # doesn't need a pre-check query.
+            models.UniqueConstraint(fields=['plate'],
+                                    condition=Q(departure_time=None, lot=None),
+                                    name='unique_open_session_per_plate'),
+            models.UniqueConstraint(fields=['lot', 'plate'],
+                                    condition=Q(departure_time=None),
+                                    name='unique_open_session_per_lot_plate'),
+        ]
+        indexes = [
+            models.Index(fields=['arrival_time', 'id'],
+                         name='parking_arrival_id_idx'),
+            # Plate history, most recent first. It also serves every other
+            # lookup by plate.
+            models.Index(fields=['plate', '-arrival_time'],
+                         name='parking_plate_arrival_idx'),
+            # Incremental exports (high-water mark).
+            models.Index(fields=['updated_at', 'id'],
+                         name='parking_updated_id_idx'),
+            models.Index(fields=['lot', 'arrival_time', 'id'],
+                         name='parking_lot_arrival_id_idx'),
+            # Plate prefix search (LIKE 'ABC%') in the admin, which the
+            # default collation can't do with the other plate index.
+            models.Index(fields=['plate'], name='parking_plate_prefix_idx',
+                         opclasses=['varchar_pattern_ops']),
+            # Alert scans (parking/alerts.py), over the open sessions only.
+            models.Index(fields=['arrival_time'], name='parking_open_arrival_idx',
+                         condition=Q(departure_time=None)),
+            models.Index(fields=['updated_at'], name='parking_paid_open_idx',
+                         condition=Q(paid=True, departure_time=None)),
+        ]
+
     def __str__(self) -> str:
         return self.plate
 
@@ -29,11 +130,110 @@ class ParkingModels(models.Model):
         errors = dict()
         if self.departure_time is not None and self.paid is False:
             errors["paid"] = ValidationError(ERR_DEPARTURE_NOT_PAID)
-        dt = ParkingModels.objects.filter(~Q(id=self.id) & 
-                                          Q(plate=self.plate) &
-                                          Q(departure_time=None))
-        if len(dt) > 0:
+        if ParkingModels.objects.filter(~Q(id=self.id) & Q(plate=self.plate) &
+                                        Q(lot=self.lot_id) & Q(departure_time=None)).exists():
             errors["plate"] = ValidationError(ERR_DUPLICATED_NO_FINISHED)
         if errors:
             raise ValidationError(errors)
-        super().clean()
\ No newline at end of file
+        super().clean()
+
+class ParkingHourlyRollup(models.Model):
+    # Closed sessions aggregated per hour, see parking/rollups.py.
+    bucket = models.DateTimeField(unique=True)
+    arrivals = models.PositiveIntegerField(default=0)
+    departures = models.PositiveIntegerField(default=0)
+    occupied_seconds = models.BigIntegerField(default=0)
+    stay_seconds = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return self.bucket.isoformat()
+
+
+class ParkingArchive(models.Model):
+    # Closed sessions moved out of ParkingModels by archive_sessions, with
+    # their original id, lot and timestamps, in the database of their lot.
+    id = models.BigIntegerField(primary_key=True)
+    lot = models.ForeignKey(ParkingLot, null=True, blank=True, default=None,
+                            on_delete=models.DO_NOTHING, db_constraint=False,
+                            related_name="archived_sessions", db_index=False)
+    plate = models.CharField(max_length=8)
+    paid = models.BooleanField(default=True)
+    arrival_time = models.DateTimeField()
+    departure_time = models.DateTimeField()
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['plate', '-arrival_time'],
+                         name='parking_archive_plate_idx'),
+            models.Index(fields=['updated_at', 'id'],
+                         name='parking_archive_updated_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return self.plate
+
+
+class ParkingAlert(models.Model):
+    # A session flagged by scan_alerts, once per kind. The session may be
+    # archived later, so there is no foreign key constraint.
+    OVERSTAY = "overstay"
+    PAID_NOT_LEFT = "paid_not_left"
+    KINDS = ((OVERSTAY, "Parked for too long"), (PAID_NOT_LEFT, "Paid but not left"))
+
+    session = models.ForeignKey(ParkingModels, on_delete=models.DO_NOTHING,
+                                db_constraint=False, related_name="alerts")
+    kind = models.CharField(max_length=16, choices=KINDS)
+    # Copied from the session, so the alert can be listed once it's archived.
+    lot = models.ForeignKey(ParkingLot, null=True, blank=True, default=None,
+                            on_delete=models.DO_NOTHING, db_constraint=False,
+                            related_name="alerts", db_index=False)
+    arrival_time = models.DateTimeField(null=True)
+    plate = models.CharField(max_length=8)
+    detected_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'kind'],
+                                    name='unique_alert_per_session_kind'),
+        ]
+
+    def __str__(self) -> str:
+        return "{} {}".format(self.kind, self.plate)
+
+
+class ParkingScanState(models.Model):
+    # High-water mark of each alert scan, see parking/alerts.py.
+    name = models.CharField(max_length=32, unique=True)
+    watermark = models.DateTimeField(null=True)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class ParkingOutbox(models.Model):
+    # sessions_changed events, recorded in the transaction of the change and
+    # delivered by outbox_worker, see parking/outbox.py. Delivered entries
+    # are deleted, "failed" ones are kept once out of attempts.
+    event = models.CharField(max_length=16)
+    plate = models.CharField(max_length=8)
+    session_id = models.BigIntegerField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=datetime.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Delivery in order for each plate.
+            models.Index(fields=['plate', 'id'], name='parking_outbox_plate_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return "{} {}".format(self.event, self.plate)
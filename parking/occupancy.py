@@ -0,0 +1,140 @@
+import logging
+import uuid
+from datetime import datetime
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.dispatch import receiver
+from parking.backends import FakeRedis, get_redis
+from parking.signals import sessions_changed
+
+logger = logging.getLogger(__name__)
+
+OCCUPANCY_KEY = "parking:occupancy"
+WARM_CHUNK_SIZE = 5000
+
+
+class OccupancyIndex:
+    """
+    Index of the sessions currently open, plate -> (id, arrival_time), kept
+    in a Redis hash. The process-local flavour uses FakeRedis.
+    """
+
+    def __init__(self, client, key=OCCUPANCY_KEY):
+        self.client = client
+        self.key = key
+        self.warm = False
+
+    @staticmethod
+    def _decode(value):
+        id, arrival_time = value.split("|", 1)
+        return int(id), datetime.fromisoformat(arrival_time)
+
+    def lookup(self, plate):
+        value = self.client.hget(self.key, plate)
+        return None if value is None else self._decode(value)
+
+    def add(self, plate, id, arrival_time):
+        self.client.hset(self.key, plate,
+                         "{}|{}".format(id, arrival_time.isoformat()))
+
+    def discard(self, plate, id):
+        # Only drop the entry if it still belongs to this session, the plate
+        # may already have a newer one.
+        session = self.lookup(plate)
+        if session is not None and session[0] == id:
+            self.client.hdel(self.key, plate)
+
+    def count(self):
+        return self.client.hlen(self.key)
+
+    def items(self):
+        return {plate: self._decode(value)
+                for plate, value in self.client.hgetall(self.key).items()}
+
+    def rebuild(self, sessions):
+        # Built aside and swapped in with RENAME, so the other workers never
+        # see a partial index (or an empty one, letting duplicates in).
+        building = "{}:rebuild:{}".format(self.key, uuid.uuid4().hex)
+        mapping = {}
+        written = False
+        for plate, id, arrival_time in sessions:
+            mapping[plate] = "{}|{}".format(id, arrival_time.isoformat())
+            if len(mapping) >= WARM_CHUNK_SIZE:
+                self.client.hset(building, mapping=mapping)
+                mapping = {}
+                written = True
+        if mapping:
+            self.client.hset(building, mapping=mapping)
+            written = True
+        if written:
+            self.client.rename(building, self.key)
+        else:
+            self.client.delete(self.key)
+        self.warm = True
+
+
+_index = None
+
+
+def index_enabled():
+    return getattr(settings, "PARKING_OCCUPANCY_INDEX", False)
+
+
+def open_sessions():
+    from parking.models import ParkingModels
+    return ParkingModels.objects.filter(departure_time=None, lot=None) \
+        .values_list("plate", "id", "arrival_time") \
+        .iterator(chunk_size=WARM_CHUNK_SIZE)
+
+
+def get_index(warm=True):
+    global _index
+    if _index is None:
+        url = getattr(settings, "PARKING_OCCUPANCY_REDIS_URL", None)
+        _index = OccupancyIndex(get_redis(url) if url else FakeRedis())
+    if warm and not _index.warm:
+        if _index.count():
+            # Shared, and kept up to date by the other workers: rebuilding
+            # it would overwrite their updates made in the meantime with a
+            # snapshot that may already be stale.
+            _index.warm = True
+        else:
+            _index.rebuild(open_sessions())
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def warm_on_startup():
+    if not index_enabled():
+        return
+    try:
+        get_index()
+    except DatabaseError:
+        # The index is warmed again on first use.
+        logger.warning("Could not warm the occupancy index", exc_info=True)
+
+
+@receiver(sessions_changed)
+def update_occupancy(sender, sessions, event, **kwargs):
+    # A cold index is built from the database on first use, so there is
+    # nothing to keep up to date until then.
+    if not index_enabled() or _index is None or not _index.warm:
+        return
+    index = _index
+    # The sessions of the lots have their own counters, see parking/lots.py.
+    changes = [(s.plate, s.id, s.arrival_time,
+                event != "delete" and s.departure_time is None)
+               for s in sessions if s.lot_id is None]
+
+    def apply():
+        for plate, id, arrival_time, inside in changes:
+            if inside:
+                index.add(plate, id, arrival_time)
+            else:
+                index.discard(plate, id)
+
+    transaction.on_commit(apply)
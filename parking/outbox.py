@@ -0,0 +1,117 @@
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
+from parking.metrics import REGISTRY, Gauge
+from parking.models import ParkingModels, ParkingOutbox
+from parking.signals import by_database, outbox_event, sessions_changed
+
+MAX_ATTEMPTS = 10
+MAX_BACKOFF = 300
+# Only the gate transitions go through the outbox: the saves and deletions
+# (admin edits, archive_sessions) have no consumer.
+OUTBOX_EVENTS = ("arrival", "payment", "departure")
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def isoformat(value):
+    # Instances created with string dates keep them until reloaded.
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+@receiver(sessions_changed)
+def record_events(sender, sessions, event, **kwargs):
+    # Runs in the transaction of the write, on the database of the sessions.
+    if event not in OUTBOX_EVENTS:
+        return
+    now = datetime.now()
+    for db, group in by_database(sessions).items():
+        ParkingOutbox.objects.using(db).bulk_create([ParkingOutbox(
+            event=event, plate=s.plate, session_id=s.id, available_at=now, payload={
+                "paid": s.paid,
+                "arrival_time": isoformat(s.arrival_time),
+                "departure_time": isoformat(s.departure_time),
+                "lot": s.lot_id,
+            }) for s in group])
+
+
+def session_of(entry):
+    payload = entry.payload
+    departure = payload["departure_time"]
+    return ParkingModels(id=entry.session_id, plate=entry.plate, paid=payload["paid"],
+                         arrival_time=parse_datetime(payload["arrival_time"]),
+                         departure_time=departure and parse_datetime(departure),
+                         lot_id=payload["lot"])
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(2 ** attempts, MAX_BACKOFF))
+
+
+def claim(db, batch_size, lease):
+    """
+    Leases up to batch_size deliverable entries to this worker: the oldest
+    pending entry of each plate, so the events of a plate are delivered one
+    after the other, in order, whatever the number of workers.
+    """
+    now = datetime.now()
+    token = uuid.uuid4().hex
+    earlier = ParkingOutbox.objects.using(db).filter(
+        plate=OuterRef("plate"), id__lt=OuterRef("id"), failed=False)
+    with transaction.atomic(using=db):
+        ids = list(ParkingOutbox.objects.using(db)
+                   .filter(Q(locked_until=None) | Q(locked_until__lt=now),
+                           failed=False, available_at__lte=now)
+                   .filter(~Exists(earlier))
+                   .order_by("id").select_for_update(skip_locked=True)
+                   .values_list("id", flat=True)[:batch_size])
+        ParkingOutbox.objects.using(db).filter(id__in=ids) \
+            .update(locked_until=now + lease, locked_by=token)
+    return token, list(ParkingOutbox.objects.using(db)
+                       .filter(id__in=ids, locked_by=token).order_by("id"))
+
+
+def deliver(db, token, entry):
+    """
+    Sends outbox_event for the entry and deletes it in one transaction (on
+    the default database and on the entry's). Returns the error on failure,
+    after scheduling the entry for a retry.
+    """
+    try:
+        with transaction.atomic(), transaction.atomic(using=db):
+            outbox_event.send(sender=ParkingOutbox, session=session_of(entry),
+                              event=entry.event)
+            if not ParkingOutbox.objects.using(db) \
+                    .filter(id=entry.id, locked_by=token).delete()[0]:
+                # Leased to another worker in the meantime.
+                raise LeaseLost()
+    except LeaseLost:
+        return None
+    except Exception as exc:
+        attempts = entry.attempts + 1
+        ParkingOutbox.objects.using(db).filter(id=entry.id, locked_by=token).update(
+            attempts=attempts, available_at=datetime.now() + backoff(attempts),
+            locked_until=None, locked_by="", failed=attempts >= MAX_ATTEMPTS,
+            last_error=traceback.format_exc()[-2000:])
+        return exc
+    return None
+
+
+def lag(db="default"):
+    # Age of the oldest event not delivered yet, in seconds.
+    oldest = ParkingOutbox.objects.using(db).filter(failed=False) \
+        .order_by("id").values_list("created_at", flat=True).first()
+    return 0 if oldest is None else (datetime.now() - oldest).total_seconds()
+
+
+REGISTRY.append(Gauge("parking_outbox_lag_seconds",
+                      "Age of the oldest outbox event not delivered yet.", lag))
+REGISTRY.append(Gauge("parking_outbox_failed",
+                      "Outbox events given up after MAX_ATTEMPTS.",
+                      lambda: ParkingOutbox.objects.filter(failed=True).count()))
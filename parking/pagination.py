@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ParkingCursorPagination(CursorPagination):
+    # Keyset pagination over the (arrival_time, id) index, so every page costs
+    # the same no matter how deep into the history it is.
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('arrival_time', 'id')
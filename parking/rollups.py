@@ -0,0 +1,94 @@
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from parking.models import ParkingHourlyRollup
+from parking.signals import outbox_event
+
+HOUR = timedelta(hours=1)
+ROLLUP_FIELDS = ("arrivals", "departures", "occupied_seconds", "stay_seconds")
+
+
+def hour_of(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def add_session(deltas, arrival, departure, since=None):
+    """
+    Adds what a closed session contributes to each hour: its arrival, its
+    departure and stay, and the seconds it was parked in every hour it spans.
+    Hours before "since" are skipped.
+    """
+    def add(bucket, index, value):
+        if since is None or bucket >= since:
+            deltas.setdefault(bucket, [0, 0, 0, 0])[index] += value
+
+    add(hour_of(arrival), 0, 1)
+    add(hour_of(departure), 1, 1)
+    add(hour_of(departure), 3, round((departure - arrival).total_seconds()))
+    bucket = hour_of(arrival)
+    while bucket <= departure:
+        seconds = (min(bucket + HOUR, departure) - max(bucket, arrival)).total_seconds()
+        if seconds > 0:
+            add(bucket, 2, round(seconds))
+        bucket += HOUR
+
+
+def apply_deltas(deltas):
+    for bucket, values in sorted(deltas.items()):
+        changes = {field: F(field) + value for field, value in zip(ROLLUP_FIELDS, values)}
+        if ParkingHourlyRollup.objects.filter(bucket=bucket).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                ParkingHourlyRollup.objects.create(bucket=bucket,
+                                                   **dict(zip(ROLLUP_FIELDS, values)))
+        except IntegrityError:
+            # Created by a concurrent departure in the meantime.
+            ParkingHourlyRollup.objects.filter(bucket=bucket).update(**changes)
+
+
+@receiver(outbox_event)
+def update_rollups(sender, session, event, **kwargs):
+    # Delivered by outbox_worker, in one transaction with the removal of the
+    # event from the outbox, so each departure is counted once.
+    if event != "departure":
+        return
+    deltas = {}
+    add_session(deltas, session.arrival_time, session.departure_time)
+    apply_deltas(deltas)
+
+
+def hourly_stats(start, end):
+    """Occupancy, stays and turnover between start and end, from the rollups only."""
+    rows = ParkingHourlyRollup.objects.filter(bucket__gte=hour_of(start), bucket__lt=end) \
+        .order_by("bucket").values_list("bucket", *ROLLUP_FIELDS)
+    hours = []
+    totals = [0, 0, 0, 0]
+    for bucket, arrivals, departures, occupied, stay in rows:
+        hours.append({
+            "hour": bucket,
+            "arrivals": arrivals,
+            "departures": departures,
+            "occupancy": round(occupied / 3600, 2),
+            "average_stay_minutes": round(stay / departures / 60, 1)
+            if departures else None,
+        })
+        for index, value in enumerate((arrivals, departures, occupied, stay)):
+            totals[index] += value
+
+    arrivals, departures, occupied, stay = totals
+    average_occupancy = occupied / 3600 / max((end - hour_of(start)) / HOUR, 1)
+    return {
+        "hours": hours,
+        "totals": {
+            "arrivals": arrivals,
+            "departures": departures,
+            "average_occupancy": round(average_occupancy, 2),
+            "average_stay_minutes": round(stay / departures / 60, 1)
+            if departures else None,
+            # How many times, on average, each occupied space changed car.
+            "turnover": round(departures / average_occupancy, 2)
+            if average_occupancy else None,
+        },
+    }
@@ -0,0 +1,79 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from django.conf import settings
+
+# Alias of the replica the current request reads from, None for the primary.
+read_replica = ContextVar("read_replica", default=None)
+
+PRIMARY_COOKIE = "parking_primary"
+
+
+def replicas():
+    return getattr(settings, "PARKING_REPLICAS", [])
+
+
+def sticky_seconds():
+    return getattr(settings, "PARKING_REPLICA_STICKY_SECONDS", 5)
+
+
+def choose_replica(request):
+    # One replica per request, so all its reads see the same point in time.
+    # A client that wrote recently keeps reading its own writes from the
+    # primary until the replicas have caught up.
+    aliases = replicas()
+    if not aliases or PRIMARY_COOKIE in request.COOKIES:
+        return None
+    return random.choice(aliases)
+
+
+def pin_to_primary(response):
+    response.set_cookie(PRIMARY_COOKIE, "1", max_age=sticky_seconds(),
+                        httponly=True, samesite="Lax")
+
+
+@contextmanager
+def use_replica(alias):
+    token = read_replica.set(alias)
+    try:
+        yield
+    finally:
+        read_replica.reset(token)
+
+
+def in_current_context(iterable):
+    # Streaming responses are consumed after the view returned, their reads
+    # still go where the view's would.
+    context = copy_context()
+    iterator = iter(iterable)
+
+    def run():
+        while True:
+            try:
+                yield context.run(next, iterator)
+            except StopIteration:
+                return
+    return run()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == "parking":
+            return read_replica.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Instances are saved back where they were read from (the shard of
+        # their lot), except when they were read from a replica.
+        instance = hints.get("instance")
+        db = instance._state.db if instance is not None else None
+        if db is None or db.startswith("replica"):
+            return "default"
+        return db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication.
+        return False if db.startswith("replica") else None
@@ -1,7 +1,36 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from parking.models import ParkingModels
+from parking.models import ParkingModels, ERR_DUPLICATED_NO_FINISHED, PLATE_VALIDATOR
+from parking.metrics import serializer_timer
 import datetime
 
+# Columns read by the fast path, in the order represent_rows() unpacks them.
+FAST_FIELDS = ("id", "plate", "paid", "arrival_time", "departure_time")
+
+
+def represent_rows(rows, now=None):
+    """
+    Read-only equivalent of ParkingSerializer(many=True).data for rows of
+    FAST_FIELDS tuples (values_list()), with the same output. "now" is taken
+    once for the whole list instead of once per row.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    data = []
+    append = data.append
+    with serializer_timer():
+        for id, plate, paid, arrival, departure in rows:
+            minutes = round(((now if departure is None else departure) - arrival)
+                            .total_seconds() / 60)
+            append({
+                "id": id,
+                "plate": plate,
+                "paid": paid,
+                "time": "{} minute{}".format(minutes, "" if minutes == 1 else "s"),
+                "left": departure is not None,
+            })
+    return data
+
 
 class ParkingSerializer(serializers.ModelSerializer):
     class Meta:
@@ -9,12 +38,18 @@ class ParkingSerializer(serializers.ModelSerializer):
         fields = ["id", "plate", "paid"]
         extra_kwargs = {'paid': {'read_only': True}}
     
-    def validate(self, attrs):
-        # This is necessary to force the validation of the ParkingModel (clean),
-        # since the restframework doesn't do this automatically.
-        instance = ParkingModels(**attrs)
-        instance.clean()
-        return attrs
+    def create(self, validated_data):
+        # The "one open session per plate" rule is enforced by a partial unique
+        # index, so a single INSERT is enough: no pre-check SELECT and no race
+        # between the check and the insert. The occupancy index isn't asked:
+        # it may lag behind the database (another worker's departure), and
+        # a stale entry would keep the plate out.
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                {"plate": [ERR_DUPLICATED_NO_FINISHED]})
 
     def calc_time_parking(self, arrival, departure):
         if departure is None:
@@ -28,8 +63,35 @@ class ParkingSerializer(serializers.ModelSerializer):
         return "{} minute".format(duration_min)
 
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-        representation['time'] = self.calc_time_parking(instance.arrival_time,
-                                                        instance.departure_time)
-        representation['left'] = instance.departure_time is not None
-        return representation
\ No newline at end of file
+        with serializer_timer():
+            representation = super().to_representation(instance)
+            representation['time'] = self.calc_time_parking(instance.arrival_time,
+                                                            instance.departure_time)
+            representation['left'] = instance.departure_time is not None
+        return representation
+
+
+class ParkingEventSerializer(serializers.Serializer):
+    EVENTS = ("arrival", "payment", "departure")
+
+    event = serializers.ChoiceField(choices=EVENTS)
+    plate = serializers.CharField(max_length=8, required=False,
+                                  validators=[PLATE_VALIDATOR])
+    id = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        # Arrivals are identified by the plate, payments and departures by
+        # the id of the session.
+        field = "plate" if attrs["event"] == "arrival" else "id"
+        if field not in attrs:
+            raise serializers.ValidationError(
+                {field: [self.fields[field].error_messages["required"]]})
+        return attrs
+
+
+class ParkingEdgeEventSerializer(serializers.Serializer):
+    # An event recorded by an edge node (see parking/edge.py): the session is
+    # identified by the plate and "at" is the time it happened at the gate.
+    event = serializers.ChoiceField(choices=ParkingEventSerializer.EVENTS)
+    plate = serializers.CharField(max_length=8, validators=[PLATE_VALIDATOR])
+    at = serializers.DateTimeField()
@@ -0,0 +1,36 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+# Sent whenever parking sessions change, including the bulk and
+# UPDATE ... RETURNING paths that don't emit post_save. Arguments:
+# "sessions" (the changed ParkingModels) and "event" ("arrival", "payment",
+# "departure", "save" or "delete"). It is sent inside the write's transaction,
+# receivers that must only see committed data use transaction.on_commit.
+sessions_changed = Signal()
+
+# Sent by outbox_worker (parking/outbox.py) for every "arrival", "payment"
+# and "departure" sessions_changed event once its write committed, in order
+# for each plate and in a transaction with the removal of the event from the
+# outbox. Arguments: "session" (the ParkingModels as of the event, not saved)
+# and "event". An exception makes the worker retry the event later.
+outbox_event = Signal()
+
+
+def by_database(sessions):
+    # The sessions grouped by the database they were written to, a lot's
+    # shard or "default": on_commit callbacks must be registered there.
+    groups = {}
+    for s in sessions:
+        groups.setdefault(s._state.db or "default", []).append(s)
+    return groups
+
+
+@receiver(post_save, sender='parking.ParkingModels')
+def parking_saved(sender, instance, created, **kwargs):
+    sessions_changed.send(sender=sender, sessions=[instance],
+                          event="arrival" if created else "save")
+
+
+@receiver(post_delete, sender='parking.ParkingModels')
+def parking_deleted(sender, instance, **kwargs):
+    sessions_changed.send(sender=sender, sessions=[instance], event="delete")
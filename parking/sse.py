@@ -0,0 +1,57 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+from parking.events import get_broker
+
+EVENTS_PATH = "/api/v1/parking/events/"
+KEEPALIVE_SECONDS = 15
+
+
+async def sse_application(scope, receive, send):
+    """
+    ASGI application streaming the gate events as Server-Sent Events. It is
+    served next to Django (see parkingmanager/asgi.py) since a long-lived
+    response would hold a worker thread under WSGI. ?plate=AAA-9999 only
+    sends the events of that plate.
+    """
+    if scope["method"] != "GET":
+        await send({"type": "http.response.start", "status": 405,
+                    "headers": [(b"allow", b"GET")]})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    plate = parse_qs(scope.get("query_string", b"").decode()).get("plate", [None])[0]
+    subscription = get_broker().subscribe()
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"text/event-stream"),
+        (b"cache-control", b"no-cache"),
+        (b"x-accel-buffering", b"no"),
+    ]})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    sequence = 0
+    try:
+        while not watcher.done():
+            getter = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait({getter, watcher}, timeout=KEEPALIVE_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                if not watcher.done():
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n",
+                                "more_body": True})
+                continue
+            event = getter.result()
+            if plate is not None and event["plate"] != plate:
+                continue
+            sequence += 1
+            message = "id: {}\nevent: {}\ndata: {}\n\n".format(
+                sequence, event["event"], json.dumps(event, separators=(",", ":")))
+            await send({"type": "http.response.body", "body": message.encode(),
+                        "more_body": True})
+    finally:
+        subscription.close()
+        watcher.cancel()
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
+
+DAY = 24 * 3600
+
+
+@dataclass(frozen=True)
+class Tariff:
+    """
+    Parking fees, in cents, evaluated on arrays of sessions at once.
+
+    - Stays up to grace_minutes are free.
+    - Every started hour is charged by the tier it falls in: tiers is a list of
+      (last hour of the tier, cents per hour), the last one open ended (None).
+    - Full hours inside the night window (night_start to night_end, "HH:MM",
+      local time) are charged night_rate instead.
+    - Each 24 hours of a stay cost at most daily_cap.
+    """
+    grace_minutes: int = 15
+    tiers: tuple = ((1, 500), (3, 300), (None, 200))
+    night_start: str = "22:00"
+    night_end: str = "06:00"
+    night_rate: int = 100
+    daily_cap: int = 3000
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**getattr(settings, "PARKING_TARIFF", {}))
+
+    @staticmethod
+    def _seconds_of_day(value):
+        hours, minutes = value.split(":")
+        return int(hours) * 3600 + int(minutes) * 60
+
+    def _night_seconds(self, t):
+        # Night seconds elapsed between the epoch and t (seconds), so the night
+        # time of [a, b) is simply _night_seconds(b) - _night_seconds(a).
+        start = self._seconds_of_day(self.night_start)
+        end = self._seconds_of_day(self.night_end)
+        days, second = np.divmod(t, DAY)
+        if start > end:
+            length = DAY - start + end
+            within = np.minimum(second, end) + np.maximum(second - start, 0)
+        else:
+            length = end - start
+            within = np.clip(second - start, 0, length)
+        return days * length + within
+
+    def _tiered(self, hours):
+        cost = np.zeros_like(hours)
+        lower = 0
+        for upper, rate in self.tiers:
+            upper = np.iinfo(np.int64).max if upper is None else upper
+            cost += rate * np.clip(hours - lower, 0, upper - lower)
+            lower = upper
+        return cost
+
+    def fees(self, arrivals, departures):
+        """Fees in cents (int64 array) for arrays of arrival/departure times."""
+        start = np.asarray(arrivals, dtype="datetime64[s]").astype(np.int64)
+        end = np.asarray(departures, dtype="datetime64[s]").astype(np.int64)
+        duration = np.maximum(end - start, 0)
+
+        full_days, rest = np.divmod(duration, DAY)
+        rest_start = start + full_days * DAY
+        hours = -(-rest // 3600)
+        night = (self._night_seconds(end) - self._night_seconds(rest_start)) // 3600
+        night = np.minimum(night, hours)
+        partial = self._tiered(hours - night) + night * self.night_rate
+        fees = full_days * self.daily_cap + np.minimum(partial, self.daily_cap)
+        return np.where(duration <= self.grace_minutes * 60, 0, fees)
+
+    def fee(self, arrival, departure=None):
+        """Fee of a single session, as a Decimal amount."""
+        if departure is None:
+            departure = datetime.now()
+        cents = int(self.fees([arrival], [departure])[0])
+        return Decimal(cents).scaleb(-2)
@@ -1,9 +1,41 @@
+from asgiref.sync import async_to_sync
+from django.core.cache import cache, caches
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
-from rest_framework.test import APITestCase
-from parking.models import ParkingModels
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+from parking.backends import FakeRedis
+from parking.edge import get_log
+from parking.fuzzy import FuzzyPlateIndex, distance, get_fuzzy_index, reset_fuzzy_index
+from parking.events import LocalBroker, RedisBroker, set_broker
+from parking.models import ParkingAlert, ParkingArchive, ParkingHourlyRollup, ParkingLot, \
+    ParkingModels, ParkingOutbox
+from parking.occupancy import OccupancyIndex, get_index, reset_index
+from parking.metrics import GATE_REQUESTS
+from parking.outbox import claim, deliver
+from parking.renderers import FastJSONRenderer
+from parking.signals import outbox_event, sessions_changed
+from parking.sse import sse_application
+from parking.serializer import ParkingSerializer, FAST_FIELDS, represent_rows
+from parking.tariff import Tariff
+from parking.throttling import pending_writes, reset_buckets
+from rest_framework.renderers import JSONRenderer
+import csv
+import asyncio
 import datetime
+import gzip
+import io
+import json
+import msgpack
+import os
+import tempfile
+import threading
+from unittest import mock, skipUnless
 from freezegun import freeze_time
 
 ERR_MSG_DUPLICATED = "It is not possible to enter this data because the same " \
@@ -167,3 +199,1351 @@ class ParkingViewSetTest(APITestCase):
             ret = self.client.get(url.format(invplate), format="json")
             self.assertEqual(ret.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+
+class ParkingConcurrencyTest(APITransactionTestCase):
+    url = "/api/v1/parking/"
+
+    def test_concurrent_add_same_plate(self):
+        PLATE = "ABC-1234"
+        barrier = threading.Barrier(2)
+        codes = []
+
+        def post():
+            client = APIClient()
+            barrier.wait()
+            try:
+                ret = client.post(self.url, {"plate": PLATE}, format="json")
+                codes.append(ret.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(codes), [status.HTTP_201_CREATED,
+                                         status.HTTP_400_BAD_REQUEST])
+        self.assertEqual(ParkingModels.objects.filter(plate=PLATE).count(), 1)
+
+
+class ParkingTransitionTest(APITestCase):
+    url_pay = "/api/v1/parking/{}/pay/"
+    url_out = "/api/v1/parking/{}/out/"
+
+    def test_pay_and_out_are_one_update_plus_outbox(self):
+        # The transition is a single UPDATE ... RETURNING, the second query
+        # is its outbox entry, written in the same transaction so that the
+        # event is delivered if and only if the transition committed.
+        parking = ParkingModels.objects.create(plate="ABC-1234")
+        for url, field in ((self.url_pay, "paid"), (self.url_out, "left")):
+            with CaptureQueriesContext(connection) as ctx:
+                ret = self.client.put(url.format(parking.id), format="json")
+            self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+            self.assertTrue(ret.data[field])
+            queries = [q["sql"] for q in ctx.captured_queries
+                       if "SAVEPOINT" not in q["sql"]]
+            self.assertEqual(len(queries), 2)
+            self.assertTrue(queries[0].startswith('UPDATE "parking_parkingmodels"'))
+            self.assertTrue(queries[1].startswith('INSERT INTO "parking_parkingoutbox"'))
+
+    def test_invalid_double_out(self):
+        parking = ParkingModels.objects.create(plate="ABC-1234", paid=True)
+        ret = self.client.put(self.url_out.format(parking.id), format="json")
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        departure = ParkingModels.objects.get(id=parking.id).departure_time
+
+        ret = self.client.put(self.url_out.format(parking.id), format="json")
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ParkingModels.objects.get(id=parking.id).departure_time,
+                         departure)
+
+    def test_invalid_pay_after_out(self):
+        parking = ParkingModels.objects.create(plate="ABC-1234", paid=True,
+                                               departure_time="2022-07-15 10:20:00")
+        ret = self.client.put(self.url_pay.format(parking.id), format="json")
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_transition_notfound(self):
+        for url in (self.url_pay, self.url_out):
+            ret = self.client.put(url.format(9999), format="json")
+            self.assertEqual(ret.status_code, status.HTTP_404_NOT_FOUND)
+            ret = self.client.put(url.format("abc"), format="json")
+            self.assertEqual(ret.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ParkingListTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        for i in range(5):
+            with freeze_time("2022-07-15 10:0{}:00".format(i)):
+                ParkingModels.objects.create(plate="ABC-000{}".format(i))
+
+    def test_list_keyset_pagination(self):
+        ret = self.client.get(self.url, {"page_size": 2}, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        plates = [row["plate"] for row in ret.data["results"]]
+        while ret.data["next"]:
+            ret = self.client.get(ret.data["next"], format="json")
+            plates += [row["plate"] for row in ret.data["results"]]
+        self.assertEqual(plates, ["ABC-000{}".format(i) for i in range(5)])
+
+    def test_list_stream_ndjson(self):
+        ret = self.client.get(self.url, {"stream": "ndjson"})
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        self.assertEqual(ret["Content-Type"], "application/x-ndjson")
+        lines = b"".join(ret.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["plate"] for line in lines],
+                         ["ABC-000{}".format(i) for i in range(5)])
+
+
+class ParkingBatchTest(APITestCase):
+    url = "/api/v1/parking/batch/"
+
+    def test_batch_events(self):
+        inside = ParkingModels.objects.create(plate="AAA-0001")
+        paid = ParkingModels.objects.create(plate="AAA-0002", paid=True)
+        ret = self.client.post(self.url, [
+            {"event": "arrival", "plate": "BBB-0001"},
+            {"event": "arrival", "plate": "AAA-0001"},
+            {"event": "arrival", "plate": "123-ABCD"},
+            {"event": "payment", "id": inside.id},
+            {"event": "departure", "id": inside.id},
+            {"event": "departure", "id": paid.id},
+            {"event": "arrival", "plate": "AAA-0002"},
+            {"event": "departure", "id": 9999},
+            {"event": "payment"},
+        ], format="json")
+        self.assertEqual(ret.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r["status"] for r in ret.data],
+                         [201, 400, 400, 202, 202, 202, 201, 404, 400])
+        self.assertEqual(ret.data[0]["data"]["plate"], "BBB-0001")
+        self.assertEqual(ret.data[1]["errors"]["plate"], [ERR_MSG_DUPLICATED])
+        self.assertEqual(ret.data[2]["errors"]["plate"], [ERR_MSG_INVALID_FORMAT])
+        self.assertTrue(ret.data[4]["data"]["left"])
+        self.assertIn("id", ret.data[8]["errors"])
+        self.assertTrue(ParkingModels.objects.get(id=inside.id).paid)
+        self.assertEqual(ParkingModels.objects.filter(plate="AAA-0002",
+                                                      departure_time=None).count(), 1)
+
+    def test_batch_queries_do_not_grow_with_size(self):
+        def run(size, offset):
+            events = [{"event": "arrival", "plate": "CCC-{:04d}".format(offset + i)}
+                      for i in range(size)]
+            with CaptureQueriesContext(connection) as ctx:
+                ret = self.client.post(self.url, events, format="json")
+            self.assertTrue(all(r["status"] == 201 for r in ret.data))
+            return len(ctx.captured_queries)
+        self.assertEqual(run(2, 0), run(50, 100))
+
+    def test_invalid_batch(self):
+        ret = self.client.post(self.url, {"event": "arrival"}, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OccupancyIndexTest(TestCase):
+    def test_add_lookup_discard(self):
+        index = OccupancyIndex(FakeRedis())
+        ARRIVAL = datetime.datetime(2022, 7, 15, 10, 0)
+        index.add("ABC-1234", 1, ARRIVAL)
+        self.assertEqual(index.lookup("ABC-1234"), (1, ARRIVAL))
+        self.assertIsNone(index.lookup("ZZZ-9999"))
+        index.discard("ABC-1234", 2)
+        self.assertEqual(index.count(), 1)
+        index.discard("ABC-1234", 1)
+        self.assertEqual(index.count(), 0)
+
+        index.rebuild([("ABC-1234", 3, ARRIVAL), ("ABC-4321", 4, ARRIVAL)])
+        self.assertEqual(index.items(), {"ABC-1234": (3, ARRIVAL),
+                                         "ABC-4321": (4, ARRIVAL)})
+        self.assertEqual(list(index.client._data), [index.key])
+        index.rebuild([])
+        self.assertEqual(index.count(), 0)
+
+    @override_settings(PARKING_OCCUPANCY_INDEX=True,
+                       PARKING_OCCUPANCY_REDIS_URL="redis://localhost/0")
+    def test_shared_index_not_rebuilt_when_filled(self):
+        # Kept up to date by the workers already running, only an empty
+        # index is built from the database.
+        client = FakeRedis()
+        ARRIVAL = datetime.datetime(2022, 7, 15, 10, 0)
+        OccupancyIndex(client).add("ABC-1234", 1, ARRIVAL)
+        ParkingModels.objects.create(plate="ABC-4321")
+        reset_index()
+        self.addCleanup(reset_index)
+        with mock.patch("parking.occupancy.get_redis", return_value=client), \
+                self.assertNumQueries(0):
+            index = get_index()
+        self.assertTrue(index.warm)
+        self.assertEqual(list(index.items()), ["ABC-1234"])
+
+        client.delete(index.key)
+        reset_index()
+        with mock.patch("parking.occupancy.get_redis", return_value=client):
+            self.assertEqual(list(get_index().items()), ["ABC-4321"])
+
+
+@override_settings(PARKING_OCCUPANCY_INDEX=True)
+class OccupancyViewSetTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+
+    def test_index_follows_gate_events(self):
+        ParkingModels.objects.create(plate="AAA-0001")
+        ret = self.client.get(self.url + "occupancy/")
+        self.assertEqual(ret.data, {"occupied": 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+        id = ret.data["id"]
+        self.assertEqual(get_index().lookup("ABC-1234")[0], id)
+
+        ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(self.url + "{}/pay/".format(id), format="json")
+            self.client.put(self.url + "{}/out/".format(id), format="json")
+        self.assertIsNone(get_index().lookup("ABC-1234"))
+        ret = self.client.get(self.url + "occupancy/")
+        self.assertEqual(ret.data, {"occupied": 1})
+
+    def test_stale_entry_doesnt_block_the_plate(self):
+        # Left through another worker, whose index was updated but not ours.
+        get_index().add("ABC-1234", 1, datetime.datetime(2022, 7, 15, 10, 0))
+        ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+
+    def test_check_occupancy_command(self):
+        ParkingModels.objects.create(plate="AAA-0001")
+        index = get_index()
+        call_command("check_occupancy", stdout=io.StringIO())
+
+        index.discard("AAA-0001", index.lookup("AAA-0001")[0])
+        with self.assertRaisesMessage(CommandError, "1 missing"):
+            call_command("check_occupancy", stdout=io.StringIO())
+        call_command("check_occupancy", "--repair", stdout=io.StringIO())
+        self.assertEqual(index.count(), 1)
+
+
+class RepresentRowsTest(TestCase):
+    @freeze_time("2022-07-15 12:00:00")
+    def test_same_output_as_serializer(self):
+        ParkingModels.objects.create(plate="ABC-0001")
+        ParkingModels.objects.create(plate="ABC-0002", paid=True,
+                                     departure_time="2022-07-15 12:01:00")
+        ParkingModels.objects.create(plate="ABC-0003", paid=True,
+                                     departure_time="2022-07-15 13:00:00")
+        queryset = ParkingModels.objects.order_by("id")
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(represent_rows(queryset.values_list(*FAST_FIELDS))),
+            renderer.render(ParkingSerializer(queryset, many=True).data))
+
+    def test_bench_serializer_command(self):
+        out = io.StringIO()
+        call_command("bench_serializer", "--rows", "200", "--repeat", "1", stdout=out)
+        self.assertIn("speedup", out.getvalue())
+
+
+class PlateHistoryTest(APITestCase):
+    url = "/api/v1/parking/{}/"
+
+    def setUp(self):
+        cache.clear()
+        for hour in range(3):
+            with freeze_time("2022-07-15 1{}:00:00".format(hour)):
+                ParkingModels.objects.create(
+                    plate="ABC-1234", paid=True,
+                    departure_time="2022-07-15 1{}:30:00".format(hour))
+
+    def test_most_recent_first_with_limit_offset(self):
+        ret = self.client.get(self.url.format("ABC-1234"), {"limit": 2})
+        self.assertEqual(len(ret.data), 2)
+        self.assertTrue(ret.data[0]["id"] > ret.data[1]["id"])
+        self.assertIn('rel="next"', ret["Link"])
+        ret = self.client.get(self.url.format("ABC-1234"), {"limit": 2, "offset": 2})
+        self.assertEqual(len(ret.data), 1)
+        self.assertFalse(ret.has_header("Link"))
+        ret = self.client.get(self.url.format("ABC-1234"), {"limit": 0})
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_if_none_match(self):
+        ret = self.client.get(self.url.format("ABC-1234"))
+        etag = ret["ETag"]
+        with self.assertNumQueries(0):
+            ret = self.client.get(self.url.format("ABC-1234"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(ret.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        ParkingModels.objects.create(plate="ABC-1234")
+        ret = self.client.get(self.url.format("ABC-1234"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(ret["ETag"], etag)
+        self.assertEqual(len(ret.data), 4)
+
+
+class AsyncParkingViewTest(TransactionTestCase):
+    # The async views query from a thread pool, hence TransactionTestCase.
+    url = "/api/v1/async/parking/"
+
+    def request(self, method, path, data=None):
+        func = getattr(self.async_client, method)
+        if data is None:
+            return async_to_sync(func)(self.url + path)
+        return async_to_sync(func)(self.url + path, data,
+                                   content_type="application/json")
+
+    def test_gate_flow(self):
+        ret = self.request("post", "", {"plate": "ABC-1234"})
+        self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+        id = ret.json()["id"]
+
+        ret = self.request("post", "", {"plate": "ABC-1234"})
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ret.json()["plate"], [ERR_MSG_DUPLICATED])
+
+        ret = self.request("put", "{}/out/".format(id))
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+        ret = self.request("put", "{}/pay/".format(id))
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        ret = self.request("put", "{}/out/".format(id))
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(ret.json()["left"])
+
+        ret = self.request("get", "ABC-1234/")
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        self.assertEqual(ret.json()[0]["id"], id)
+        ret = self.request("get", "ZZZ-9999/")
+        self.assertEqual(ret.status_code, status.HTTP_404_NOT_FOUND)
+        ret = self.request("get", "")
+        self.assertEqual(ret.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+    def test_pay_same_response_as_sync(self):
+        sync_id = ParkingModels.objects.create(plate="ABC-0001").id
+        async_id = ParkingModels.objects.create(plate="ABC-0002").id
+        sync = self.client.put("/api/v1/parking/{}/pay/".format(sync_id))
+        ret = self.request("put", "{}/pay/".format(async_id))
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(ret.json().keys(), sync.json().keys())
+        self.assertEqual(ret.json()["fee"], sync.json()["fee"])
+
+class BenchmarkCommandTest(TestCase):
+    def test_reports_queries_per_operation(self):
+        # The test database is already set up, the command runs in it.
+        with mock.patch.multiple("parking.management.commands.benchmark",
+                                 setup_test_environment=mock.DEFAULT,
+                                 teardown_test_environment=mock.DEFAULT,
+                                 setup_databases=mock.DEFAULT,
+                                 teardown_databases=mock.DEFAULT):
+            out = io.StringIO()
+            call_command("benchmark", "--sessions", "50", "--plates", "40",
+                         "--open-percent", "25", "--operations", "40", stdout=out)
+        operations = json.loads(out.getvalue())["operations"]
+        self.assertEqual(sum(op["requests"] for op in operations.values()), 40)
+        # The write and its outbox entry, plus the SAVEPOINT and RELEASE of
+        # the transaction inside the test's.
+        for op, code in (("arrival", "201"), ("payment", "202"), ("departure", "202")):
+            self.assertEqual(operations[op]["queries_per_request"], 4.0, op)
+            self.assertEqual(list(operations[op]["status"]), [code], op)
+        # One query on a cache miss, none on a hit.
+        self.assertLessEqual(operations["search"]["queries_per_request"], 1)
+        self.assertEqual(list(operations["search"]["status"]), ["200"])
+
+class InstrumentationTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def test_server_timing_and_metrics(self):
+        ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+        self.assertRegex(ret["Server-Timing"], r'^db;desc="\d+ queries";dur=[\d.]+, '
+                                               r'ser;dur=[\d.]+, app;dur=[\d.]+$')
+        parking = ParkingModels.objects.get(plate="ABC-1234")
+        ret = self.client.put(self.url + "{}/pay/".format(parking.id))
+        # The UPDATE and its outbox entry, in a savepoint of the test's
+        # transaction.
+        self.assertIn('db;desc="4 queries"', ret["Server-Timing"])
+
+        ret = self.client.get("/metrics")
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        content = ret.content.decode()
+        self.assertIn("# TYPE parking_request_seconds histogram", content)
+        self.assertRegex(content, r'parking_db_queries_count\{route="create"\} \d+')
+        self.assertRegex(content, r'parking_db_queries_bucket\{route="pay",le="1"\} \d+')
+
+
+class RollupTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def leave(self, arrival, departure):
+        with freeze_time(arrival):
+            parking = ParkingModels.objects.create(plate="ABC-1234", paid=True)
+        with freeze_time(departure):
+            ret = self.client.put(self.url + "{}/out/".format(parking.id))
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        call_command("outbox_worker", "--once", "--threads", "1", stdout=io.StringIO())
+
+    def test_rollups_follow_departures(self):
+        self.leave("2022-07-15 10:30:00", "2022-07-15 12:15:00")
+        self.leave("2022-07-15 11:00:00", "2022-07-15 11:30:00")
+        rollups = {r.bucket.hour: r for r in ParkingHourlyRollup.objects.all()}
+        self.assertEqual(sorted(rollups), [10, 11, 12])
+        self.assertEqual(rollups[10].arrivals, 1)
+        self.assertEqual(rollups[10].occupied_seconds, 30 * 60)
+        self.assertEqual(rollups[11].arrivals, 1)
+        self.assertEqual(rollups[11].departures, 1)
+        self.assertEqual(rollups[11].occupied_seconds, 90 * 60)
+        self.assertEqual(rollups[12].stay_seconds, 105 * 60)
+
+        ret = self.client.get(self.url + "analytics/",
+                              {"start": "2022-07-15", "end": "2022-07-15T13:00"})
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(ret.data["hours"]), 3)
+        totals = ret.data["totals"]
+        self.assertEqual(totals["arrivals"], 2)
+        self.assertEqual(totals["departures"], 2)
+        self.assertEqual(totals["average_stay_minutes"], 67.5)
+
+        expected = list(ParkingHourlyRollup.objects.order_by("bucket").values())
+        call_command("backfill_rollups", stdout=io.StringIO())
+        self.assertEqual(list(ParkingHourlyRollup.objects.order_by("bucket").values(
+            "bucket", "arrivals", "departures", "occupied_seconds", "stay_seconds")),
+            [{k: v for k, v in row.items() if k != "id"} for row in expected])
+        call_command("backfill_rollups", "--since", "2022-07-15T11:00",
+                     stdout=io.StringIO())
+        self.assertEqual(ParkingHourlyRollup.objects.get(bucket__hour=11).occupied_seconds,
+                         90 * 60)
+
+    def test_invalid_analytics_range(self):
+        ret = self.client.get(self.url + "analytics/",
+                              {"start": "2022-07-15", "end": "2022-07-14"})
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+        ret = self.client.get(self.url + "analytics/", {"start": "yesterday"})
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TariffTest(TestCase):
+    def fees(self, *sessions):
+        arrivals = [datetime.datetime.fromisoformat(a) for a, d in sessions]
+        departures = [datetime.datetime.fromisoformat(d) for a, d in sessions]
+        return list(Tariff().fees(arrivals, departures))
+
+    def test_fees(self):
+        self.assertEqual(self.fees(
+            ("2022-07-15 10:00", "2022-07-15 10:10"),  # grace period
+            ("2022-07-15 10:00", "2022-07-15 10:20"),  # first hour
+            ("2022-07-15 10:00", "2022-07-15 12:30"),  # 500 + 300 + 300
+            ("2022-07-15 10:00", "2022-07-15 16:00"),  # 500 + 2 * 300 + 3 * 200
+            ("2022-07-15 21:00", "2022-07-16 07:00"),  # 8 night hours
+            ("2022-07-15 10:00", "2022-07-17 11:00"),  # 2 capped days + 1 hour
+        ), [0, 500, 1100, 1700, 1600, 6500])
+
+    def test_single_fee(self):
+        fee = Tariff(night_rate=50).fee(datetime.datetime(2022, 7, 15, 23),
+                                        datetime.datetime(2022, 7, 16, 1))
+        self.assertEqual(str(fee), "1.00")
+
+    @freeze_time("2022-07-15 12:30:00")
+    def test_pay_quotes_fee(self):
+        with freeze_time("2022-07-15 10:00:00"):
+            parking = ParkingModels.objects.create(plate="ABC-1234")
+        ret = self.client.put("/api/v1/parking/{}/pay/".format(parking.id))
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(ret.json()["fee"], "11.00")
+
+    def test_reconcile_fees_command(self):
+        ParkingModels.objects.create(plate="ABC-1234", paid=True,
+                                     departure_time="2022-07-15 12:30:00")
+        ParkingModels.objects.filter(plate="ABC-1234").update(
+            arrival_time="2022-07-15 10:00:00")
+        out = io.StringIO()
+        call_command("reconcile_fees", "2022-07-15T00:00", "2022-07-16T00:00", stdout=out)
+        self.assertEqual(json.loads(out.getvalue()),
+                         [{"day": "2022-07-15", "sessions": 1, "revenue": "11.00"}])
+
+
+class ArchiveTest(APITestCase):
+    def test_archive_sessions(self):
+        with freeze_time("2022-06-01 10:00:00"):
+            old = [ParkingModels.objects.create(plate="ABC-1234", paid=True,
+                                                departure_time="2022-06-01 11:00:00")
+                   for _ in range(3)]
+        with freeze_time("2022-07-15 10:00:00"):
+            recent = ParkingModels.objects.create(plate="ABC-1234", paid=True,
+                                                  departure_time="2022-07-15 11:00:00")
+            inside = ParkingModels.objects.create(plate="ABC-1234")
+
+        handler = mock.Mock()
+        sessions_changed.connect(handler)
+        self.addCleanup(sessions_changed.disconnect, handler)
+        with freeze_time("2022-07-20 10:00:00"):
+            call_command("archive_sessions", "--days", "30", "--batch-size", "2",
+                         stdout=io.StringIO())
+        handler.assert_not_called()
+        self.assertEqual(sorted(ParkingModels.objects.values_list("id", flat=True)),
+                         [recent.id, inside.id])
+        self.assertEqual(sorted(ParkingArchive.objects.values_list("id", flat=True)),
+                         [obj.id for obj in old])
+
+        ret = self.client.get("/api/v1/parking/ABC-1234/")
+        self.assertEqual([row["id"] for row in ret.data],
+                         [inside.id, recent.id] + [obj.id for obj in reversed(old)])
+        ret = self.client.get("/api/v1/parking/ABC-1234/", {"limit": 2, "offset": 2})
+        self.assertEqual([row["id"] for row in ret.data], [old[2].id, old[1].id])
+
+
+class ExportTest(APITestCase):
+    def setUp(self):
+        with freeze_time("2022-07-15 10:00:00"):
+            self.first = ParkingModels.objects.create(plate="ABC-0001")
+        with freeze_time("2022-07-15 11:00:00"):
+            self.second = ParkingModels.objects.create(plate="ABC-0002")
+
+    def read_csv(self, content):
+        return list(csv.DictReader(io.StringIO(gzip.decompress(content).decode())))
+
+    def test_export_endpoint(self):
+        ret = self.client.get("/api/v1/parking/export/")
+        self.assertEqual(ret["Content-Type"], "application/gzip")
+        rows = self.read_csv(b"".join(ret.streaming_content))
+        self.assertEqual([row["plate"] for row in rows], ["ABC-0001", "ABC-0002"])
+        self.assertEqual(rows[0]["paid"], "false")
+        self.assertEqual(rows[0]["departure_time"], "")
+
+        ret = self.client.get("/api/v1/parking/export/", {
+            "after_updated_at": rows[0]["updated_at"], "after_id": rows[0]["id"]})
+        rows = self.read_csv(b"".join(ret.streaming_content))
+        self.assertEqual([row["plate"] for row in rows], ["ABC-0002"])
+
+    def test_export_sessions_command_is_incremental(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("export_sessions", directory, "--rows-per-file", "1",
+                         stdout=io.StringIO())
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ["export-state.json", "sessions-000001.csv.gz",
+                              "sessions-000002.csv.gz"])
+
+            with freeze_time("2022-07-15 12:00:00"):
+                ParkingModels.objects.filter(id=self.first.id).pay()
+            call_command("export_sessions", directory, stdout=io.StringIO())
+            with open(os.path.join(directory, "sessions-000003.csv.gz"), "rb") as f:
+                rows = self.read_csv(f.read())
+            self.assertEqual([(row["plate"], row["paid"]) for row in rows],
+                             [("ABC-0001", "true")])
+
+
+class GateEventsTest(APITestCase):
+    def setUp(self):
+        self.broker = LocalBroker()
+        set_broker(self.broker)
+        self.addCleanup(set_broker, None)
+
+    def test_events_are_published_on_commit(self):
+        async def subscribe():
+            return self.broker.subscribe()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        subscription = loop.run_until_complete(subscribe())
+        with self.captureOnCommitCallbacks() as callbacks:
+            ret = self.client.post("/api/v1/parking/", {"plate": "ABC-1234"})
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(subscription.queue.empty())
+        for callback in callbacks:
+            callback()
+        event = loop.run_until_complete(asyncio.wait_for(subscription.get(), 1))
+        self.assertEqual(event["event"], "arrival")
+        self.assertEqual(event["id"], ret.data["id"])
+        self.assertEqual((event["plate"], event["paid"], event["left"]),
+                         ("ABC-1234", False, False))
+        subscription.close()
+        self.assertEqual(self.broker.subscriptions, set())
+
+    def test_redis_broker_relays_through_channel(self):
+        broker = RedisBroker(FakeRedis())
+
+        async def scenario():
+            subscription = broker.subscribe()
+            broker.publish({"event": "payment", "plate": "ABC-1234"})
+            return await asyncio.wait_for(subscription.get(), 1)
+
+        self.assertEqual(asyncio.run(scenario()), {"event": "payment", "plate": "ABC-1234"})
+
+    def test_sse_stream_filters_by_plate(self):
+        sent = []
+
+        async def scenario():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if message.get("body", b"").startswith(b"id:"):
+                    disconnect.set()
+
+            scope = {"type": "http", "method": "GET", "path": "/api/v1/parking/events/",
+                     "query_string": b"plate=ABC-1234"}
+            stream = asyncio.ensure_future(sse_application(scope, receive, send))
+            while not self.broker.subscriptions:
+                await asyncio.sleep(0)
+            self.broker.publish({"event": "arrival", "plate": "XYZ-9999"})
+            self.broker.publish({"event": "payment", "plate": "ABC-1234"})
+            await asyncio.wait_for(stream, 1)
+
+        asyncio.run(scenario())
+        self.assertEqual(dict(sent[0]["headers"])[b"content-type"], b"text/event-stream")
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(sent[1]["body"],
+                         b'id: 1\nevent: payment\ndata: {"event":"payment","plate":"ABC-1234"}\n\n')
+        self.assertEqual(self.broker.subscriptions, set())
+
+
+class IdempotencyTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        caches["idempotency"].clear()
+
+    def test_retried_post_is_replayed(self):
+        first = self.client.post(self.url, {"plate": "ABC-1234"}, format="json",
+                                 HTTP_IDEMPOTENCY_KEY="gate-1:0001")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(0):
+            retry = self.client.post(self.url, {"plate": "ABC-1234"}, format="json",
+                                     HTTP_IDEMPOTENCY_KEY="gate-1:0001")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(ParkingModels.objects.count(), 1)
+
+        ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json",
+                               HTTP_IDEMPOTENCY_KEY="gate-1:0002")
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_retried_pay_is_replayed(self):
+        obj = ParkingModels.objects.create(plate="ABC-1234")
+        url = "{}{}/pay/".format(self.url, obj.id)
+        first = self.client.put(url, HTTP_IDEMPOTENCY_KEY="gate-1:0003")
+        retry = self.client.put(url, HTTP_IDEMPOTENCY_KEY="gate-1:0003")
+        self.assertEqual(retry.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(retry.json(), first.json())
+
+    def test_key_reused_for_another_request(self):
+        self.client.post(self.url, {"plate": "ABC-1234"}, format="json",
+                         HTTP_IDEMPOTENCY_KEY="gate-1:0004")
+        ret = self.client.post(self.url, {"plate": "XYZ-9999"}, format="json",
+                               HTTP_IDEMPOTENCY_KEY="gate-1:0004")
+        self.assertEqual(ret.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertFalse(ParkingModels.objects.filter(plate="XYZ-9999").exists())
+
+
+class IdempotencyConcurrencyTest(APITransactionTestCase):
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        caches["idempotency"].clear()
+
+    def test_async_post_is_replayed(self):
+        async def post():
+            return await self.async_client.post(
+                "/api/v1/async/parking/", {"plate": "ABC-1234"},
+                content_type="application/json", **{"Idempotency-Key": "gate-1:0005"})
+
+        first = async_to_sync(post)()
+        retry = async_to_sync(post)()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), first.json())
+
+    def test_concurrent_retries_create_once(self):
+        barrier = threading.Barrier(8)
+        responses = []
+
+        def post():
+            client = APIClient()
+            barrier.wait()
+            try:
+                responses.append(client.post(self.url, {"plate": "ABC-1234"},
+                                             format="json",
+                                             HTTP_IDEMPOTENCY_KEY="gate-1:0006"))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # One request creates the session, the others are replayed or told
+        # to retry while it runs; none of them fail as a duplicate.
+        created = [r for r in responses if r.status_code == status.HTTP_201_CREATED
+                   and not r.has_header("Idempotent-Replayed")]
+        self.assertEqual(len(created), 1)
+        for ret in responses:
+            self.assertIn(ret.status_code, (status.HTTP_201_CREATED,
+                                            status.HTTP_409_CONFLICT))
+        retry = APIClient().post(self.url, {"plate": "ABC-1234"}, format="json",
+                                 HTTP_IDEMPOTENCY_KEY="gate-1:0006")
+        self.assertEqual(retry.json(), created[0].json())
+        self.assertEqual(ParkingModels.objects.filter(plate="ABC-1234").count(), 1)
+
+
+class EdgeTest(APITestCase):
+    url = "/api/v1/edge/parking/"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(PARKING_EDGE_LOG=os.path.join(directory.name,
+                                                                   "edge.sqlite3"))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(lambda: get_log().close())
+
+    def test_gate_writes_are_logged_locally(self):
+        with self.assertNumQueries(0):
+            ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+            self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+            ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+            self.assertEqual(ret.data["plate"], [ERR_MSG_DUPLICATED])
+            ret = self.client.put(self.url + "ABC-1234/out/")
+            self.assertEqual(ret.data["paid"], [ERR_MSG_NO_PAYMENT])
+            ret = self.client.put(self.url + "XYZ-9999/pay/")
+            self.assertEqual(ret.status_code, status.HTTP_404_NOT_FOUND)
+            self.client.put(self.url + "ABC-1234/pay/")
+            ret = self.client.put(self.url + "ABC-1234/out/")
+        self.assertEqual((ret.data["event"], ret.data["left"]), ("departure", True))
+        self.assertEqual([(e["event"], e["plate"]) for e in get_log().pending(10)],
+                         [("arrival", "ABC-1234"), ("payment", "ABC-1234"),
+                          ("departure", "ABC-1234")])
+
+    @override_settings(PARKING_EDGE_LOG=None)
+    def test_disabled_on_central(self):
+        ret = self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sync_applies_recorded_times_and_rules(self):
+        existing = ParkingModels.objects.create(plate="XYZ-9999")
+        events = [
+            {"event": "arrival", "plate": "ABC-1234", "at": "2022-07-15T10:00:00"},
+            {"event": "arrival", "plate": "XYZ-9999", "at": "2022-07-15T10:05:00"},
+            {"event": "payment", "plate": "ABC-1234", "at": "2022-07-15T11:00:00"},
+            {"event": "departure", "plate": "ABC-1234", "at": "2022-07-15T11:10:00"},
+            {"event": "departure", "plate": "XYZ-9999", "at": "2022-07-15T11:20:00"},
+            {"event": "payment", "plate": "XYZ-9999", "at": "2022-07-15T11:30:00"},
+            {"event": "payment", "plate": "DEF-0001", "at": "2022-07-15T11:40:00"},
+        ]
+        ret = self.client.post("/api/v1/parking/sync/", events, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([r["status"] for r in ret.data],
+                         [201, 400, 202, 202, 400, 202, 404])
+        self.assertEqual(ret.data[1]["errors"]["plate"], [ERR_MSG_DUPLICATED])
+        self.assertEqual(ret.data[4]["errors"]["paid"], [ERR_MSG_NO_PAYMENT])
+
+        obj = ParkingModels.objects.get(plate="ABC-1234")
+        self.assertEqual((obj.arrival_time, obj.departure_time, obj.paid),
+                         (datetime.datetime(2022, 7, 15, 10, 0),
+                          datetime.datetime(2022, 7, 15, 11, 10), True))
+        existing.refresh_from_db()
+        self.assertEqual((existing.paid, existing.departure_time), (True, None))
+        call_command("outbox_worker", "--once", "--threads", "1", stdout=io.StringIO())
+        self.assertEqual(ParkingHourlyRollup.objects.get(
+            bucket="2022-07-15 11:00:00").departures, 1)
+
+    def test_edge_sync_command(self):
+        for path in ("", "ABC-1234/pay/", "ABC-1234/out/"):
+            method = self.client.post if not path else self.client.put
+            method(self.url + path, {"plate": "ABC-1234"}, format="json")
+        self.client.post(self.url, {"plate": "ABC-1234"}, format="json")
+        ParkingModels.objects.create(plate="ABC-1234")
+        requests = []
+
+        def post(command, url, body, headers, timeout):
+            requests.append(headers["Idempotency-Key"])
+            ret = self.client.post(url + "sync/", json.loads(body), format="json",
+                                   HTTP_IDEMPOTENCY_KEY=headers["Idempotency-Key"])
+            return ret.status_code, ret.content
+
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch("parking.management.commands.edge_sync.Command.post", post):
+            call_command("edge_sync", "/api/v1/parking/", "--batch-size", "3",
+                         "--node", "gate-1", stdout=out, stderr=err)
+        self.assertEqual(requests, ["edge:gate-1:1-3", "edge:gate-1:4-4"])
+        self.assertIn("4 events synced, 0 pending.", out.getvalue())
+        # The first arrival conflicts with the session opened centrally, which
+        # the payment and the departure then close.
+        self.assertIn("Event 1 (arrival ABC-1234) rejected", err.getvalue())
+        self.assertEqual(ParkingModels.objects.filter(plate="ABC-1234").count(), 2)
+        self.assertEqual(ParkingModels.objects.filter(plate="ABC-1234",
+                                                      departure_time=None).count(), 1)
+
+
+@override_settings(PARKING_REPLICAS=["replica"])
+class ReplicaRoutingTest(APITransactionTestCase):
+    databases = {"default", "replica"}
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        cache.clear()
+
+    def queries(self, request):
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            ret = request()
+            if ret.streaming:
+                b"".join(ret.streaming_content)
+        return ret, len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        ParkingModels.objects.create(plate="ABC-1234")
+        ret, primary, replica = self.queries(lambda: self.client.get(self.url))
+        self.assertEqual(len(ret.data["results"]), 1)
+        self.assertEqual((primary, replica), (0, 1))
+        ret, primary, replica = self.queries(
+            lambda: self.client.get(self.url, {"stream": "ndjson"}))
+        self.assertEqual((primary, replica), (0, 1))
+
+    def test_writer_reads_its_writes_from_the_primary(self):
+        ret, primary, replica = self.queries(
+            lambda: self.client.post(self.url, {"plate": "ABC-1234"}, format="json"))
+        self.assertEqual(replica, 0)
+        self.assertIn("parking_primary", ret.cookies)
+        ret, primary, replica = self.queries(lambda: self.client.get(self.url))
+        self.assertEqual((primary, replica), (1, 0))
+        # Other clients read the plate just written from the primary too.
+        other = APIClient()
+        ret, primary, replica = self.queries(lambda: other.get(self.url + "ABC-1234/"))
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        self.assertEqual(replica, 0)
+        ret, primary, replica = self.queries(lambda: other.get(self.url))
+        self.assertEqual((primary, replica), (0, 1))
+
+    def test_bench_connections(self):
+        out = io.StringIO()
+        call_command("bench_connections", "--requests", "5", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["new_connection"]["requests"], 5)
+        self.assertIn("setup_saved_ms", report)
+
+
+class FuzzyPlateTest(APITestCase):
+    url = "/api/v1/parking/fuzzy/"
+
+    def setUp(self):
+        reset_fuzzy_index()
+        self.addCleanup(reset_fuzzy_index)
+
+    def test_confusions_cost_half_an_edit(self):
+        self.assertEqual(distance("ABC1234", "A8C1234"), 0.5)
+        self.assertEqual(distance("ABC1234", "A8CI234"), 1.0)
+        self.assertEqual(distance("ABC1234", "AXC1234"), 1.0)
+        self.assertEqual(distance("ABC1234", "ABC234"), 1.0)
+
+    def test_index_ranks_candidates(self):
+        index = FuzzyPlateIndex()
+        index.rebuild(["ABC-1234", "ABC-1284", "XYZ-9999", "OBC-1234"])
+        self.assertEqual(index.search("A8C-I234", max_distance=2),
+                         [(1.0, "ABC-1234"), (2.0, "ABC-1284"), (2.0, "OBC-1234")])
+        # A missed character plus a confusion, another misread is too far.
+        self.assertEqual(index.search("ABC-I28", max_distance=2),
+                         [(1.5, "ABC-1284")])
+        index.discard("ABC-1234")
+        self.assertEqual(index.search("ABC-1234"), [(1.0, "ABC-1284"),
+                                                    (1.0, "OBC-1234")])
+
+    def test_fuzzy_endpoint(self):
+        ParkingModels.objects.create(plate="OBC-1234")
+        ParkingModels.objects.create(plate="OBC-1284", departure_time="2022-07-15 10:00",
+                                     paid=True)
+        ret = self.client.get(self.url, {"plate": "0BC1234"})
+        self.assertEqual(ret.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r["plate"], r["distance"]) for r in ret.data],
+                         [("OBC-1234", 0.5)])
+
+        # Arrivals of this process are indexed as they commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/v1/parking/", {"plate": "DBC-1234"}, format="json")
+        with self.assertNumQueries(1):
+            ret = self.client.get(self.url, {"plate": "OBC1234"})
+        self.assertEqual([(r["plate"], r["distance"]) for r in ret.data],
+                         [("OBC-1234", 0.0), ("DBC-1234", 0.5)])
+
+        ret = self.client.get(self.url, {"plate": "OBC1234", "max_distance": 5})
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ParkingLotTest(APITestCase):
+    def setUp(self):
+        self.north = ParkingLot.objects.create(slug="north", name="North", capacity=2)
+        self.south = ParkingLot.objects.create(slug="south", name="South", capacity=1)
+
+    def url(self, lot, path=""):
+        return "/api/v1/lots/{}/parking/{}".format(lot, path)
+
+    def arrive(self, lot, plate):
+        return self.client.post(self.url(lot), {"plate": plate}, format="json")
+
+    def test_capacity_without_counting(self):
+        with CaptureQueriesContext(connection) as queries:
+            ret = self.arrive("south", "ABC-1234")
+        self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"].upper()])
+        ret = self.arrive("south", "XYZ-9999")
+        self.assertEqual(ret.status_code, status.HTTP_409_CONFLICT)
+        ret = self.client.get(self.url("south", "occupancy/"))
+        self.assertEqual(ret.data, {"occupied": 1, "capacity": 1})
+
+    def test_duplicates_are_checked_per_lot(self):
+        self.assertEqual(self.arrive("north", "ABC-1234").status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self.arrive("south", "ABC-1234").status_code,
+                         status.HTTP_201_CREATED)
+        ret = self.arrive("north", "ABC-1234")
+        self.assertEqual(ret.data["plate"], [ERR_MSG_DUPLICATED])
+        self.north.refresh_from_db()
+        self.assertEqual(self.north.occupied, 1)
+        ret = self.client.post("/api/v1/parking/", {"plate": "ABC-1234"}, format="json")
+        self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+
+    def test_departure_releases_the_space(self):
+        id = self.arrive("south", "ABC-1234").data["id"]
+        self.assertEqual(self.client.put(self.url("north", "{}/pay/".format(id)))
+                         .status_code, status.HTTP_404_NOT_FOUND)
+        self.client.put(self.url("south", "{}/pay/".format(id)))
+        ret = self.client.put(self.url("south", "{}/out/".format(id)))
+        self.assertEqual(ret.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.arrive("south", "XYZ-9999").status_code,
+                         status.HTTP_201_CREATED)
+        ret = self.client.get(self.url("south"))
+        self.assertEqual([r["plate"] for r in ret.data["results"]],
+                         ["ABC-1234", "XYZ-9999"])
+        self.assertEqual(self.client.get(self.url("east")).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_check_lots_repairs_counters(self):
+        ParkingModels.objects.create(lot=self.north, plate="ABC-1234")
+        with self.assertRaises(CommandError):
+            call_command("check_lots", stdout=io.StringIO())
+        call_command("check_lots", "--repair", stdout=io.StringIO())
+        self.north.refresh_from_db()
+        self.assertEqual(self.north.occupied, 1)
+
+
+@skipUnless("shard1" in settings.DATABASES, "needs a shard1 database")
+@override_settings(PARKING_LOT_DATABASES={"north": "shard1"})
+class ParkingLotShardTest(APITransactionTestCase):
+    # Only the aliases that exist, the class is checked even when skipped.
+    databases = {"default"} | ({"shard1"} & set(settings.DATABASES))
+
+    def test_lot_sessions_live_in_its_shard(self):
+        call_command("create_lot", "north", "10", stdout=io.StringIO())
+        self.assertFalse(ParkingLot.objects.exists())
+        ret = self.client.post("/api/v1/lots/north/parking/", {"plate": "ABC-1234"},
+                               format="json")
+        id = ret.data["id"]
+        self.client.put("/api/v1/lots/north/parking/{}/pay/".format(id))
+        self.client.put("/api/v1/lots/north/parking/{}/out/".format(id))
+        self.assertFalse(ParkingModels.objects.exists())
+        obj = ParkingModels.objects.using("shard1").get()
+        self.assertTrue(obj.departure_time is not None)
+        self.assertEqual(ParkingLot.objects.using("shard1").get().occupied, 0)
+
+    def test_commit_callbacks_wait_for_the_shard(self):
+        # The writes of a lot commit on its shard, "default" has no
+        # transaction open: callbacks registered there would run at once.
+        call_command("create_lot", "north", "10", stdout=io.StringIO())
+        lot = ParkingLot.objects.using("shard1").get()
+        broker = mock.Mock()
+        set_broker(broker)
+        self.addCleanup(set_broker, None)
+        reset_fuzzy_index()
+        self.addCleanup(reset_fuzzy_index)
+        fuzzy = get_fuzzy_index()
+        with mock.patch("parking.cache.invalidate_plates") as invalidate:
+            with self.assertRaises(RuntimeError), transaction.atomic(using="shard1"):
+                ParkingModels.objects.using("shard1").create(lot=lot, plate="ABC-1234")
+                raise RuntimeError()
+            broker.publish.assert_not_called()
+            self.assertEqual(fuzzy.plates, set())
+            self.assertEqual(invalidate.call_count, 1)
+
+            with transaction.atomic(using="shard1"):
+                ParkingModels.objects.using("shard1").create(lot=lot, plate="ABC-1234")
+                broker.publish.assert_not_called()
+                self.assertEqual(fuzzy.plates, set())
+                self.assertEqual(invalidate.call_count, 2)
+            self.assertEqual(broker.publish.call_args[0][0]["plate"], "ABC-1234")
+            self.assertEqual(fuzzy.plates, {"ABC-1234"})
+            self.assertEqual(invalidate.call_count, 3)
+
+    def test_export_resumes_per_database(self):
+        # Same updated_at in both databases, and ids numbered separately.
+        call_command("create_lot", "north", "10", stdout=io.StringIO())
+        lot = ParkingLot.objects.using("shard1").get()
+        with freeze_time("2022-07-15 10:00:00"):
+            for i in range(2):
+                ParkingModels.objects.create(id=10 + i, plate="ABC-000{}".format(i))
+                ParkingModels.objects.using("shard1").create(
+                    id=10 + i, lot=lot, plate="XYZ-000{}".format(i))
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("export_sessions", directory, "--rows-per-file", "1",
+                         stdout=io.StringIO())
+            rows = []
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".csv.gz"):
+                    with open(os.path.join(directory, name), "rb") as f:
+                        rows += csv.DictReader(io.StringIO(gzip.decompress(f.read()).decode()))
+        self.assertEqual(sorted(row["plate"] for row in rows),
+                         ["ABC-0000", "ABC-0001", "XYZ-0000", "XYZ-0001"])
+        self.assertEqual([row["database"] for row in rows],
+                         ["default", "default", "shard1", "shard1"])
+
+    def test_archive_and_export_cover_the_shards(self):
+        call_command("create_lot", "north", "10", stdout=io.StringIO())
+        lot = ParkingLot.objects.using("shard1").get()
+        with freeze_time("2022-06-01 10:00:00"):
+            ParkingModels.objects.create(plate="ABC-0001", paid=True,
+                                         departure_time="2022-06-01 11:00:00")
+            session = ParkingModels.objects.using("shard1").create(
+                lot=lot, plate="ABC-0002", paid=True, departure_time="2022-06-01 12:00:00")
+        with freeze_time("2022-07-20 10:00:00"):
+            call_command("archive_sessions", "--days", "30", stdout=io.StringIO())
+        self.assertFalse(ParkingModels.objects.using("shard1").exists())
+        archived = ParkingArchive.objects.using("shard1").get()
+        self.assertEqual((archived.id, archived.lot_id), (session.id, lot.id))
+
+        ret = self.client.get("/api/v1/parking/export/")
+        rows = list(csv.DictReader(io.StringIO(
+            gzip.decompress(b"".join(ret.streaming_content)).decode())))
+        self.assertEqual(sorted((row["plate"], row["lot_id"]) for row in rows),
+                         [("ABC-0001", ""), ("ABC-0002", str(lot.id))])
+
+
+class ParkingAdminTest(TestCase):
+    url = "/admin/parking/parkingmodels/"
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser("admin", "a@b.c", "pw"))
+        ParkingModels.objects.bulk_create(
+            ParkingModels(plate="ABC-{:04d}".format(i), paid=True,
+                          departure_time="2022-07-15 10:00") for i in range(150))
+        ParkingModels.objects.create(plate="XYZ-0001")
+
+    def test_keyset_pages_without_offset(self):
+        with CaptureQueriesContext(connection) as queries:
+            ret = self.client.get(self.url)
+        self.assertEqual(ret.status_code, 200)
+        page = ret.context["cl"].result_list
+        self.assertEqual(len(page), 100)
+        self.assertEqual(page[0].plate, "XYZ-0001")
+        self.assertFalse([q for q in queries if "OFFSET" in q["sql"]])
+        self.assertEqual(ret.context["cl"].result_count, 151)
+        self.assertContains(ret, "Older")
+
+        ret = self.client.get(self.url + ret.context["cl"].next_page_url)
+        page = ret.context["cl"].result_list
+        self.assertEqual(len(page), 51)
+        self.assertEqual(page[0].plate, "ABC-0050")
+        self.assertIsNone(ret.context["cl"].next_page_url)
+
+    def test_filters_and_prefix_search(self):
+        ret = self.client.get(self.url, {"open": "1"})
+        self.assertEqual([o.plate for o in ret.context["cl"].result_list], ["XYZ-0001"])
+        ret = self.client.get(self.url, {"q": "abc-001"})
+        self.assertEqual(len(ret.context["cl"].result_list), 10)
+
+
+class WireFormatTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        cache.clear()
+        with freeze_time("2022-07-15 10:00:00"):
+            ParkingModels.objects.bulk_create(
+                ParkingModels(plate="ABC-{:04d}".format(i)) for i in range(50))
+
+    def test_msgpack_compact_keys(self):
+        ret = self.client.get(self.url, HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(ret["Content-Type"], "application/msgpack")
+        data = msgpack.unpackb(ret.content)
+        self.assertEqual(len(data["r"]), 50)
+        self.assertEqual(set(data["r"][0]), {"i", "p", "pd", "t", "l"})
+
+        ret = self.client.post(self.url, msgpack.packb({"p": "XYZ-0001"}),
+                               content_type="application/msgpack",
+                               HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+        data = msgpack.unpackb(ret.content)
+        self.assertEqual(data["p"], "XYZ-0001")
+        self.assertEqual(data["i"], ParkingModels.objects.get(plate="XYZ-0001").id)
+
+        ret = self.client.post(self.url, b"\xc1", content_type="application/msgpack")
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_fast_json_matches_json(self):
+        data = {"results": represent_rows(ParkingModels.objects.values_list(*FAST_FIELDS)),
+                "at": datetime.datetime(2022, 7, 15, 10, 0, 0, 1500),
+                "fee": Tariff.from_settings().fee(datetime.datetime(2022, 7, 15, 10),
+                                                  datetime.datetime(2022, 7, 15, 13)),
+                "note": "line\u2028separator"}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_large_responses_compressed(self):
+        ret = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(ret["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", ret["Vary"])
+        self.assertEqual(len(json.loads(gzip.decompress(ret.content))["results"]), 50)
+
+        ret = self.client.get(self.url, {"stream": "ndjson"}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(ret["Content-Encoding"], "gzip")
+        content = gzip.decompress(b"".join(ret.streaming_content))
+        self.assertEqual(len(content.splitlines()), 50)
+
+        ret = self.client.get(self.url + "occupancy/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(ret.has_header("Content-Encoding"))
+        ret = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertFalse(ret.has_header("Content-Encoding"))
+
+    @override_settings(PARKING_COMPRESS_MIN_SIZE=0)
+    def test_compressed_etag_revalidates(self):
+        ParkingModels.objects.bulk_create(
+            ParkingModels(plate="ABC-0001", paid=True, departure_time="2022-07-15 09:00")
+            for _ in range(20))
+        url = self.url + "ABC-0001/"
+        ret = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(ret["Content-Encoding"], "gzip")
+        self.assertTrue(ret["ETag"].startswith('W/"'))
+        ret = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip",
+                              HTTP_IF_NONE_MATCH=ret["ETag"])
+        self.assertEqual(ret.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class AlertScanTest(APITestCase):
+    url = "/api/v1/parking/alerts/"
+
+    def setUp(self):
+        with freeze_time("2022-07-15 08:00:00"):
+            self.early = ParkingModels.objects.create(plate="ABC-0001")
+        with freeze_time("2022-07-15 09:00:00"):
+            self.late = ParkingModels.objects.create(plate="ABC-0002")
+            self.paid = ParkingModels.objects.create(plate="ABC-0003")
+            ParkingModels.objects.filter(pk=self.paid.pk).pay()
+
+    def test_incremental_scan(self):
+        with freeze_time("2022-07-16 08:30:00"):
+            call_command("scan_alerts", stdout=io.StringIO())
+        self.assertEqual(set(ParkingAlert.objects.values_list("plate", "kind")), {
+            ("ABC-0001", ParkingAlert.OVERSTAY), ("ABC-0003", ParkingAlert.PAID_NOT_LEFT)})
+
+        # Only the sessions between the previous cutoff and the new one are read.
+        with freeze_time("2022-07-16 09:30:00"), \
+                CaptureQueriesContext(connection) as queries:
+            call_command("scan_alerts", stdout=io.StringIO())
+        overstay = [q["sql"] for q in queries if '"arrival_time" <=' in q["sql"]]
+        self.assertEqual(len(overstay), 1)
+        self.assertIn('"arrival_time" >', overstay[0].replace('"arrival_time" <=', ""))
+        self.assertEqual(ParkingAlert.objects.filter(kind=ParkingAlert.OVERSTAY).count(), 3)
+
+        with freeze_time("2022-07-16 09:31:00"):
+            call_command("scan_alerts", stdout=io.StringIO())
+            call_command("scan_alerts", "--rescan", stdout=io.StringIO())
+        self.assertEqual(ParkingAlert.objects.count(), 4)
+
+    def test_alerts_endpoint(self):
+        with freeze_time("2022-07-16 10:00:00"):
+            call_command("scan_alerts", stdout=io.StringIO())
+        ret = self.client.get(self.url)
+        self.assertEqual([a["plate"] for a in ret.data],
+                         ["ABC-0001", "ABC-0002", "ABC-0003", "ABC-0003"])
+        ret = self.client.get(self.url, {"kind": "paid_not_left"})
+        self.assertEqual([(a["session"], a["paid"]) for a in ret.data], [(self.paid.id, True)])
+        ret = self.client.get(self.url, {"after": ret.data[0]["id"]})
+        self.assertEqual(ret.data, [])
+
+        ParkingModels.objects.filter(pk=self.paid.pk).check_out()
+        ret = self.client.get(self.url)
+        self.assertEqual([a["plate"] for a in ret.data], ["ABC-0001", "ABC-0002"])
+        ret = self.client.get(self.url, {"all": "1"})
+        self.assertEqual(len(ret.data), 4)
+        ret = self.client.get(self.url, {"kind": "other"})
+        self.assertEqual(ret.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_alerts_of_archived_sessions_still_listed(self):
+        with freeze_time("2022-07-16 10:00:00"):
+            call_command("scan_alerts", stdout=io.StringIO())
+            ParkingModels.objects.filter(pk=self.paid.pk).check_out()
+        with freeze_time("2022-09-01 10:00:00"):
+            call_command("archive_sessions", "--days", "30", stdout=io.StringIO())
+        self.assertFalse(ParkingModels.objects.filter(pk=self.paid.pk).exists())
+        ret = self.client.get(self.url, {"all": "1"})
+        archived = [a for a in ret.data if a["session"] == self.paid.id]
+        self.assertEqual(len(archived), 2)
+        self.assertEqual({(a["paid"], a["lot"], a["arrival_time"]) for a in archived},
+                         {(True, None, self.paid.arrival_time)})
+
+
+@override_settings(PARKING_RATE_LIMIT={"rate": 1, "burst": 3})
+class RateLimitTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def setUp(self):
+        reset_buckets()
+
+    def tearDown(self):
+        reset_buckets()
+
+    def test_token_bucket_per_gate(self):
+        with mock.patch("parking.throttling.time.monotonic", lambda: 0):
+            codes = [self.client.post(self.url, {"plate": "ABC-000{}".format(i)},
+                                      HTTP_X_GATE_ID="north-1").status_code
+                     for i in range(5)]
+            self.assertEqual(codes, [201, 201, 201, 429, 429])
+            with CaptureQueriesContext(connection) as queries:
+                ret = self.client.put(self.url + "1/pay/", HTTP_X_GATE_ID="north-1")
+            self.assertEqual(ret.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(ret["Retry-After"], "1")
+            self.assertEqual(len(queries), 0)
+            # Other gates and the reads aren't affected.
+            ret = self.client.post(self.url, {"plate": "XYZ-0001"},
+                                   HTTP_X_GATE_ID="south-1")
+            self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        with mock.patch("parking.throttling.time.monotonic", lambda: 1.5):
+            ret = self.client.post(self.url, {"plate": "ABC-0009"},
+                                   HTTP_X_GATE_ID="north-1")
+            self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(GATE_REQUESTS.get("north-1", "throttled"), 3)
+        self.assertIn('parking_gate_requests_total{gate="south-1",outcome="accepted"} 1',
+                      self.client.get("/metrics").content.decode())
+
+    @override_settings(PARKING_MAX_PENDING_WRITES=1)
+    def test_shed_when_busy(self):
+        pending_writes.enter(0)
+        try:
+            with self.assertNumQueries(0):
+                ret = self.client.post(self.url, {"plate": "ABC-0001"})
+        finally:
+            pending_writes.exit()
+        self.assertEqual(ret.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(ret["Retry-After"], "1")
+        ret = self.client.post(self.url, {"plate": "ABC-0001"})
+        self.assertEqual(ret.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(pending_writes.count, 0)
+
+
+class OutboxTest(APITestCase):
+    url = "/api/v1/parking/"
+
+    def visit(self, plate, leave=True):
+        id = self.client.post(self.url, {"plate": plate}, format="json").data["id"]
+        if leave:
+            self.client.put(self.url + "{}/pay/".format(id))
+            self.client.put(self.url + "{}/out/".format(id))
+        return id
+
+    def test_delivered_in_order_per_plate(self):
+        self.visit("ABC-0001")
+        self.visit("ABC-0002", leave=False)
+        self.assertEqual(list(ParkingOutbox.objects.values_list("plate", "event")), [
+            ("ABC-0001", "arrival"), ("ABC-0001", "payment"), ("ABC-0001", "departure"),
+            ("ABC-0002", "arrival")])
+        token, entries = claim("default", 10, datetime.timedelta(seconds=60))
+        self.assertEqual([(e.plate, e.event) for e in entries],
+                         [("ABC-0001", "arrival"), ("ABC-0002", "arrival")])
+        # Leased: not handed to another worker.
+        self.assertEqual(claim("default", 10, datetime.timedelta(seconds=60))[1], [])
+
+        delivered = []
+
+        def handler(sender, session, event, **kwargs):
+            delivered.append((session.plate, event))
+        outbox_event.connect(handler)
+        self.addCleanup(outbox_event.disconnect, handler)
+        for entry in entries:
+            self.assertIsNone(deliver("default", token, entry))
+        call_command("outbox_worker", "--once", "--threads", "1", stdout=io.StringIO())
+        self.assertEqual(delivered, [
+            ("ABC-0001", "arrival"), ("ABC-0002", "arrival"),
+            ("ABC-0001", "payment"), ("ABC-0001", "departure")])
+        self.assertFalse(ParkingOutbox.objects.exists())
+        self.assertEqual(ParkingHourlyRollup.objects.get().departures, 1)
+
+    def test_saves_and_deletions_not_recorded(self):
+        session = ParkingModels.objects.create(plate="ABC-0001")
+        session.paid = True
+        session.save()
+        session.delete()
+        self.assertEqual(list(ParkingOutbox.objects.values_list("event", flat=True)),
+                         ["arrival"])
+
+    def test_failed_events_retried_and_block_their_plate(self):
+        with freeze_time("2022-07-15 10:00:00"):
+            self.visit("ABC-0001")
+            self.visit("ABC-0002")
+        failures = []
+
+        def handler(sender, session, event, **kwargs):
+            if session.plate == "ABC-0001" and event == "payment" and not failures:
+                failures.append(event)
+                raise ValueError("receipt printer offline")
+        outbox_event.connect(handler)
+        self.addCleanup(outbox_event.disconnect, handler)
+
+        stderr = io.StringIO()
+        with freeze_time("2022-07-15 10:00:05"):
+            call_command("outbox_worker", "--once", "--threads", "1",
+                         stdout=io.StringIO(), stderr=stderr)
+            self.assertIn("receipt printer offline", stderr.getvalue())
+            self.assertEqual(list(ParkingOutbox.objects.values_list("event", "attempts")),
+                             [("payment", 1), ("departure", 0)])
+            self.assertIn("parking_outbox_lag_seconds 5.0",
+                          self.client.get("/metrics").content.decode())
+        with freeze_time("2022-07-15 10:00:08"):
+            call_command("outbox_worker", "--once", "--threads", "1", stdout=io.StringIO())
+        self.assertFalse(ParkingOutbox.objects.exists())
+        self.assertEqual(ParkingHourlyRollup.objects.get().departures, 2)
+
+        with mock.patch("parking.outbox.MAX_ATTEMPTS", 1):
+            self.visit("ABC-0003", leave=False)
+            failures.clear()
+            outbox_event.disconnect(handler)
+            outbox_event.connect(lambda **kwargs: 1 / 0, weak=False,
+                                 dispatch_uid="always-fails")
+            self.addCleanup(outbox_event.disconnect, dispatch_uid="always-fails")
+            call_command("outbox_worker", "--once", "--threads", "1",
+                         stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertTrue(ParkingOutbox.objects.get().failed)
+
+
+class OutboxWorkerPoolTest(TestCase):
+    def test_thread_pool(self):
+        # The pool is driven with a stub delivery, which doesn't touch the
+        # database, so the test doesn't depend on the backend's locking.
+        for i in range(20):
+            ParkingModels.objects.create(plate="ABC-{:04d}".format(i))
+        ParkingModels.objects.filter(plate="ABC-0000").pay()
+        delivered = []
+        lock = threading.Lock()
+
+        def deliver(db, token, entry):
+            with lock:
+                delivered.append((entry.id, threading.current_thread()))
+
+        out = io.StringIO()
+        with mock.patch("parking.management.commands.outbox_worker.deliver", deliver):
+            call_command("outbox_worker", "--once", "--threads", "4",
+                         "--batch-size", "8", stdout=out)
+        self.assertIn("default: 20 delivered, 0 failed", out.getvalue())
+        # Each plate's first event once, the payment waits for its arrival.
+        arrivals = ParkingOutbox.objects.filter(event="arrival").values_list("id", flat=True)
+        self.assertEqual(sorted(id for id, _ in delivered), sorted(arrivals))
+        self.assertNotIn(threading.main_thread(), {thread for _, thread in delivered})
@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from parking.backends import get_redis
+
+BUCKET_PREFIX = "parking:bucket:"
+# Idle buckets (full again) are dropped from memory past this many gates.
+MAX_LOCAL_BUCKETS = 10000
+
+# KEYS[1] bucket, ARGV rate (tokens per second) and burst. The time is the
+# Redis server's, so the workers' clocks don't matter.
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "at")
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+def retry_after(tokens, rate):
+    return max(1, math.ceil((1 - tokens) / rate))
+
+
+class LocalBuckets:
+    """
+    Token buckets of this process, one per gate: "burst" requests at once,
+    then "rate" per second.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, gate):
+        # Returns None when the request may go, else the seconds to wait.
+        now = time.monotonic()
+        with self.lock:
+            tokens, at = self.buckets.get(gate, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - at) * self.rate)
+            if len(self.buckets) >= MAX_LOCAL_BUCKETS and gate not in self.buckets:
+                self.prune(now)
+            if tokens < 1:
+                self.buckets[gate] = (tokens, now)
+                return retry_after(tokens, self.rate)
+            self.buckets[gate] = (tokens - 1, now)
+        return None
+
+    async def atake(self, gate):
+        return self.take(gate)
+
+    def prune(self, now):
+        refill = self.burst / self.rate
+        self.buckets = {gate: (tokens, at) for gate, (tokens, at) in self.buckets.items()
+                        if now - at < refill}
+
+
+class RedisBuckets(LocalBuckets):
+    """Token buckets shared by every worker, in Redis."""
+
+    def __init__(self, client, rate, burst):
+        super().__init__(rate, burst)
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, gate):
+        allowed, tokens = self.script(keys=[BUCKET_PREFIX + gate],
+                                      args=[self.rate, self.burst])
+        return None if int(allowed) else retry_after(float(tokens), self.rate)
+
+    async def atake(self, gate):
+        return await sync_to_async(self.take, thread_sensitive=False)(gate)
+
+
+class PendingWrites:
+    """Number of writes in progress in this process, for load shedding."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def enter(self, limit):
+        with self.lock:
+            if limit and self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def exit(self):
+        with self.lock:
+            self.count -= 1
+
+
+pending_writes = PendingWrites()
+_buckets = None
+
+
+def rate_limit():
+    # (rate, burst), rate 0 disables the buckets.
+    limit = getattr(settings, "PARKING_RATE_LIMIT", {})
+    return limit.get("rate", 0), limit.get("burst", 1)
+
+
+def get_buckets():
+    global _buckets
+    rate, burst = rate_limit()
+    if not rate:
+        return None
+    if _buckets is None or (_buckets.rate, _buckets.burst) != (rate, burst):
+        url = getattr(settings, "PARKING_RATE_LIMIT_REDIS_URL", None)
+        _buckets = RedisBuckets(get_redis(url), rate, burst) if url \
+            else LocalBuckets(rate, burst)
+    return _buckets
+
+
+def reset_buckets():
+    global _buckets
+    _buckets = None
+
+
+def gate_of(request):
+    # The gate controllers identify themselves with the PARKING_GATE_HEADER
+    # header, other clients are told apart by address.
+    gate = request.headers.get(getattr(settings, "PARKING_GATE_HEADER", "X-Gate-Id"))
+    if gate:
+        return gate[:64]
+    return request.META.get("REMOTE_ADDR") or "unknown"
@@ -1,9 +1,21 @@
-from django.urls import path
-from parking.views import ParkingViewSet
+from django.urls import path, re_path
+from parking import views
+from parking.views import EdgeViewSet, LotParkingViewSet, ParkingViewSet
 from rest_framework.routers import SimpleRouter
 
 parking_router = SimpleRouter()
 parking_router.register("", ParkingViewSet)
 
+lot_router = SimpleRouter()
+lot_router.register("", LotParkingViewSet, basename="lot-parking")
+
+edge_router = SimpleRouter()
+edge_router.register("", EdgeViewSet, basename="edge")
+
+# Async routes, for the ASGI deployment.
 urlpatterns = [
+    path("", views.create_async),
+    path("<int:pk>/pay/", views.pay_async),
+    path("<int:pk>/out/", views.out_async),
+    re_path(r"^(?P<plate>[A-Z]{3}-[0-9]{4})/$", views.search_plate_async),
 ]
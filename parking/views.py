@@ -1,10 +1,154 @@
-from datetime import datetime
-from rest_framework import viewsets, mixins, status
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+from itertools import islice
+import orjson
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed, \
+    HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags
+from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.exceptions import APIException, NotFound, ParseError, \
+    ValidationError
 from rest_framework.response import Response
-from parking.models import ParkingModels
-from parking.serializer import ParkingSerializer
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+from parking.alerts import alert_rows, represent_alerts
+from parking.cache import history_key, history_timeout, make_etag, recently_written
+from parking.batch import apply_edge_events, apply_events, MAX_BATCH_SIZE
+from parking.edge import edge_enabled, get_log
+from parking.export import gzip_csv, iter_sessions
+from parking.fuzzy import MAX_DISTANCE, get_fuzzy_index
+from parking.lots import arrive, get_lot
+from parking.metrics import instrument_queries, render_metrics
+from parking.models import ParkingAlert, ParkingArchive, ParkingModels, ERR_ALREADY_LEFT, \
+    ERR_DEPARTURE_NOT_PAID
+from parking.occupancy import get_index, index_enabled
+from parking.pagination import ParkingCursorPagination
+from parking.rollups import hourly_stats
+from parking.routers import choose_replica, in_current_context, pin_to_primary, \
+    read_replica, use_replica
+from parking.serializer import ParkingEdgeEventSerializer, ParkingSerializer, \
+    FAST_FIELDS, represent_rows
+from parking.tariff import Tariff
+
+STREAM_CHUNK_SIZE = 2000
+HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 500
+MAX_ANALYTICS_DAYS = 366
+# Read-only actions that may be answered from a replica.
+REPLICA_ACTIONS = ("list", "search_plate", "occupancy", "analytics", "export", "fuzzy",
+                   "alerts")
+FUZZY_LIMIT = 10
+ALERTS_LIMIT = 100
+
+
+def int_param(params, name, default, minimum, maximum):
+    value = params.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: ["A valid integer is required."]})
+    if not minimum <= value <= maximum:
+        raise ValidationError({name: ["Must be between {} and {}.".format(
+            minimum, maximum)]})
+    return value
+
+
+def float_param(params, name, default, minimum, maximum):
+    value = params.get(name, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: ["A valid number is required."]})
+    if not minimum <= value <= maximum:
+        raise ValidationError({name: ["Must be between {} and {}.".format(
+            minimum, maximum)]})
+    return value
+
+
+def datetime_param(params, name, required=True):
+    value = params.get(name)
+    if value is None:
+        if not required:
+            return None
+        raise ValidationError({name: ["This field is required."]})
+    parsed = parse_datetime(value)
+    if parsed is None and parse_date(value) is not None:
+        parsed = datetime.combine(parse_date(value), datetime.min.time())
+    if parsed is None:
+        raise ValidationError({name: ["Enter a valid date/time."]})
+    return parsed
+
+
+def history_page(queryset, plate, limit, offset):
+    # Pages are cached per plate until the plate changes, so a kiosk
+    # revalidating with If-None-Match gets a 304 without any database work.
+    key = history_key(plate, limit, offset)
+    page = cache.get(key)
+    if page is None:
+        # Recent sessions and the archived ones, both read through their
+        # (plate, -arrival_time) index.
+        archived = ParkingArchive.objects.filter(plate=plate).values_list(*FAST_FIELDS)
+        rows = list(queryset.filter(plate=plate).values_list(*FAST_FIELDS)
+                    .union(archived, all=True)
+                    .order_by('-arrival_time', '-id')[offset:offset + limit + 1])
+        if not rows:
+            raise NotFound()
+        now = datetime.now()
+        data = represent_rows(rows[:limit], now)
+        page = {"data": data, "etag": make_etag(data), "more": len(rows) > limit}
+        cache.set(key, page, history_timeout(rows[:limit], now))
+    return page
+
+
+def history_headers(request, page, limit, offset):
+    headers = {"ETag": page["etag"], "Cache-Control": "no-cache"}
+    if page["more"]:
+        url = replace_query_param(request.build_absolute_uri(), "offset",
+                                  offset + limit)
+        headers["Link"] = '<{}>; rel="next"'.format(url)
+    return headers
+
+
+def not_modified(request, page):
+    # Weak comparison: compressed responses carry the ETag as W/"...".
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    return page["etag"] in etags or "W/" + page["etag"] in etags
+
+
+def batch_items(request):
+    items = request.data
+    if not isinstance(items, list):
+        raise ValidationError({"non_field_errors": ["Expected a list of events."]})
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValidationError({"non_field_errors": [
+            "A batch accepts at most {} events.".format(MAX_BATCH_SIZE)]})
+    return items
+
+
+def transition(queryset, pk, method):
+    # pay/out are a single conditional UPDATE ... RETURNING. Only when no
+    # row was updated is the session read again to report why.
+    try:
+        queryset = queryset.filter(pk=pk)
+    except (TypeError, ValueError):
+        raise NotFound()
+    obj = getattr(queryset, method)()
+    if obj is not None:
+        return obj
+    state = queryset.values_list('paid', 'departure_time').first()
+    if state is None:
+        raise NotFound()
+    paid, departure_time = state
+    if departure_time is not None:
+        raise ValidationError({"departure_time": [ERR_ALREADY_LEFT]})
+    raise ValidationError({"paid": [ERR_DEPARTURE_NOT_PAID]})
+
 
 class ParkingViewSet(mixins.CreateModelMixin,
                     mixins.UpdateModelMixin,
@@ -12,31 +156,319 @@ class ParkingViewSet(mixins.CreateModelMixin,
                     viewsets.GenericViewSet):
     serializer_class = ParkingSerializer
     queryset = ParkingModels.objects.all()
+    pagination_class = ParkingCursorPagination
+
+    def dispatch(self, request, *args, **kwargs):
+        alias = None
+        if self.action_map.get(request.method.lower()) in REPLICA_ACTIONS:
+            alias = choose_replica(request)
+        with use_replica(alias):
+            response = super().dispatch(request, *args, **kwargs)
+            if alias is not None and response.streaming:
+                response.streaming_content = in_current_context(
+                    response.streaming_content)
+        if request.method not in permissions.SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(response)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') == 'ndjson':
+            return self.stream_ndjson()
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.values_list(*FAST_FIELDS, named=True)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(represent_rows(page))
+        return Response(represent_rows(queryset))
+
+    def stream_ndjson(self):
+        # Rows are read through a server-side cursor and written as soon as
+        # they are read, so memory stays flat regardless of the table size.
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.order_by(*self.pagination_class.ordering)
+        rows = queryset.values_list(*FAST_FIELDS).iterator(chunk_size=STREAM_CHUNK_SIZE)
+        now = datetime.now()
+
+        def lines():
+            while True:
+                chunk = list(islice(rows, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    return
+                yield b"".join(orjson.dumps(data) + b"\n"
+                               for data in represent_rows(chunk, now))
+
+        return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        results = apply_events(self.get_queryset(), batch_items(request))
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        # Events recorded offline by the edge nodes, see edge_sync.
+        results = apply_edge_events(self.get_queryset(), batch_items(request))
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # gzip compressed CSV of the sessions, recent and archived, ordered by
+        # (updated_at, database, id). Pass the updated_at, database and id of
+        # the last row received as after_updated_at/after_database/after_id to
+        # resume or export incrementally.
+        params = request.query_params
+        start = datetime_param(params, "start", required=False)
+        end = datetime_param(params, "end", required=False)
+        after = None
+        if "after_updated_at" in params:
+            after = (datetime_param(params, "after_updated_at"),
+                     params.get("after_database", "default"),
+                     int_param(params, "after_id", 0, 0, 2 ** 63 - 1))
+        response = StreamingHttpResponse(gzip_csv(iter_sessions(start, end, after)),
+                                         content_type="application/gzip")
+        response["Content-Disposition"] = 'attachment; filename="sessions.csv.gz"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def occupancy(self, request):
+        if index_enabled():
+            occupied = get_index().count()
+        else:
+            occupied = self.get_queryset().filter(departure_time=None, lot=None).count()
+        return Response({"occupied": occupied}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        # Answered from the hourly rollups, never from the sessions.
+        start = datetime_param(request.query_params, "start")
+        end = datetime_param(request.query_params, "end")
+        if not start < end <= start + timedelta(days=MAX_ANALYTICS_DAYS):
+            raise ValidationError({"end": ["Must be after start and at most {} days "
+                                           "later.".format(MAX_ANALYTICS_DAYS)]})
+        data = hourly_stats(start, end)
+        data.update(start=start, end=end)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def fuzzy(self, request):
+        # Plates currently inside that look like a (mis)read plate, closest
+        # first, e.g. ?plate=A8C-I234. Misreads between confusable characters
+        # (0/O, 8/B, 1/I, ...) count as half an edit.
+        params = request.query_params
+        plate = params.get("plate", "")
+        if not 4 <= len(plate) <= 16:
+            raise ValidationError({"plate": ["Between 4 and 16 characters."]})
+        max_distance = float_param(params, "max_distance", 1, 0, MAX_DISTANCE)
+        limit = int_param(params, "limit", FUZZY_LIMIT, 1, 100)
+        ranked = get_fuzzy_index().search(plate, max_distance, limit)
+        if not ranked:
+            return Response([], status=status.HTTP_200_OK)
+        # The sessions are read back, which also drops the plates that left
+        # through another worker since the index was built.
+        distances = dict((p, d) for d, p in ranked)
+        rows = self.get_queryset().filter(plate__in=distances, departure_time=None) \
+            .values_list(*FAST_FIELDS)
+        data = represent_rows(rows)
+        for item in data:
+            item["distance"] = distances[item["plate"]]
+        data.sort(key=lambda item: (item["distance"], item["plate"]))
+        return Response(data, status=status.HTTP_200_OK)
+
+    def get_alerts(self):
+        return ParkingAlert.objects.all()
+
+    @action(detail=False, methods=['get'])
+    def alerts(self, request):
+        # Alerts of scan_alerts in the order they were raised, of the sessions
+        # still inside unless ?all=1. Pass the id of the last alert received
+        # as "after" to get the new ones.
+        params = request.query_params
+        alerts = self.get_alerts().filter(
+            id__gt=int_param(params, "after", 0, 0, 2 ** 63 - 1))
+        kind = params.get("kind")
+        if kind is not None:
+            if kind not in dict(ParkingAlert.KINDS):
+                raise ValidationError({"kind": ["Must be one of {}.".format(
+                    ", ".join(dict(ParkingAlert.KINDS)))]})
+            alerts = alerts.filter(kind=kind)
+        if params.get("all") != "1":
+            alerts = alerts.filter(session__departure_time=None)
+        limit = int_param(params, "limit", ALERTS_LIMIT, 1, MAX_HISTORY_LIMIT)
+        rows = alert_rows(alerts.order_by("id"))[:limit]
+        return Response(represent_alerts(rows), status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'], url_path="(?P<plate>[A-Z]{3}-[0-9]{4})")
     def search_plate(self, request, plate=None):
-        data = self.get_queryset().filter(plate=plate)
-        if len(data) > 0:
-            serializer = self.get_serializer(data, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        raise NotFound()
+        # Most recent sessions first, "limit" at a time.
+        params = request.query_params
+        limit = int_param(params, "limit", HISTORY_LIMIT, 1, MAX_HISTORY_LIMIT)
+        offset = int_param(params, "offset", 0, 0, 2 ** 31)
+        alias = None if recently_written(plate) else read_replica.get()
+        with use_replica(alias):
+            page = history_page(self.get_queryset(), plate, limit, offset)
+        headers = history_headers(request, page, limit, offset)
+        if not_modified(request, page):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(page["data"], status=status.HTTP_200_OK, headers=headers)
 
     @action(detail=True, methods=['put'])
     def pay(self, request, pk=None):
-        obj = self.get_object()
-        obj.paid = True
-        obj.save()
+        obj = transition(self.get_queryset(), pk, 'pay')
         serializer = self.get_serializer(obj)
-        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        data = serializer.data
+        data["fee"] = str(Tariff.from_settings().fee(obj.arrival_time, obj.updated_at))
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=True, methods=['put'])
     def out(self, request, pk=None):
-        obj = self.get_object()
-        obj.departure_time = datetime.now()
+        obj = transition(self.get_queryset(), pk, 'check_out')
+        serializer = self.get_serializer(obj)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class LotParkingViewSet(ParkingViewSet):
+    # The gate routes of one lot, /api/v1/lots/<lot>/parking/, on the lot's
+    # database (see parking/lots.py). Plate history, analytics, exports and
+    # the batch/edge/fuzzy routes stay global.
+    search_plate = analytics = export = batch = sync = fuzzy = None
+
+    def dispatch(self, request, *args, lot=None, **kwargs):
+        self.lot_slug = lot
+        return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.lot = get_lot(self.lot_slug)
+
+    def get_queryset(self):
+        return ParkingModels.objects.using(self.lot._state.db).filter(lot=self.lot)
+
+    def get_alerts(self):
+        return ParkingAlert.objects.using(self.lot._state.db).filter(lot=self.lot)
+
+    def perform_create(self, serializer):
+        serializer.instance = arrive(self.lot, serializer.validated_data["plate"])
+
+    @action(detail=False, methods=['get'])
+    def occupancy(self, request):
+        return Response({"occupied": self.lot.occupied, "capacity": self.lot.capacity},
+                        status=status.HTTP_200_OK)
+
+
+class EdgeViewSet(viewsets.ViewSet):
+    # Gate routes of an edge node (PARKING_EDGE_LOG set): the writes are
+    # appended to the local log and answered with 202, edge_sync applies them
+    # to the central database later. Sessions are identified by plate since
+    # their central id isn't known yet.
+    lookup_field = "plate"
+    lookup_value_regex = "[A-Z]{3}-[0-9]{4}"
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not edge_enabled():
+            raise NotFound()
+
+    def append(self, event, plate):
+        serializer = ParkingEdgeEventSerializer(data={
+            "event": event, "plate": plate, "at": datetime.now()})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return Response(get_log().append(data["event"], data["plate"], data["at"]),
+                        status=status.HTTP_202_ACCEPTED)
+
+    def create(self, request):
+        return self.append("arrival", request.data.get("plate"))
+
+    @action(detail=True, methods=['put'])
+    def pay(self, request, plate=None):
+        return self.append("payment", plate)
+
+    @action(detail=True, methods=['put'])
+    def out(self, request, plate=None):
+        return self.append("departure", plate)
+
+
+# Async versions of create/pay/out/search_plate for the ASGI deployment.
+# Django 4.0 has no async ORM yet, so the queries run through
+# db_sync_to_async while parsing and rendering stay on the event loop.
+
+def db_sync_to_async(func):
+    # thread_sensitive=False lets requests query concurrently from a thread
+    # pool instead of queueing on a single thread. Each thread has its own
+    # connection, closed around the call like Django does around requests.
+    def run(*args, **kwargs):
+        close_old_connections()
         try:
-            obj.full_clean()
-            obj.save()
-            serializer = self.get_serializer(obj)
-            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
-        except Exception as e:
-            raise ValidationError(str(e))
\ No newline at end of file
+            with instrument_queries():
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def async_api(*methods):
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail
+                if not isinstance(detail, (list, dict)):
+                    detail = {"detail": detail}
+                return JsonResponse(detail, status=exc.status_code, safe=False,
+                                    encoder=JSONEncoder)
+        # csrf_exempt() isn't async-aware in Django 4.0.
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def create_session(data):
+    serializer = ParkingSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+    return serializer.data
+
+
+@async_api("POST")
+async def create_async(request):
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        raise ParseError()
+    data = await db_sync_to_async(create_session)(data)
+    return JsonResponse(data, status=status.HTTP_201_CREATED, encoder=JSONEncoder)
+
+
+@async_api("PUT")
+async def pay_async(request, pk):
+    obj = await db_sync_to_async(transition)(ParkingModels.objects.all(), pk, 'pay')
+    data = ParkingSerializer(obj).data
+    data["fee"] = str(Tariff.from_settings().fee(obj.arrival_time, obj.updated_at))
+    return JsonResponse(data, status=status.HTTP_202_ACCEPTED)
+
+
+@async_api("PUT")
+async def out_async(request, pk):
+    obj = await db_sync_to_async(transition)(ParkingModels.objects.all(), pk,
+                                              'check_out')
+    return JsonResponse(ParkingSerializer(obj).data, status=status.HTTP_202_ACCEPTED)
+
+
+@async_api("GET")
+async def search_plate_async(request, plate):
+    limit = int_param(request.GET, "limit", HISTORY_LIMIT, 1, MAX_HISTORY_LIMIT)
+    offset = int_param(request.GET, "offset", 0, 0, 2 ** 31)
+    page = await db_sync_to_async(history_page)(ParkingModels.objects.all(), plate,
+                                                 limit, offset)
+    headers = history_headers(request, page, limit, offset)
+    if not_modified(request, page):
+        return HttpResponseNotModified(headers=headers)
+    return JsonResponse(page["data"], safe=False, headers=headers)
+
+
+def metrics(request):
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4")
@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parkingmanager.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from parking.occupancy import warm_on_startup  # noqa: E402
+from parking.sse import EVENTS_PATH, sse_application  # noqa: E402
+
+warm_on_startup()
+
+
+async def application(scope, receive, send):
+    # The gate events stream is served outside Django, see parking/sse.py.
+    if scope["type"] == "http" and scope["path"] == EVENTS_PATH:
+        return await sse_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 
@@ -58,10 +59,74 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny'
-    ]
+    ],
+    # JSON (through orjson when installed) or MessagePack for the gate
+    # controllers, see parking/renderers.py.
+    'DEFAULT_RENDERER_CLASSES': [
+        'parking.renderers.FastJSONRenderer',
+        'parking.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'parking.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# API responses of at least this many bytes are compressed (gzip, or brotli
+# when the brotli package is installed).
+PARKING_COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+
+# Parking fees in cents, see parking/tariff.py.
+PARKING_TARIFF = {
+    'grace_minutes': 15,
+    'tiers': ((1, 500), (3, 300), (None, 200)),
+    'night_start': '22:00',
+    'night_end': '06:00',
+    'night_rate': 100,
+    'daily_cap': 3000,
+}
+
+# In-memory index of the vehicles currently parked. It is kept in the process
+# unless a Redis URL is given, which lets several workers share it.
+PARKING_OCCUPANCY_INDEX = os.environ.get("OCCUPANCY_INDEX", "0") == "1"
+PARKING_OCCUPANCY_REDIS_URL = os.environ.get("OCCUPANCY_REDIS_URL")
+# The fuzzy plate search index is rebuilt from the database this often
+# (seconds) to pick up the arrivals handled by the other workers.
+PARKING_FUZZY_REFRESH_SECONDS = int(os.environ.get("FUZZY_REFRESH_SECONDS", 60))
+
+# Alert thresholds of scan_alerts: sessions open for this many hours, paid
+# sessions still inside this many minutes after paying.
+PARKING_OVERSTAY_HOURS = float(os.environ.get("OVERSTAY_HOURS", 24))
+PARKING_PAID_EXIT_MINUTES = float(os.environ.get("PAID_EXIT_MINUTES", 30))
+
+# Path of the local write-ahead log on an edge node (gate site), see
+# parking/edge.py. Unset on the central deployment.
+PARKING_EDGE_LOG = os.environ.get("EDGE_LOG")
+
+# API writes per gate (X-Gate-Id header, else client address): "burst" at
+# once then "rate" per second, off unless RATE_LIMIT_RATE is set. The
+# buckets are kept in the process unless a Redis URL is given, which shares
+# them between workers. Writes arriving while PARKING_MAX_PENDING_WRITES are
+# in progress in the process are shed (0 to disable).
+PARKING_RATE_LIMIT = {
+    'rate': float(os.environ.get("RATE_LIMIT_RATE", 0)),
+    'burst': int(os.environ.get("RATE_LIMIT_BURST", 20)),
+}
+PARKING_RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+PARKING_GATE_HEADER = "X-Gate-Id"
+PARKING_MAX_PENDING_WRITES = int(os.environ.get("MAX_PENDING_WRITES", 64))
+
+# Gate events (Server-Sent Events, ASGI only) are delivered in the process
+# unless a Redis URL is given, which relays them between workers.
+PARKING_EVENTS_REDIS_URL = os.environ.get("EVENTS_REDIS_URL")
+
 MIDDLEWARE = [
+    'parking.middleware.instrumentation_middleware',
+    'parking.middleware.compression_middleware',
+    'parking.middleware.rate_limit_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +134,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'parking.middleware.idempotency_middleware',
 ]
 
 ROOT_URLCONF = 'parkingmanager.urls'
@@ -101,11 +167,76 @@ DATABASES = {
         'NAME': os.environ.get("DBNAME"),
         'USER': os.environ.get("DBUSER"),
         'PASSWORD': os.environ.get("DBPASSWORD"),
-        'HOST': 'db', # Or 'localhost' if no use Docker
-        'PORT': '5432',
+        'HOST': os.environ.get("DBHOST", 'db'), # Or 'localhost' if no use Docker
+        'PORT': os.environ.get("DBPORT", '5432'),
+        # Seconds a connection is kept open between requests, 0 closes it
+        # after each request. Off by default: under ASGI the async views
+        # query from a pool of threads (thread_sensitive=False), each
+        # keeping its own connection, which can exhaust the server's.
+        'CONN_MAX_AGE': int(os.environ.get("DB_CONN_MAX_AGE", 0)),
+        # Behind PgBouncer in transaction pooling mode (DB_PGBOUNCER=1) the
+        # server-side cursors of the streaming exports can't be used.
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get("DB_PGBOUNCER", "0") == "1",
     }
 }
 
+# Read replicas (DB_REPLICA_HOSTS=host1,host2): the read-only API actions are
+# answered from one of them, see parking/routers.py. The "replica" alias
+# always exists (on the primary by default) and mirrors "default" in tests.
+DB_REPLICA_HOSTS = [h for h in os.environ.get("DB_REPLICA_HOSTS", "").split(",") if h]
+for index, host in enumerate(DB_REPLICA_HOSTS or [DATABASES['default']['HOST']]):
+    DATABASES['replica' if index == 0 else 'replica{}'.format(index + 1)] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+
+# Shards for the sessions of the lots (DB_SHARDS=shard1=host1,shard2=host2),
+# and the lot each one holds (LOT_DATABASES={"lot-a": "shard1"}). Run
+# "migrate --database <shard>" on each; see parking/lots.py.
+for spec in filter(None, os.environ.get("DB_SHARDS", "").split(",")):
+    alias, host = spec.split("=")
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host)
+PARKING_LOT_DATABASES = json.loads(os.environ.get("LOT_DATABASES", "{}"))
+
+DATABASE_ROUTERS = ['parking.routers.ReplicaRouter']
+PARKING_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')] \
+    if DB_REPLICA_HOSTS else []
+# Upper bound of the replication lag: a client (or a plate) that was just
+# written to is read from the primary for this many seconds.
+PARKING_REPLICA_STICKY_SECONDS = int(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The plate history is cached here. Workers must share it (Redis) so that a
+# write handled by one of them invalidates the pages cached by the others.
+# The responses replayed for an Idempotency-Key have their own cache, so they
+# are not evicted by the history pages.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idempotency',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+if os.environ.get("CACHE_REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get("CACHE_REDIS_URL"),
+        },
+        'idempotency': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get("CACHE_REDIS_URL"),
+            'KEY_PREFIX': 'idempotency',
+        },
+    }
+
+PARKING_IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 24 * 3600))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -15,9 +15,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from parking.urls import parking_router
+from parking.urls import edge_router, lot_router, parking_router
+from parking.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/v1/parking/", include(parking_router.urls)),
+    path("api/v1/async/parking/", include("parking.urls")),
+    path("api/v1/edge/parking/", include(edge_router.urls)),
+    path("api/v1/lots/<slug:lot>/parking/", include(lot_router.urls)),
+    path("metrics", metrics),
 ]